@@ -0,0 +1,64 @@
+"""Unique score identity index
+
+Revision ID: k7l8m9n0p1q2
+Revises: j6k7l8m9n0p1
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'k7l8m9n0p1q2'
+down_revision = 'j6k7l8m9n0p1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """
+    One score row per student / subject / semester / academic year / subject group:
+    - remove duplicates, keeping the most recently updated row (then the highest id)
+    - add a unique index; NULL subject_id / subject_group_id are folded to 0 so that
+      they compare equal (works on PostgreSQL < 15 without NULLS NOT DISTINCT)
+    """
+
+    # Step 1: Drop duplicate rows
+    op.execute("""
+        DELETE FROM scores s
+        USING (
+            SELECT id,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY student_id,
+                                    COALESCE(subject_id, 0),
+                                    semester,
+                                    academic_year,
+                                    COALESCE(subject_group_id, 0)
+                       ORDER BY updated_at DESC NULLS LAST, id DESC
+                   ) AS rn
+            FROM scores
+        ) d
+        WHERE s.id = d.id
+          AND d.rn > 1
+    """)
+
+    # Step 2: Unique identity index (also the ON CONFLICT target for score upserts)
+    op.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_scores_identity
+        ON scores (
+            student_id,
+            COALESCE(subject_id, 0),
+            semester,
+            academic_year,
+            COALESCE(subject_group_id, 0)
+        )
+    """)
+
+    print("✅ Deduplicated scores and added uq_scores_identity")
+
+
+def downgrade() -> None:
+    """
+    Drop the unique index; removed duplicates are not restored
+    """
+    op.execute("DROP INDEX IF EXISTS uq_scores_identity")
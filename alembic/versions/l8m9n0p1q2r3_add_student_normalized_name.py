@@ -0,0 +1,49 @@
+"""Add students.normalized_name
+
+Revision ID: l8m9n0p1q2r3
+Revises: k7l8m9n0p1q2
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from key_utils import student_name_key
+
+
+# revision identifiers, used by Alembic.
+revision = 'l8m9n0p1q2r3'
+down_revision = 'k7l8m9n0p1q2'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    """
+    Stored name matching key for students:
+    - add normalized_name (key_utils.student_name_key(name))
+    - backfill it in Python, so it is byte-identical to what the application writes
+      (PostgreSQL lower() on Cyrillic depends on the database locale)
+    - index (grade_id, normalized_name) for import name matching
+    """
+    op.add_column('students', sa.Column('normalized_name', sa.String(length=255), nullable=True))
+
+    bind = op.get_bind()
+    students = bind.execute(sa.text("SELECT id, name FROM students")).fetchall()
+    rows = [{"id": student_id, "key": student_name_key(name)} for student_id, name in students]
+    for start in range(0, len(rows), BATCH_SIZE):
+        bind.execute(
+            sa.text("UPDATE students SET normalized_name = :key WHERE id = :id"),
+            rows[start:start + BATCH_SIZE],
+        )
+
+    op.create_index('ix_students_grade_normalized_name', 'students', ['grade_id', 'normalized_name'])
+
+    print(f"✅ Backfilled normalized_name for {len(rows)} students")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_students_grade_normalized_name', table_name='students')
+    op.drop_column('students', 'normalized_name')
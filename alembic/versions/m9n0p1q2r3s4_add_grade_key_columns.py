@@ -0,0 +1,58 @@
+"""Add grades.canonical_key, parallel_number, letter
+
+Revision ID: m9n0p1q2r3s4
+Revises: l8m9n0p1q2r3
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from key_utils import grade_key_columns
+
+
+# revision identifiers, used by Alembic.
+revision = 'm9n0p1q2r3s4'
+down_revision = 'l8m9n0p1q2r3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """
+    Stored class keys (same rules as scripts/merge_duplicate_grades.py):
+    - canonical_key: «10А», parallel_number: 10, letter: «А»
+    - backfilled in Python with key_utils.grade_key_columns, like the application writes them
+    - indexes for canonical lookups and "next parallel" / "all 11-12" queries
+    """
+    op.add_column('grades', sa.Column('canonical_key', sa.String(length=101), nullable=True))
+    op.add_column('grades', sa.Column('parallel_number', sa.Integer(), nullable=True))
+    op.add_column('grades', sa.Column('letter', sa.String(length=50), nullable=True))
+
+    bind = op.get_bind()
+    grades = bind.execute(sa.text("SELECT id, grade, parallel FROM grades")).fetchall()
+    rows = [{"id": grade_id, **grade_key_columns(grade, parallel)} for grade_id, grade, parallel in grades]
+    if rows:
+        bind.execute(
+            sa.text("""
+                UPDATE grades
+                SET canonical_key = :canonical_key,
+                    parallel_number = :parallel_number,
+                    letter = :letter
+                WHERE id = :id
+            """),
+            rows,
+        )
+
+    op.create_index('ix_grades_canonical_key', 'grades', ['canonical_key'])
+    op.create_index('ix_grades_parallel_number_letter', 'grades', ['parallel_number', 'letter'])
+
+    print(f"✅ Backfilled class keys for {len(rows)} grades")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_grades_parallel_number_letter', table_name='grades')
+    op.drop_index('ix_grades_canonical_key', table_name='grades')
+    op.drop_column('grades', 'letter')
+    op.drop_column('grades', 'parallel_number')
+    op.drop_column('grades', 'canonical_key')
@@ -0,0 +1,147 @@
+"""Add score_danger_rollup maintained by triggers on scores
+
+Revision ID: n0p1q2r3s4t5
+Revises: m9n0p1q2r3s4
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'n0p1q2r3s4t5'
+down_revision = 'm9n0p1q2r3s4'
+branch_labels = None
+depends_on = None
+
+
+_ROLLUP_KEY = "grade_id, subject_id, subject_name, academic_year, danger_level"
+
+# Разница по строкам: {deltas} — строки с ключом сводки и score_count / delta_sum / delta_count.
+# ORDER BY: все писатели блокируют ключи сводки в одном порядке — без взаимных блокировок
+_ROLLUP_UPSERT = f"""
+        INSERT INTO score_danger_rollup AS r
+            ({_ROLLUP_KEY}, score_count, delta_sum, delta_count)
+        SELECT {_ROLLUP_KEY}, SUM(score_count), SUM(delta_sum), SUM(delta_count)
+        FROM ({{deltas}}) deltas
+        GROUP BY {_ROLLUP_KEY}
+        ORDER BY {_ROLLUP_KEY}
+        ON CONFLICT (grade_id, (COALESCE(subject_id, 0)), subject_name, academic_year, danger_level)
+        DO UPDATE SET score_count = r.score_count + EXCLUDED.score_count,
+                      delta_sum = r.delta_sum + EXCLUDED.delta_sum,
+                      delta_count = r.delta_count + EXCLUDED.delta_count;
+"""
+
+_DELTAS = f"""
+            SELECT {_ROLLUP_KEY},
+                   {{sign}}1 AS score_count,
+                   {{sign}}COALESCE(delta_percentage, 0) AS delta_sum,
+                   {{sign}}(delta_percentage IS NOT NULL)::int AS delta_count
+            FROM {{source}}"""
+
+# Опустевшие строки сводки — только среди ключей, у которых оценки убавились (по уникальному индексу)
+_ROLLUP_CLEANUP = f"""
+        DELETE FROM score_danger_rollup r
+        USING (SELECT DISTINCT {_ROLLUP_KEY} FROM {{source}}) k
+        WHERE r.grade_id = k.grade_id
+          AND COALESCE(r.subject_id, 0) = COALESCE(k.subject_id, 0)
+          AND r.subject_name = k.subject_name
+          AND r.academic_year = k.academic_year
+          AND r.danger_level = k.danger_level
+          AND r.score_count <= 0;
+"""
+
+# Строки UPDATE, у которых не менялись поля сводки, пропускаются
+_CHANGED_OLD = """(
+            SELECT o.* FROM old_scores o JOIN new_scores n ON n.id = o.id
+            WHERE (o.grade_id, o.subject_id, o.subject_name, o.academic_year, o.danger_level, o.delta_percentage)
+                  IS DISTINCT FROM
+                  (n.grade_id, n.subject_id, n.subject_name, n.academic_year, n.danger_level, n.delta_percentage)
+        ) changed"""
+_CHANGED_NEW = _CHANGED_OLD.replace("SELECT o.*", "SELECT n.*")
+
+
+def upgrade() -> None:
+    """
+    Pre-aggregated danger levels for the dashboards:
+    - one row per scores.grade_id / subject / academic_year / danger_level with score count
+      and sum/count of delta_percentage
+    - statement-level triggers with transition tables apply the difference of every INSERT,
+      UPDATE (incl. ON CONFLICT DO UPDATE) and DELETE on scores (incl. cascades) in the same transaction
+    - backfilled from the existing scores
+    """
+    op.create_table(
+        'score_danger_rollup',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('grade_id', sa.Integer(), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('subject_name', sa.String(length=100), nullable=False),
+        sa.Column('academic_year', sa.String(length=10), nullable=False),
+        sa.Column('danger_level', sa.Integer(), nullable=False),
+        sa.Column('score_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('delta_sum', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('delta_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.create_index('ix_score_danger_rollup_id', 'score_danger_rollup', ['id'])
+    op.execute("""
+        CREATE UNIQUE INDEX uq_score_danger_rollup_key
+        ON score_danger_rollup (grade_id, COALESCE(subject_id, 0), subject_name, academic_year, danger_level)
+    """)
+
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION score_danger_rollup_apply() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {_ROLLUP_UPSERT.format(deltas=_DELTAS.format(sign='', source='new_scores'))}
+            ELSIF TG_OP = 'DELETE' THEN
+                {_ROLLUP_UPSERT.format(deltas=_DELTAS.format(sign='-', source='old_scores'))}
+                {_ROLLUP_CLEANUP.format(source='old_scores')}
+            ELSE
+                -- Старые и новые значения — одним INSERT: один упорядоченный проход по ключам
+                {_ROLLUP_UPSERT.format(deltas=_DELTAS.format(sign='-', source=_CHANGED_OLD)
+                                       + " UNION ALL " + _DELTAS.format(sign='', source=_CHANGED_NEW))}
+                {_ROLLUP_CLEANUP.format(source=_CHANGED_OLD)}
+            END IF;
+            RETURN NULL;
+        END;
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER scores_danger_rollup_insert
+        AFTER INSERT ON scores
+        REFERENCING NEW TABLE AS new_scores
+        FOR EACH STATEMENT EXECUTE PROCEDURE score_danger_rollup_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER scores_danger_rollup_update
+        AFTER UPDATE ON scores
+        REFERENCING OLD TABLE AS old_scores NEW TABLE AS new_scores
+        FOR EACH STATEMENT EXECUTE PROCEDURE score_danger_rollup_apply()
+    """)
+    op.execute("""
+        CREATE TRIGGER scores_danger_rollup_delete
+        AFTER DELETE ON scores
+        REFERENCING OLD TABLE AS old_scores
+        FOR EACH STATEMENT EXECUTE PROCEDURE score_danger_rollup_apply()
+    """)
+
+    op.execute("""
+        INSERT INTO score_danger_rollup
+            (grade_id, subject_id, subject_name, academic_year, danger_level, score_count, delta_sum, delta_count)
+        SELECT grade_id, subject_id, subject_name, academic_year, danger_level,
+               COUNT(*), COALESCE(SUM(delta_percentage), 0), COUNT(delta_percentage)
+        FROM scores
+        GROUP BY grade_id, subject_id, subject_name, academic_year, danger_level
+    """)
+
+    print("✅ Created score_danger_rollup with triggers on scores")
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS scores_danger_rollup_delete ON scores")
+    op.execute("DROP TRIGGER IF EXISTS scores_danger_rollup_update ON scores")
+    op.execute("DROP TRIGGER IF EXISTS scores_danger_rollup_insert ON scores")
+    op.execute("DROP FUNCTION IF EXISTS score_danger_rollup_apply()")
+    op.drop_table('score_danger_rollup')
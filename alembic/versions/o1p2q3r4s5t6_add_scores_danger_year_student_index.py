@@ -0,0 +1,28 @@
+"""Add composite index scores(danger_level, academic_year, student_id)
+
+Revision ID: o1p2q3r4s5t6
+Revises: n0p1q2r3s4t5
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'o1p2q3r4s5t6'
+down_revision = 'n0p1q2r3s4t5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Index for /grades/get_students_danger: filter by danger_level (and year), join to students."""
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_scores_danger_year_student
+        ON scores (danger_level, academic_year, student_id)
+    """)
+    print("✅ Created ix_scores_danger_year_student")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_scores_danger_year_student")
@@ -0,0 +1,99 @@
+"""Add data_versions counters bumped at commit by triggers
+
+Revision ID: q3r4s5t6u7v8
+Revises: p2q3r4s5t6u7
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'q3r4s5t6u7v8'
+down_revision = 'p2q3r4s5t6u7'
+branch_labels = None
+depends_on = None
+
+
+# Таблицы, из которых строятся аналитика, списки и справочники (response_cache._DATA_TABLES)
+_TRACKED_TABLES = (
+    'scores',
+    'students',
+    'grades',
+    'subgroups',
+    'subjects',
+    'subject_groups',
+    'student_subject_group_memberships',
+    'curator_grades',
+    'teacher_assignments',
+    'users',
+)
+
+
+def upgrade() -> None:
+    """
+    Версии данных для ETag и кэша ответов (etag_utils, response_cache):
+    - одна строка на таблицу, version увеличивается на 1 за каждую транзакцию, изменившую таблицу
+    - увеличение — в отложенном (DEFERRABLE INITIALLY DEFERRED) триггере, т.е. при commit: блокировка
+      строки версии держится мгновенье, а версии идут в порядке commit (updated_at этого не даёт)
+    - WHEN data_version_first_change(...) ставит в очередь одно событие на таблицу за транзакцию
+      (флаг — SET LOCAL, при откате savepoint откатывается вместе с событием)
+    """
+    op.create_table(
+        'data_versions',
+        sa.Column('table_name', sa.String(length=64), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    op.execute(
+        "INSERT INTO data_versions (table_name, version) VALUES "
+        + ", ".join(f"('{table}', 0)" for table in _TRACKED_TABLES)
+    )
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION data_version_first_change(tbl text) RETURNS boolean
+        LANGUAGE plpgsql VOLATILE AS $$
+        BEGIN
+            IF current_setting('data_version.changed_' || tbl, true) = '1' THEN
+                RETURN false;
+            END IF;
+            PERFORM set_config('data_version.changed_' || tbl, '1', true);
+            RETURN true;
+        END;
+        $$
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION data_version_bump() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$
+    """)
+
+    for table in _TRACKED_TABLES:
+        op.execute(f"""
+            CREATE CONSTRAINT TRIGGER {table}_data_version
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW
+            WHEN (data_version_first_change('{table}'))
+            EXECUTE PROCEDURE data_version_bump()
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table}_data_version_truncate
+            AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE data_version_bump()
+        """)
+
+    print("✅ Created data_versions with commit-time triggers")
+
+
+def downgrade() -> None:
+    for table in reversed(_TRACKED_TABLES):
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_data_version_truncate ON {table}")
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_data_version ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS data_version_bump()")
+    op.execute("DROP FUNCTION IF EXISTS data_version_first_change(text)")
+    op.drop_table('data_versions')
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from config import init_db, get_db, reset_db
+from config import THREADPOOL_SIZE, init_db, get_db, reset_db
 from routes.auth import router as auth_router
 from routes.grades import router as grades_router
 from routes.dashboard import router as dashboard_router
@@ -13,13 +13,17 @@ from routes.assignments import router as assignments_router
 from routes.curators import router as curators_router
 from routes.discipline import router as discipline_router
 from routes.achievements import router as achievements_router
+from routes.import_jobs import router as import_jobs_router
 import os
 import sys
 import subprocess
+import anyio
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from auth_utils import hash_password
+from services.process_pool import shutdown_process_pool, warm_process_pool
+from services.import_jobs import resume_import_jobs, shutdown_import_jobs
 from schemas.models import UserInDB
 
 load_dotenv()
@@ -36,6 +40,39 @@ app.add_middleware(
 
 init_db()
 
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """Sync handlers (DB, pandas, bcrypt) run in anyio's threadpool; bound its size."""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = THREADPOOL_SIZE
+
+
+@app.on_event("startup")
+def start_process_pool():
+    """Excel parsing and templates run in a process pool; start its workers in the background."""
+    warm_process_pool()
+
+
+@app.on_event("shutdown")
+def stop_process_pool():
+    shutdown_process_pool()
+
+
+@app.on_event("startup")
+def start_import_jobs():
+    """Background imports persist in import_jobs: pick up queued and interrupted jobs."""
+    try:
+        resume_import_jobs()
+    except Exception as e:
+        print(f"Failed to resume import jobs: {e}")
+
+
+@app.on_event("shutdown")
+def stop_import_jobs():
+    shutdown_import_jobs()
+
+
 # Ensure default admin account exists so the operator can log in
 def ensure_default_admin():
     try:
@@ -83,6 +120,7 @@ app.include_router(assignments_router, prefix="/assignments", tags=["Teacher Ass
 app.include_router(curators_router, prefix="/curators", tags=["Curators"])
 app.include_router(discipline_router, prefix="/discipline", tags=["Discipline"])
 app.include_router(achievements_router, prefix="/achievements", tags=["Achievements"])
+app.include_router(import_jobs_router, prefix="/import-jobs", tags=["Import Jobs"])
 
 # Import settings router
 from routes.settings import router as settings_router
@@ -10,7 +10,23 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL")
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL or POSTGRES_URL environment variable not set")
     
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Threads that may hold a DB connection at the same time
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))  # sync route handlers (app.py)
+PARALLEL_QUERY_WORKERS = int(os.getenv("PARALLEL_QUERY_WORKERS", "6"))  # services/parallel_queries.py
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", "2"))  # services/import_jobs.py
+# A running import job holds up to three sessions (import, progress, heartbeat); +1 for the job monitor
+DB_CONNECTIONS_NEEDED = THREADPOOL_SIZE + PARALLEL_QUERY_WORKERS + 3 * IMPORT_JOB_WORKERS + 1
+
+# pool_size connections are kept open, overflow covers the rest: by default
+# pool_size + max_overflow == DB_CONNECTIONS_NEEDED, so no thread waits for a connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(0, DB_CONNECTIONS_NEEDED - DB_POOL_SIZE))))
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_db():
@@ -0,0 +1,96 @@
+"""
+Strong ETags and conditional GET for read-heavy endpoints.
+
+The ETag is a hash of the request (path + query), the caller's access scope and the data versions
+of the tables the response is built from (data_versions: bumped by triggers in commit order, read by
+primary key). It is derived from the database, so all workers agree on it, and a body is never older
+than the versions in its ETag: cached_response keys on the same versions, read after these.
+When If-None-Match matches, the dependency answers 304 before the endpoint builds its payload.
+"""
+
+import hashlib
+from typing import Callable, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+
+from config import get_db
+from response_cache import data_version
+from role_utils import AccessScope
+from routes.auth import get_access_scope
+from schemas.models import (
+    GradeInDB,
+    ScoresInDB,
+    StudentInDB,
+    StudentSubjectGroupMembershipInDB,
+    SubjectGroupInDB,
+    SubjectInDB,
+    TeacherAssignmentInDB,
+    UserInDB,
+)
+
+# Tables behind class analytics, rosters and dashboards
+ANALYTICS_MODELS = (
+    ScoresInDB,
+    StudentInDB,
+    GradeInDB,
+    SubjectInDB,
+    SubjectGroupInDB,
+    StudentSubjectGroupMembershipInDB,
+)
+# /grades/all: student counts, curators, subject-group anchors for teachers
+GRADE_LIST_MODELS = (GradeInDB, StudentInDB, UserInDB, TeacherAssignmentInDB, SubjectGroupInDB)
+SUBJECT_MODELS = (SubjectInDB,)
+
+
+def tables_fingerprint(db: Session, models: Tuple[type, ...]) -> tuple:
+    """Data versions of the models' tables."""
+    return data_version(db, (model.__tablename__ for model in models))
+
+
+def _canonical_scope(scope: AccessScope, per_user: bool) -> tuple:
+    # Sorted, not frozensets: the ETag must not depend on a process's set iteration order
+    def ids(values: Optional[frozenset]):
+        return None if values is None else tuple(sorted(values))
+
+    parts = (scope.user_type, ids(scope.grade_ids), ids(scope.subject_ids), ids(scope.subject_group_ids))
+    if per_user:
+        parts += (scope.user_data.get("sub"),)
+    return parts
+
+
+def compute_etag(*parts) -> str:
+    return '"' + hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:40] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(value.removeprefix("W/") == etag for value in candidates)
+
+
+def conditional_get(models: Tuple[type, ...], per_user: bool = False) -> Callable:
+    """
+    Route dependency: `@router.get(..., dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])`.
+    Sets ETag on the response or raises 304 when the client already has this version.
+    """
+    def dependency(
+        request: Request,
+        response: Response,
+        scope: AccessScope = Depends(get_access_scope),
+        db: Session = Depends(get_db),
+    ) -> None:
+        etag = compute_etag(
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            _canonical_scope(scope, per_user),
+            tables_fingerprint(db, models),
+        )
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+    return dependency
@@ -0,0 +1,66 @@
+"""
+Normalization of natural keys used for matching.
+The same functions fill the stored key columns and build lookup values, so both sides always agree.
+"""
+
+import re
+from typing import Optional, Tuple
+
+
+def normalize_student_name(value: object) -> str:
+    """Trimmed name with internal whitespace collapsed; "" for empty/NaN."""
+    if value is None:
+        return ""
+
+    text = str(value).strip()
+    if not text or text.lower() == "nan":
+        return ""
+    return " ".join(text.split())
+
+
+def student_name_key(value: object) -> Optional[str]:
+    """Value of students.normalized_name: normalized and lower-cased, None for empty names."""
+    return normalize_student_name(value).lower() or None
+
+
+_GRADE_LETTERS = "A-Za-zА-Яа-яЁёІіҢңҒғҚқӨөҰұҮүҺһ"
+_COMPACT_GRADE_RE = re.compile(rf"^(\d{{1,2}})([{_GRADE_LETTERS}]?)$")
+_GRADE_NUMBER_RE = re.compile(r"^(\d{1,2})")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_grade_key(grade_text: object, parallel_text: object) -> Tuple[str, str, str]:
+    """
+    (canonical, number, letter) of a class: «10 А» / «10» + «а» → ("10А", "10", "А").
+    Same rules as scripts/merge_duplicate_grades.py.
+    """
+    grade_raw = str(grade_text or "").strip()
+    parallel_raw = str(parallel_text or "").strip().upper()
+
+    compact_grade = _WHITESPACE_RE.sub("", grade_raw)
+    match = _COMPACT_GRADE_RE.match(compact_grade)
+    if match:
+        num = match.group(1)
+        letter = (match.group(2) or parallel_raw).upper()
+        canonical = f"{num}{letter}" if letter else num
+        return canonical, num, letter
+
+    num_match = _GRADE_NUMBER_RE.match(grade_raw)
+    if num_match:
+        num = num_match.group(1)
+        letter = parallel_raw
+        canonical = f"{num}{letter}" if letter else num
+        return canonical, num, letter
+
+    fallback = f"{grade_raw} {parallel_raw}".strip()
+    return fallback, grade_raw, parallel_raw
+
+
+def grade_key_columns(grade_text: object, parallel_text: object) -> dict:
+    """Values of grades.canonical_key / parallel_number / letter."""
+    canonical, num, letter = normalize_grade_key(grade_text, parallel_text)
+    return {
+        "canonical_key": canonical,
+        "parallel_number": int(num) if num.isdigit() else None,
+        "letter": letter,
+    }
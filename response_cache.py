@@ -0,0 +1,140 @@
+"""
+Response cache for read-heavy analytics endpoints.
+
+Responses are keyed by (endpoint, query params, access-scope fingerprint, data version).
+The data version comes from the data_versions table: triggers bump a table's counter when a
+transaction that changed it commits, so every worker sees a write by any worker on its next
+request. The TTL only bounds memory use. Where the triggers are not installed (no migration,
+SQLite) a process-local version bumped after this process's own commits is used instead.
+"""
+
+import functools
+import os
+import threading
+from typing import Callable, Hashable, Iterable, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache
+from config import SessionLocal
+from role_utils import AccessScope
+from schemas.models import DataVersionInDB
+
+_response_cache = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "60")),
+)
+_data_version = 0
+_data_version_lock = threading.Lock()
+
+# Writes to these tables change dashboard / class analytics responses
+_DATA_TABLES = frozenset({
+    "scores",
+    "students",
+    "grades",
+    "subgroups",
+    "subjects",
+    "subject_groups",
+    "student_subject_group_memberships",
+    "curator_grades",
+    "teacher_assignments",
+    "users",
+})
+_DIRTY_KEY = "analytics_data_dirty"
+
+
+def bump_data_version() -> None:
+    """Invalidate cached responses. Called automatically after commits touching _DATA_TABLES."""
+    global _data_version
+    with _data_version_lock:
+        _data_version += 1
+
+
+def data_version(db: Session, tables: Iterable[str]) -> Tuple[Hashable, ...]:
+    """
+    Versions of the given tables from data_versions (one primary-key lookup). Tables without a
+    counter row fall back to the process-local version.
+    """
+    tables = sorted(set(tables))
+    rows = dict(
+        db.query(DataVersionInDB.table_name, DataVersionInDB.version)
+        .filter(DataVersionInDB.table_name.in_(tables))
+        .all()
+    )
+    version: Tuple[Hashable, ...] = tuple((table, rows[table]) for table in tables if table in rows)
+    if len(rows) < len(tables):
+        version += (("local", _data_version),)
+    return version
+
+
+def response_cache_stats() -> dict:
+    return {**_response_cache.stats(), "data_version": _data_version}
+
+
+def scope_fingerprint(scope: AccessScope, per_user: bool = False) -> Tuple[Hashable, ...]:
+    """Users with the same role and the same resolved grades/subjects/groups get the same responses."""
+    fingerprint = (scope.user_type, scope.grade_ids, scope.subject_ids, scope.subject_group_ids)
+    if per_user:
+        fingerprint += (scope.user_data.get("sub"),)
+    return fingerprint
+
+
+def cached_response(endpoint: str, per_user: bool = False) -> Callable:
+    """
+    Cache the return value of a sync route that takes `scope: AccessScope` and `db: Session`.
+    Every other keyword argument (query/path params) is part of the key. Errors are not cached.
+    per_user — the response also depends on the user, not only on the resolved scope.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            scope = kwargs["scope"]
+            params = tuple(sorted((name, value) for name, value in kwargs.items() if name not in ("scope", "db")))
+            key = (endpoint, params, scope_fingerprint(scope, per_user), data_version(kwargs["db"], _DATA_TABLES))
+            cached = _response_cache.get(key)
+            if cached is not None:
+                return cached
+            result = func(*args, **kwargs)
+            # Stored under the version read before building: the body is at least that recent
+            _response_cache.set(key, result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _statement_tables(statement) -> frozenset:
+    table = getattr(statement, "table", None)
+    name = getattr(table, "name", None)
+    return frozenset({name}) if name else frozenset()
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _track_bulk_writes(orm_execute_state) -> None:
+    if orm_execute_state.is_select:
+        return
+    tables = _statement_tables(orm_execute_state.statement)
+    # Textual statements: the table is unknown, assume the data changed
+    if not tables or tables & _DATA_TABLES:
+        orm_execute_state.session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _track_flushed_writes(session: Session, flush_context) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if getattr(obj, "__tablename__", None) in _DATA_TABLES:
+            session.info[_DIRTY_KEY] = True
+            return
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _bump_on_commit(session: Session) -> None:
+    if session.info.pop(_DIRTY_KEY, False):
+        bump_data_version()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _reset_on_rollback(session: Session) -> None:
+    session.info.pop(_DIRTY_KEY, None)
@@ -3,6 +3,10 @@ Role-based access control utilities.
 Helper functions to determine which grades/subjects a user can access based on their role.
 """
 
+import os
+import threading
+from dataclasses import dataclass
+from sqlalchemy import and_, or_, select, union
 from sqlalchemy.orm import Session
 from schemas.models import (
     UserInDB,
@@ -14,7 +18,17 @@ from schemas.models import (
     StudentInDB,
     SubjectInDB,
 )
-from typing import List, Optional, Set
+from typing import FrozenSet, List, Optional, Set, Tuple
+from cache_utils import TTLCache
+
+# Resolved scopes are cached per process, keyed by the token identity (email + role)
+# and a scope version that writes to assignments / curators / subject groups bump.
+_scope_cache = TTLCache(
+    maxsize=int(os.getenv("ACL_CACHE_MAX_ENTRIES", "2048")),
+    ttl=float(os.getenv("ACL_CACHE_TTL_SECONDS", "300")),
+)
+_scope_version = 0
+_scope_version_lock = threading.Lock()
 
 
 def get_user_from_token(user_data: dict, db: Session) -> Optional[UserInDB]:
@@ -25,6 +39,158 @@ def get_user_from_token(user_data: dict, db: Session) -> Optional[UserInDB]:
     return db.query(UserInDB).filter(UserInDB.email == user_email).first()
 
 
+@dataclass(frozen=True)
+class AccessScope:
+    """
+    Resolved access rights of the current user.
+
+    grade_ids / subject_ids / subject_group_ids follow the role_utils convention:
+    None means no restriction, an empty set means no access.
+    """
+
+    user_data: dict
+    user_id: Optional[int]
+    grade_ids: Optional[FrozenSet[int]]
+    subject_ids: Optional[FrozenSet[int]]
+    subject_group_ids: Optional[FrozenSet[int]]
+
+    @property
+    def user_type(self) -> Optional[str]:
+        return self.user_data.get("type")
+
+    def can_access_grade(self, grade_id: Optional[int]) -> bool:
+        if self.grade_ids is None:
+            return True
+        return grade_id in self.grade_ids
+
+
+def _curator_grade_ids(db: Session, user_id: int) -> Set[int]:
+    """Grades via CuratorGradeInDB plus legacy GradeInDB.curator_id — one UNION query."""
+    assigned = select(CuratorGradeInDB.grade_id).where(CuratorGradeInDB.curator_id == user_id)
+    legacy = select(GradeInDB.id).where(GradeInDB.curator_id == user_id)
+    return {gid for (gid,) in db.execute(union(assigned, legacy)) if gid is not None}
+
+
+def _teacher_scope(db: Session, user_id: int) -> Tuple[Set[int], Set[int], Set[int]]:
+    """(grade_ids, subject_ids, subject_group_ids) of a teacher in three set-based queries."""
+    assignments = db.query(
+        TeacherAssignmentInDB.grade_id,
+        TeacherAssignmentInDB.subject_id,
+        TeacherAssignmentInDB.subject_group_id,
+    ).filter(
+        TeacherAssignmentInDB.teacher_id == user_id,
+        TeacherAssignmentInDB.is_active == 1,
+    ).all()
+
+    grade_ids: Set[int] = set()
+    subject_ids: Set[int] = set()
+    assigned_group_ids: Set[int] = set()
+    for grade_id, subject_id, subject_group_id in assignments:
+        if grade_id:
+            grade_ids.add(grade_id)
+        if subject_id:
+            subject_ids.add(subject_id)
+        if subject_group_id:
+            assigned_group_ids.add(subject_group_id)
+
+    # Assigned groups (any state) and teacher-owned active groups (created via /subject-groups/teacher);
+    # grade-anchored groups also surface their class.
+    group_filter = and_(
+        SubjectGroupInDB.owner_teacher_id == user_id,
+        SubjectGroupInDB.is_active == 1,
+    )
+    if assigned_group_ids:
+        group_filter = or_(group_filter, SubjectGroupInDB.id.in_(assigned_group_ids))
+    group_ids: Set[int] = set(assigned_group_ids)
+    for gid, grade_id in db.query(SubjectGroupInDB.id, SubjectGroupInDB.grade_id).filter(group_filter):
+        group_ids.add(gid)
+        if grade_id:
+            grade_ids.add(grade_id)
+
+    # For classless (cross-class) groups: add the home grade of every member
+    # so analytics queries that filter by grade_id still surface these students.
+    if group_ids:
+        rows = (
+            db.query(StudentInDB.grade_id)
+            .join(
+                StudentSubjectGroupMembershipInDB,
+                StudentSubjectGroupMembershipInDB.student_id == StudentInDB.id,
+            )
+            .filter(
+                StudentSubjectGroupMembershipInDB.subject_group_id.in_(group_ids),
+                StudentSubjectGroupMembershipInDB.is_active == 1,
+                StudentInDB.is_active == 1,
+            )
+            .distinct()
+        )
+        for (gid,) in rows:
+            if gid is not None:
+                grade_ids.add(gid)
+
+    return grade_ids, subject_ids, group_ids
+
+
+def bump_access_scope_version() -> None:
+    """
+    Invalidate cached scopes. Call after committing changes to teacher assignments,
+    curator grades, subject groups (owner, members) or users.
+    """
+    global _scope_version
+    with _scope_version_lock:
+        _scope_version += 1
+
+
+def access_scope_cache_stats() -> dict:
+    return {**_scope_cache.stats(), "version": _scope_version}
+
+
+def resolve_access_scope(user_data: dict, db: Session) -> AccessScope:
+    """Cached resolve_access_scope: a warm request runs no ACL queries."""
+    key = (user_data.get("sub"), user_data.get("type"), _scope_version)
+    cached = _scope_cache.get(key)
+    if cached is None:
+        scope = _resolve_access_scope(user_data, db)
+        # Stored under the version read before resolving: a concurrent bump makes it unreachable.
+        _scope_cache.set(key, (scope.user_id, scope.grade_ids, scope.subject_ids, scope.subject_group_ids))
+        return scope
+    return AccessScope(user_data, *cached)
+
+
+def _resolve_access_scope(user_data: dict, db: Session) -> AccessScope:
+    """
+    Resolve grade/subject/subject-group access for the token payload.
+
+    - admin: no restrictions
+    - curator: own grades, all subjects and groups within them
+    - teacher: assigned grades/subjects, assigned and owned groups (+ members' home grades)
+    - unknown user or role: no access
+    """
+    user_type = user_data.get("type")
+    user_id = None
+    user_email = user_data.get("sub")
+    if user_email:
+        user_id = db.query(UserInDB.id).filter(UserInDB.email == user_email).scalar()
+
+    if user_type == "admin":
+        return AccessScope(user_data, user_id, None, None, None)
+
+    if user_id is None:
+        empty = frozenset()
+        if user_type == "curator":
+            return AccessScope(user_data, None, empty, None, None)
+        return AccessScope(user_data, None, empty, empty, empty)
+
+    if user_type == "curator":
+        return AccessScope(user_data, user_id, frozenset(_curator_grade_ids(db, user_id)), None, None)
+
+    if user_type == "teacher":
+        grade_ids, subject_ids, group_ids = _teacher_scope(db, user_id)
+        return AccessScope(user_data, user_id, frozenset(grade_ids), frozenset(subject_ids), frozenset(group_ids))
+
+    empty = frozenset()
+    return AccessScope(user_data, user_id, empty, empty, empty)
+
+
 def get_user_allowed_grade_ids(user_data: dict, db: Session) -> Optional[Set[int]]:
     """
     Get the set of grade IDs that a user is allowed to access.
@@ -34,84 +200,8 @@ def get_user_allowed_grade_ids(user_data: dict, db: Session) -> Optional[Set[int
         - Set of grade IDs for curator/teacher
         - Empty set if no assignments found
     """
-    user_type = user_data.get("type")
-    
-    # Admins can access everything
-    if user_type == "admin":
-        return None
-    
-    user = get_user_from_token(user_data, db)
-    if not user:
-        return set()
-    
-    allowed_grades: Set[int] = set()
-    
-    if user_type == "curator":
-        # Get grades assigned to this curator via CuratorGradeInDB
-        curator_assignments = db.query(CuratorGradeInDB).filter(
-            CuratorGradeInDB.curator_id == user.id
-        ).all()
-        for assignment in curator_assignments:
-            allowed_grades.add(assignment.grade_id)
-        
-        # Also check GradeInDB.curator_id (legacy assignment)
-        legacy_grades = db.query(GradeInDB).filter(
-            GradeInDB.curator_id == user.id
-        ).all()
-        for grade in legacy_grades:
-            allowed_grades.add(grade.id)
-    
-    elif user_type == "teacher":
-        # Grades assigned to this teacher via TeacherAssignmentInDB
-        teacher_assignments = db.query(TeacherAssignmentInDB).filter(
-            TeacherAssignmentInDB.teacher_id == user.id,
-            TeacherAssignmentInDB.is_active == 1
-        ).all()
-        teacher_subject_group_ids: Set[int] = set()
-        for assignment in teacher_assignments:
-            if assignment.grade_id:
-                allowed_grades.add(assignment.grade_id)
-            if assignment.subject_group_id:
-                teacher_subject_group_ids.add(assignment.subject_group_id)
-                # For grade-anchored groups, also surface that class
-                subject_group = db.query(SubjectGroupInDB).filter(
-                    SubjectGroupInDB.id == assignment.subject_group_id
-                ).first()
-                if subject_group and subject_group.grade_id:
-                    allowed_grades.add(subject_group.grade_id)
-
-        # Teacher-owned subject groups (created via /subject-groups/teacher)
-        owned_groups = db.query(SubjectGroupInDB).filter(
-            SubjectGroupInDB.owner_teacher_id == user.id,
-            SubjectGroupInDB.is_active == 1,
-        ).all()
-        for g in owned_groups:
-            teacher_subject_group_ids.add(g.id)
-            if g.grade_id:
-                allowed_grades.add(g.grade_id)
-
-        # For classless (cross-class) groups: add the home grade of every member
-        # so analytics queries that filter by grade_id still surface these students.
-        if teacher_subject_group_ids:
-            rows = (
-                db.query(StudentInDB.grade_id)
-                .join(
-                    StudentSubjectGroupMembershipInDB,
-                    StudentSubjectGroupMembershipInDB.student_id == StudentInDB.id,
-                )
-                .filter(
-                    StudentSubjectGroupMembershipInDB.subject_group_id.in_(teacher_subject_group_ids),
-                    StudentSubjectGroupMembershipInDB.is_active == 1,
-                    StudentInDB.is_active == 1,
-                )
-                .distinct()
-                .all()
-            )
-            for (gid,) in rows:
-                if gid is not None:
-                    allowed_grades.add(gid)
-
-    return allowed_grades
+    grade_ids = resolve_access_scope(user_data, db).grade_ids
+    return None if grade_ids is None else set(grade_ids)
 
 
 def get_user_allowed_subject_ids(user_data: dict, db: Session) -> Optional[Set[int]]:
@@ -123,28 +213,8 @@ def get_user_allowed_subject_ids(user_data: dict, db: Session) -> Optional[Set[i
         - Set of subject IDs for teacher
         - Empty set if no assignments found
     """
-    user_type = user_data.get("type")
-    
-    # Admins and curators can see all subjects within their allowed grades
-    if user_type in ("admin", "curator"):
-        return None
-    
-    user = get_user_from_token(user_data, db)
-    if not user:
-        return set()
-    
-    allowed_subjects: Set[int] = set()
-    
-    if user_type == "teacher":
-        teacher_assignments = db.query(TeacherAssignmentInDB).filter(
-            TeacherAssignmentInDB.teacher_id == user.id,
-            TeacherAssignmentInDB.is_active == 1
-        ).all()
-        for assignment in teacher_assignments:
-            if assignment.subject_id:
-                allowed_subjects.add(assignment.subject_id)
-    
-    return allowed_subjects
+    subject_ids = resolve_access_scope(user_data, db).subject_ids
+    return None if subject_ids is None else set(subject_ids)
 
 
 def get_user_allowed_subject_group_ids(user_data: dict, db: Session) -> Optional[Set[int]]:
@@ -156,36 +226,8 @@ def get_user_allowed_subject_group_ids(user_data: dict, db: Session) -> Optional
         - Set of group IDs for teacher: groups they own + groups they're assigned to
         - Empty set if the teacher has no groups
     """
-    user_type = user_data.get("type")
-
-    if user_type in ("admin", "curator"):
-        return None
-
-    user = get_user_from_token(user_data, db)
-    if not user:
-        return set()
-
-    group_ids: Set[int] = set()
-
-    if user_type == "teacher":
-        owned_rows = db.query(SubjectGroupInDB.id).filter(
-            SubjectGroupInDB.owner_teacher_id == user.id,
-            SubjectGroupInDB.is_active == 1,
-        ).all()
-        for (gid,) in owned_rows:
-            if gid is not None:
-                group_ids.add(gid)
-
-        assigned_rows = db.query(TeacherAssignmentInDB.subject_group_id).filter(
-            TeacherAssignmentInDB.teacher_id == user.id,
-            TeacherAssignmentInDB.is_active == 1,
-            TeacherAssignmentInDB.subject_group_id.isnot(None),
-        ).all()
-        for (gid,) in assigned_rows:
-            if gid is not None:
-                group_ids.add(gid)
-
-    return group_ids
+    group_ids = resolve_access_scope(user_data, db).subject_group_ids
+    return None if group_ids is None else set(group_ids)
 
 
 def check_grade_access(user_data: dict, grade_id: int, db: Session) -> bool:
@@ -194,13 +236,7 @@ def check_grade_access(user_data: dict, grade_id: int, db: Session) -> bool:
     
     Returns True if access is allowed, False otherwise.
     """
-    allowed_grades = get_user_allowed_grade_ids(user_data, db)
-    
-    # None means admin - full access
-    if allowed_grades is None:
-        return True
-    
-    return grade_id in allowed_grades
+    return resolve_access_scope(user_data, db).can_access_grade(grade_id)
 
 
 def filter_grades_by_access(user_data: dict, grades: List[GradeInDB], db: Session) -> List[GradeInDB]:
@@ -3,28 +3,24 @@ from sqlalchemy.orm import Session
 from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
-from routes.auth import oauth2_scheme
-from role_utils import get_user_allowed_grade_ids, check_grade_access
+from routes.auth import oauth2_scheme, get_access_scope
+from role_utils import AccessScope
 from typing import List, Optional
 from datetime import datetime
 
 router = APIRouter()
 
 @router.get("/", response_model=List[AchievementResponse])
-async def get_achievements(
+def get_achievements(
     student_id: Optional[int] = Query(None),
     category: Optional[str] = Query(None),
     limit: Optional[int] = Query(100),
     offset: Optional[int] = Query(0),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get achievements with optional filters"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
 
     query = db.query(AchievementInDB)
 
@@ -74,15 +70,13 @@ async def get_achievements(
     return result
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_achievement(
+def create_achievement(
     achievement: CreateAchievement,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Create a new achievement"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_data = scope.user_data
     
     # Check if the user is an admin, teacher, or curator
     if user_data.get("type") not in ["admin", "teacher", "curator"]:
@@ -100,7 +94,7 @@ async def create_achievement(
         raise HTTPException(status_code=404, detail="Student not found")
 
     # Non-admins can only act on students in grades they have access to.
-    if not check_grade_access(user_data, student.grade_id, db):
+    if not scope.can_access_grade(student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     # Validate points (non-negative)
@@ -116,7 +110,7 @@ async def create_achievement(
         description=achievement.description,
         category=achievement.category,
         achievement_date=achievement.achievement_date or datetime.utcnow(),
-        awarded_by=user_data.get("id"),
+        awarded_by=scope.user_id,
         points=achievement.points,
         certificate_url=achievement.certificate_url
     )
@@ -128,16 +122,14 @@ async def create_achievement(
     return {"id": db_achievement.id, "message": "Achievement created successfully"}
 
 @router.put("/{achievement_id}", status_code=status.HTTP_200_OK)
-async def update_achievement(
+def update_achievement(
     achievement_id: int,
     update_data: UpdateAchievement,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Update an achievement by ID"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_data = scope.user_data
     
     # Check if the user is an admin, teacher, or curator
     if user_data.get("type") not in ["admin", "teacher", "curator"]:
@@ -153,11 +145,11 @@ async def update_achievement(
         raise HTTPException(status_code=404, detail="Achievement not found")
 
     target_student = db.query(StudentInDB).filter(StudentInDB.id == achievement.student_id).first()
-    if target_student and not check_grade_access(user_data, target_student.grade_id, db):
+    if target_student and not scope.can_access_grade(target_student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     # Only admin or the original awarder can update
-    if user_data.get("type") != "admin" and achievement.awarded_by != user_data.get("id"):
+    if user_data.get("type") != "admin" and achievement.awarded_by != scope.user_id:
         raise HTTPException(
             status_code=403,
             detail="You can only update your own achievements"
@@ -183,7 +175,7 @@ async def update_achievement(
     return {"message": "Achievement updated successfully"}
 
 @router.delete("/{achievement_id}", status_code=status.HTTP_200_OK)
-async def delete_achievement(
+def delete_achievement(
     achievement_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -213,22 +205,18 @@ async def delete_achievement(
     return {"message": "Achievement deleted successfully"}
 
 @router.get("/student/{student_id}", response_model=List[AchievementResponse])
-async def get_student_achievements(
+def get_student_achievements(
     student_id: int,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get all achievements for a specific student"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    
     # Verify student exists
     student = db.query(StudentInDB).filter(StudentInDB.id == student_id).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    if not check_grade_access(user_data, student.grade_id, db):
+    if not scope.can_access_grade(student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     achievements = db.query(AchievementInDB).filter(
@@ -260,7 +248,7 @@ async def get_student_achievements(
     return result
 
 @router.get("/categories", response_model=List[str])
-async def get_achievement_categories(
+def get_achievement_categories(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -276,17 +264,13 @@ async def get_achievement_categories(
     return category_list
 
 @router.get("/statistics", response_model=dict)
-async def get_achievement_statistics(
+def get_achievement_statistics(
     grade_id: Optional[int] = Query(None),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get achievement statistics"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
 
     query = db.query(AchievementInDB)
     joined_students = False
@@ -5,12 +5,13 @@ from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
 from routes.auth import oauth2_scheme
+from role_utils import bump_access_scope_version
 from typing import List, Optional
 
 router = APIRouter()
 
 @router.get("/", response_model=List[TeacherAssignmentResponse])
-async def get_teacher_assignments(
+def get_teacher_assignments(
     grade_id: Optional[int] = Query(None),
     subject_id: Optional[int] = Query(None),
     teacher_id: Optional[int] = Query(None),
@@ -69,12 +70,10 @@ async def get_teacher_assignments(
 
 
 def _canonical_grade(grade: GradeInDB) -> str:
-    from routes.grades import _normalize_grade_key
-    canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-    return canonical
+    return grade.canonical_key
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_teacher_assignment(
+def create_teacher_assignment(
     assignment: CreateTeacherAssignment,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -179,12 +178,13 @@ async def create_teacher_assignment(
     
     db.add(db_assignment)
     db.commit()
+    bump_access_scope_version()
     db.refresh(db_assignment)
     
     return {"id": db_assignment.id, "message": "Teacher assignment created successfully"}
 
 @router.put("/{assignment_id}", status_code=status.HTTP_200_OK)
-async def update_teacher_assignment(
+def update_teacher_assignment(
     assignment_id: int,
     update_data: UpdateTeacherAssignment,
     token: str = Depends(oauth2_scheme),
@@ -213,12 +213,13 @@ async def update_teacher_assignment(
             setattr(assignment, key, value)
     
     db.commit()
+    bump_access_scope_version()
     db.refresh(assignment)
     
     return {"message": "Teacher assignment updated successfully"}
 
 @router.delete("/{assignment_id}", status_code=status.HTTP_200_OK)
-async def delete_teacher_assignment(
+def delete_teacher_assignment(
     assignment_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -241,11 +242,12 @@ async def delete_teacher_assignment(
     # Soft delete by setting is_active to 0
     assignment.is_active = 0
     db.commit()
+    bump_access_scope_version()
     
     return {"message": "Teacher assignment deleted successfully"}
 
 @router.get("/teachers", response_model=List[dict])
-async def get_available_teachers(
+def get_available_teachers(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -271,7 +273,7 @@ async def get_available_teachers(
     return result
 
 @router.get("/by-grade/{grade_id}", response_model=List[TeacherAssignmentResponse])
-async def get_assignments_by_grade(
+def get_assignments_by_grade(
     grade_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
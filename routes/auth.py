@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from auth_utils import hash_password, verify_password, create_access_token, verify_access_token
 from config import get_db
 from schemas.models import *
-from role_utils import compute_show_subject_groups_nav_for_user
+from role_utils import AccessScope, compute_show_subject_groups_nav_for_user, resolve_access_scope
 from datetime import timedelta
 import traceback
 import logging
@@ -17,6 +17,15 @@ router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+
+def get_access_scope(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> AccessScope:
+    """Права доступа текущего пользователя — вычисляются один раз на запрос."""
+    user_data = verify_access_token(token)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return resolve_access_scope(user_data, db)
+
+
 @router.post("/login", response_model=Token)
 def login(user: UserLogin, db: Session = Depends(get_db)):
     try:
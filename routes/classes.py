@@ -2,9 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, B
 from sqlalchemy.orm import Session
 from config import get_db
 from schemas.models import *
-from auth_utils import verify_access_token
-from routes.auth import oauth2_scheme
-from role_utils import check_grade_access, get_user_allowed_subject_ids
+from routes.auth import get_access_scope
+from role_utils import AccessScope
 import pandas as pd
 from io import BytesIO, StringIO
 from services.analyze import analyze_excel
@@ -15,23 +14,19 @@ router = APIRouter()
 @router.get("/class/{classParam}")
 def get_class_info(
     classParam: str,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
     # Query to get the class information
     class_info = db.query(GradeInDB).filter(GradeInDB.grade == classParam).first()
 
     if not class_info:
         raise HTTPException(status_code=404, detail="Class not found")
 
-    if not check_grade_access(user_data, class_info.id, db):
+    if not scope.can_access_grade(class_info.id):
         raise HTTPException(status_code=403, detail="You don't have access to this class")
 
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
+    allowed_subject_ids = scope.subject_ids
     if allowed_subject_ids is not None and not allowed_subject_ids:
         return {
             "class_name": class_info.grade,
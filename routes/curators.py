@@ -4,12 +4,13 @@ from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
 from routes.auth import oauth2_scheme
+from role_utils import bump_access_scope_version
 from typing import List
 
 router = APIRouter()
 
 @router.get("/", response_model=List[CuratorAssignmentResponse])
-async def get_curator_assignments(
+def get_curator_assignments(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -39,7 +40,7 @@ async def get_curator_assignments(
     return result
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_curator_assignment(
+def create_curator_assignment(
     assignment: CreateCuratorAssignment,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -89,12 +90,13 @@ async def create_curator_assignment(
         message = "Curator assignment created successfully"
 
     db.commit()
+    bump_access_scope_version()
     db.refresh(db_assignment)
 
     return {"id": db_assignment.id, "message": message}
 
 @router.delete("/{assignment_id}", status_code=status.HTTP_200_OK)
-async def delete_curator_assignment(
+def delete_curator_assignment(
     assignment_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -117,11 +119,12 @@ async def delete_curator_assignment(
     # Hard delete curator assignment
     db.delete(assignment)
     db.commit()
+    bump_access_scope_version()
     
     return {"message": "Curator assignment removed successfully"}
 
 @router.get("/available", response_model=List[dict])
-async def get_available_curators(
+def get_available_curators(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -153,7 +156,7 @@ async def get_available_curators(
     return result
 
 @router.get("/by-curator/{curator_id}", response_model=List[dict])
-async def get_grades_by_curator(
+def get_grades_by_curator(
     curator_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -195,7 +198,7 @@ async def get_grades_by_curator(
     return result
 
 @router.get("/by-grade/{grade_id}", response_model=dict)
-async def get_curator_by_grade(
+def get_curator_by_grade(
     grade_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -1,29 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional
+from typing import List, Optional, Set
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
-from schemas.models import ScoresInDB, StudentInDB, GradeInDB
-from auth_utils import verify_access_token
-from routes.auth import oauth2_scheme
+from sqlalchemy import and_, case, func
+from schemas.models import ScoresInDB, StudentInDB, GradeInDB, ScoreDangerRollupInDB
+from routes.auth import get_access_scope
 from config import get_db 
-from role_utils import get_user_allowed_grade_ids, get_user_allowed_subject_ids
+from role_utils import AccessScope, access_scope_cache_stats
+from response_cache import cached_response, response_cache_stats
+from etag_utils import ANALYTICS_MODELS, conditional_get
+from services.danger_rollup import (
+    filter_rollup_by_scope,
+    rollup_at_risk_count,
+    rollup_avg_danger,
+    rollup_avg_delta,
+    rollup_score_count,
+)
+from services.parallel_queries import run_queries_concurrently
+from services.reference_data import reference_data_cache_stats
 import re
 
 
 router = APIRouter()
 
-@router.get("/danger-levels")
+@router.get("/danger-levels", dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])
+@cached_response("dashboard.danger_levels")
 def get_danger_level_stats(
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
     ):
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
     # Get allowed grade IDs for the current user
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
+    allowed_subject_ids = scope.subject_ids
 
     empty_response = {
         "danger_level_stats": {
@@ -37,50 +44,62 @@ def get_danger_level_stats(
         "all_dangerous_classes": []
     }
 
-    # Build query for scores - filter by allowed grades if not admin
-    scores_query = db.query(ScoresInDB.student_id, ScoresInDB.danger_level, ScoresInDB.grade_id)
+    # Средний уровень риска каждого ученика по его оценкам (только заполненные danger_level)
+    per_student = db.query(
+        ScoresInDB.student_id.label("student_id"),
+        func.sum(ScoresInDB.danger_level).label("danger_sum"),
+        func.count(ScoresInDB.danger_level).label("danger_count"),
+    ).filter(ScoresInDB.danger_level.isnot(None))
     if allowed_grade_ids is not None:  # Not admin
         if not allowed_grade_ids:  # Empty set - no access
             return empty_response
-        scores_query = scores_query.filter(ScoresInDB.grade_id.in_(allowed_grade_ids))
+        per_student = per_student.filter(ScoresInDB.grade_id.in_(allowed_grade_ids))
     if allowed_subject_ids is not None:  # Teacher
         if not allowed_subject_ids:
             return empty_response
-        scores_query = scores_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-
-    scores_data = scores_query.all()
-
-    # Group by student
-    student_danger_sums = {}
-    student_danger_counts = {}
+        per_student = per_student.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    per_student = per_student.group_by(ScoresInDB.student_id).subquery()
+
+    # round() как в Python (половина — к чётному) в целых числах: sum / count → r = (2*sum + count) // (2*count),
+    # при точной половине нечётный r уменьшается на 1; затем ограничение 0..3
+    danger_sum = per_student.c.danger_sum
+    danger_count = per_student.c.danger_count
+    half_up = (2 * danger_sum + danger_count) // (2 * danger_count)
+    is_tie = ((2 * danger_sum + danger_count) % (2 * danger_count)) == 0
+    rounded = half_up - case((and_(is_tie, half_up % 2 == 1), 1), else_=0)
+    has_scores = danger_count.isnot(None)
+    student_level = case(
+        (~has_scores, 0),  # No scores -> Low risk (0)
+        (rounded < 0, 0),
+        (rounded > 3, 3),
+        else_=rounded,
+    )
 
-    for student_id, danger_level, grade_id in scores_data:
-        if danger_level is not None:
-            student_danger_sums[student_id] = student_danger_sums.get(student_id, 0) + danger_level
-            student_danger_counts[student_id] = student_danger_counts.get(student_id, 0) + 1
-    
-    # Get student IDs filtered by allowed grades
-    students_query = db.query(StudentInDB.id)
+    # Ученики из доступных классов; гистограмма считается в БД — несколько строк вместо всей таблицы оценок
+    student_levels = db.query(
+        student_level.label("level"),
+        has_scores.label("has_scores"),
+    ).select_from(StudentInDB).outerjoin(per_student, per_student.c.student_id == StudentInDB.id)
     if allowed_grade_ids is not None:
-        students_query = students_query.filter(StudentInDB.grade_id.in_(allowed_grade_ids))
-    all_student_ids = set(s[0] for s in students_query.all())
-    
+        student_levels = student_levels.filter(StudentInDB.grade_id.in_(allowed_grade_ids))
+    student_levels = student_levels.subquery()
+    buckets = db.query(
+        student_levels.c.level,
+        student_levels.c.has_scores,
+        func.count(),
+    ).group_by(student_levels.c.level, student_levels.c.has_scores).all()
+
     danger_counts = {0: 0, 1: 0, 2: 0, 3: 0}
+    total_students = 0
     total_danger_sum = 0
     students_with_danger = 0
 
-    for student_id in all_student_ids:
-        if student_id in student_danger_counts and student_danger_counts[student_id] > 0:
-            avg_danger = round(student_danger_sums[student_id] / student_danger_counts[student_id])
-            # Clamp to valid range 0-3 just in case
-            avg_danger = max(0, min(3, int(avg_danger)))
-            danger_counts[avg_danger] += 1
-            
-            total_danger_sum += avg_danger
-            students_with_danger += 1
-        else:
-            # No scores -> Low risk (0)
-            danger_counts[0] += 1
+    for avg_danger, with_scores, count in buckets:
+        danger_counts[int(avg_danger)] += count
+        total_students += count
+        if with_scores:
+            total_danger_sum += int(avg_danger) * count
+            students_with_danger += count
 
     # Initialize the result
     danger_level_stats = {level: {
@@ -89,10 +108,11 @@ def get_danger_level_stats(
                          } for level, count in danger_counts.items()}
     
     # Add total number of students and average danger level to the result
-    danger_level_stats["total_students"] = len(all_student_ids)
+    danger_level_stats["total_students"] = total_students
     danger_level_stats["avg_danger_level"] = round(total_danger_sum / students_with_danger, 2) if students_with_danger > 0 else 0
 
-    # Query to get all dangerous classes ordered by average danger level
+    # All dangerous classes ordered by average danger level
+    # Класс ученика — текущий (students.grade_id): после перевода оценки прошлого года идут в новый класс
     dangerous_classes_query = db.query(
         GradeInDB.grade,
         func.avg(ScoresInDB.danger_level).label("avg_danger_level")
@@ -103,7 +123,7 @@ def get_danger_level_stats(
         dangerous_classes_query = dangerous_classes_query.filter(GradeInDB.id.in_(allowed_grade_ids))
     if allowed_subject_ids is not None:
         dangerous_classes_query = dangerous_classes_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-    
+
     dangerous_classes = dangerous_classes_query.group_by(GradeInDB.grade) \
      .order_by(func.avg(ScoresInDB.danger_level).desc()).all()
 
@@ -117,18 +137,15 @@ def get_danger_level_stats(
         "all_dangerous_classes": all_dangerous_classes
     }
 
-@router.get("/danger-levels-piechart")
+@router.get("/danger-levels-piechart", dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])
+@cached_response("dashboard.danger_levels_piechart")
 def get_class_danger_percentages(
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
     # Get allowed grade IDs for the current user
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
+    allowed_subject_ids = scope.subject_ids
 
     empty_pie = {
         "class_danger_percentages": [],
@@ -177,7 +194,7 @@ def get_class_danger_percentages(
         class_danger_query = class_danger_query.filter(GradeInDB.id.in_(allowed_grade_ids))
     if allowed_subject_ids is not None:
         class_danger_query = class_danger_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-    
+
     class_danger_stats = class_danger_query.group_by(GradeInDB.grade, ScoresInDB.danger_level) \
      .order_by(GradeInDB.grade, ScoresInDB.danger_level).all()
 
@@ -216,60 +233,8 @@ def get_class_danger_percentages(
         "class_danger_percentages": class_danger_result
     }
 
-@router.get("/insights")
-def get_actionable_insights(
-    class_level: Optional[str] = Query(None, description="Class level e.g. '8', '10'"),
-    grade_id: Optional[int] = Query(None, description="Specific grade ID"),
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    """
-    Get actionable insights for curators and admins:
-    - Top at-risk students requiring immediate attention
-    - Classes with declining performance
-    - Subject-level analysis
-    - Recommendations
-    """
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
-
-    empty_insights = {
-        "at_risk_students": [],
-        "problem_classes": [],
-        "subject_analysis": [],
-        "recommendations": [],
-        "summary": {"total_students": 0, "at_risk_count": 0, "critical_count": 0}
-    }
-
-    if allowed_subject_ids is not None and not allowed_subject_ids:
-        return empty_insights
-
-    # --- FILTERING ---
-    # Apply Filters to allowed_grade_ids
-    current_grades_query = db.query(GradeInDB)
-    
-    if allowed_grade_ids is not None:
-        current_grades_query = current_grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
-    
-    if grade_id:
-        current_grades_query = current_grades_query.filter(GradeInDB.id == grade_id)
-        
-    if class_level:
-        current_grades_query = current_grades_query.filter(
-             (GradeInDB.grade == class_level) | 
-             (GradeInDB.grade.like(f"{class_level} %")) | 
-             (GradeInDB.grade.like(f"{class_level}_%"))
-        )
-    
-    filtered_grades_objs = current_grades_query.all()
-    # IMPORTANT: Overwrite allowed_grade_ids with the filtered list
-    allowed_grade_ids = [g.id for g in filtered_grades_objs]
-    
-    # 1. Get top at-risk students (danger_level >= 2)
+def _insights_at_risk_students(db: Session, allowed_grade_ids: List[int], allowed_subject_ids: Optional[Set[int]]) -> List[dict]:
+    """Top at-risk students (avg danger_level >= 2)."""
     at_risk_query = db.query(
         StudentInDB.id,
         StudentInDB.name,
@@ -279,12 +244,8 @@ def get_actionable_insights(
         func.avg(ScoresInDB.delta_percentage).label("avg_delta"),
         func.count(ScoresInDB.id).label("subjects_count")
     ).join(GradeInDB, StudentInDB.grade_id == GradeInDB.id) \
-     .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id)
-    
-    if allowed_grade_ids is not None:
-        if not allowed_grade_ids:
-            return empty_insights
-        at_risk_query = at_risk_query.filter(GradeInDB.id.in_(allowed_grade_ids))
+     .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id) \
+     .filter(GradeInDB.id.in_(allowed_grade_ids))
     if allowed_subject_ids is not None:
         at_risk_query = at_risk_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
 
@@ -294,7 +255,7 @@ def get_actionable_insights(
      .order_by(func.avg(ScoresInDB.danger_level).desc()) \
      .limit(10).all()
     
-    at_risk_list = [{
+    return [{
         "id": s.id,
         "name": s.name,
         "class": f"{s.grade} {s.parallel}" if s.parallel else s.grade,
@@ -303,8 +264,10 @@ def get_actionable_insights(
         "subjects_affected": s.subjects_count,
         "priority": "critical" if s.avg_danger >= 2.5 else "high"
     } for s in at_risk_students]
-    
-    # 2. Problem classes (classes with highest average danger)
+
+
+def _insights_problem_classes(db: Session, allowed_grade_ids: List[int], allowed_subject_ids: Optional[Set[int]]) -> List[dict]:
+    """Classes with highest average danger (students' current class)."""
     problem_classes_query = db.query(
         GradeInDB.id,
         GradeInDB.grade,
@@ -314,10 +277,8 @@ def get_actionable_insights(
         func.avg(ScoresInDB.danger_level).label("avg_danger"),
         func.sum(case((ScoresInDB.danger_level >= 2, 1), else_=0)).label("at_risk_count")
     ).join(StudentInDB, StudentInDB.grade_id == GradeInDB.id) \
-     .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id)
-    
-    if allowed_grade_ids is not None:
-        problem_classes_query = problem_classes_query.filter(GradeInDB.id.in_(allowed_grade_ids))
+     .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id) \
+     .filter(GradeInDB.id.in_(allowed_grade_ids))
     if allowed_subject_ids is not None:
         problem_classes_query = problem_classes_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
 
@@ -326,8 +287,8 @@ def get_actionable_insights(
     ).having(func.avg(ScoresInDB.danger_level) >= 1.5) \
      .order_by(func.avg(ScoresInDB.danger_level).desc()) \
      .limit(5).all()
-    
-    problem_classes_list = [{
+
+    return [{
         "id": c.id,
         "class": f"{c.grade} {c.parallel}" if c.parallel else c.grade,
         "curator": c.curator_name or "Не назначен",
@@ -336,26 +297,23 @@ def get_actionable_insights(
         "at_risk_students": int(c.at_risk_count) if c.at_risk_count else 0,
         "attention_needed": "immediate" if c.avg_danger >= 2 else "monitor"
     } for c in problem_classes]
-    
-    # 3. Subject analysis - which subjects have most problems
+
+
+def _insights_subject_analysis(db: Session, allowed_grade_ids: List[int], allowed_subject_ids: Optional[Set[int]]) -> List[dict]:
+    """Which subjects have most problems (from score_danger_rollup)."""
     subject_query = db.query(
-        ScoresInDB.subject_name,
-        func.count(ScoresInDB.id).label("total_scores"),
-        func.avg(ScoresInDB.danger_level).label("avg_danger"),
-        func.avg(ScoresInDB.delta_percentage).label("avg_delta"),
-        func.sum(case((ScoresInDB.danger_level >= 2, 1), else_=0)).label("problem_count")
+        ScoreDangerRollupInDB.subject_name,
+        rollup_score_count.label("total_scores"),
+        rollup_avg_danger.label("avg_danger"),
+        rollup_avg_delta.label("avg_delta"),
+        rollup_at_risk_count.label("problem_count")
     )
-    
-    if allowed_grade_ids is not None:
-        subject_query = subject_query.filter(ScoresInDB.grade_id.in_(allowed_grade_ids))
-    if allowed_subject_ids is not None:
-        subject_query = subject_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    subject_query = filter_rollup_by_scope(subject_query, allowed_grade_ids, allowed_subject_ids)
 
-    subject_stats = subject_query.filter(ScoresInDB.subject_name.isnot(None)) \
-     .group_by(ScoresInDB.subject_name) \
-     .order_by(func.avg(ScoresInDB.danger_level).desc()).all()
+    subject_stats = subject_query.group_by(ScoreDangerRollupInDB.subject_name) \
+     .order_by(rollup_avg_danger.desc()).all()
     
-    subject_analysis = [{
+    return [{
         "subject": s.subject_name,
         "students_count": s.total_scores,
         "avg_danger_level": round(float(s.avg_danger), 2) if s.avg_danger else 0,
@@ -363,6 +321,95 @@ def get_actionable_insights(
         "problem_students": int(s.problem_count) if s.problem_count else 0,
         "status": "critical" if (s.avg_danger or 0) >= 2 else "warning" if (s.avg_danger or 0) >= 1.5 else "ok"
     } for s in subject_stats]
+
+
+def _insights_total_students(db: Session, allowed_grade_ids: List[int]) -> int:
+    return db.query(func.count(StudentInDB.id.distinct())) \
+        .filter(StudentInDB.grade_id.in_(allowed_grade_ids)).scalar() or 0
+
+
+def _insights_students_with_danger(
+    db: Session, allowed_grade_ids: List[int], allowed_subject_ids: Optional[Set[int]], min_danger_level: int
+) -> int:
+    """Students with any score at danger_level >= min_danger_level."""
+    count_query = db.query(func.count(StudentInDB.id.distinct())) \
+        .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id) \
+        .filter(StudentInDB.grade_id.in_(allowed_grade_ids))
+    if allowed_subject_ids is not None:
+        count_query = count_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    return count_query.filter(ScoresInDB.danger_level >= min_danger_level).scalar() or 0
+
+
+@router.get("/insights", dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])
+@cached_response("dashboard.insights")
+def get_actionable_insights(
+    class_level: Optional[str] = Query(None, description="Class level e.g. '8', '10'"),
+    grade_id: Optional[int] = Query(None, description="Specific grade ID"),
+    scope: AccessScope = Depends(get_access_scope),
+    db: Session = Depends(get_db)
+):
+    """
+    Get actionable insights for curators and admins:
+    - Top at-risk students requiring immediate attention
+    - Classes with declining performance
+    - Subject-level analysis
+    - Recommendations
+    """
+    allowed_grade_ids = scope.grade_ids
+    allowed_subject_ids = scope.subject_ids
+
+    empty_insights = {
+        "at_risk_students": [],
+        "problem_classes": [],
+        "subject_analysis": [],
+        "recommendations": [],
+        "summary": {"total_students": 0, "at_risk_count": 0, "critical_count": 0}
+    }
+
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return empty_insights
+
+    # --- FILTERING ---
+    # Apply Filters to allowed_grade_ids
+    current_grades_query = db.query(GradeInDB)
+    
+    if allowed_grade_ids is not None:
+        current_grades_query = current_grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
+    
+    if grade_id:
+        current_grades_query = current_grades_query.filter(GradeInDB.id == grade_id)
+        
+    if class_level:
+        current_grades_query = current_grades_query.filter(
+             (GradeInDB.grade == class_level) | 
+             (GradeInDB.grade.like(f"{class_level} %")) | 
+             (GradeInDB.grade.like(f"{class_level}_%"))
+        )
+    
+    filtered_grades_objs = current_grades_query.all()
+    # IMPORTANT: Overwrite allowed_grade_ids with the filtered list
+    allowed_grade_ids = [g.id for g in filtered_grades_objs]
+    
+    if not allowed_grade_ids:
+        return empty_insights
+
+    # Independent aggregates run concurrently, each on its own pooled connection;
+    # release the request's connection meanwhile (read-only, nothing to keep)
+    db.rollback()
+    results = run_queries_concurrently({
+        "at_risk_students": lambda s: _insights_at_risk_students(s, allowed_grade_ids, allowed_subject_ids),
+        "problem_classes": lambda s: _insights_problem_classes(s, allowed_grade_ids, allowed_subject_ids),
+        "subject_analysis": lambda s: _insights_subject_analysis(s, allowed_grade_ids, allowed_subject_ids),
+        "total_students": lambda s: _insights_total_students(s, allowed_grade_ids),
+        "at_risk_total": lambda s: _insights_students_with_danger(s, allowed_grade_ids, allowed_subject_ids, 2),
+        "critical_total": lambda s: _insights_students_with_danger(s, allowed_grade_ids, allowed_subject_ids, 3),
+    })
+    at_risk_list = results["at_risk_students"]
+    problem_classes_list = results["problem_classes"]
+    subject_analysis = results["subject_analysis"]
+    total_students = results["total_students"]
+    at_risk_total = results["at_risk_total"]
+    critical_total = results["critical_total"]
     
     # 4. Generate recommendations
     recommendations = []
@@ -408,22 +455,6 @@ def get_actionable_insights(
             "link": None
         })
     
-    # 5. Summary stats
-    total_query = db.query(func.count(StudentInDB.id.distinct()))
-    if allowed_grade_ids is not None:
-        total_query = total_query.filter(StudentInDB.grade_id.in_(allowed_grade_ids))
-    total_students = total_query.scalar() or 0
-    
-    at_risk_count_query = db.query(func.count(StudentInDB.id.distinct())) \
-        .join(ScoresInDB, ScoresInDB.student_id == StudentInDB.id)
-    if allowed_grade_ids is not None:
-        at_risk_count_query = at_risk_count_query.filter(StudentInDB.grade_id.in_(allowed_grade_ids))
-    if allowed_subject_ids is not None:
-        at_risk_count_query = at_risk_count_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-    # Count students with any danger level >= 2
-    at_risk_total = at_risk_count_query.filter(ScoresInDB.danger_level >= 2).scalar() or 0
-    critical_total = at_risk_count_query.filter(ScoresInDB.danger_level >= 3).scalar() or 0
-    
     return {
         "at_risk_students": at_risk_list,
         "problem_classes": problem_classes_list,
@@ -436,3 +467,15 @@ def get_actionable_insights(
             "at_risk_percentage": round((at_risk_total / total_students * 100), 1) if total_students > 0 else 0
         }
     }
+
+
+@router.get("/cache-stats")
+def get_cache_stats(scope: AccessScope = Depends(get_access_scope)):
+    """Hit/miss counters of the in-process caches (admin only)"""
+    if scope.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view cache statistics")
+    return {
+        "responses": response_cache_stats(),
+        "access_scopes": access_scope_cache_stats(),
+        "reference_data": reference_data_cache_stats(),
+    }
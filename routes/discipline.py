@@ -3,29 +3,25 @@ from sqlalchemy.orm import Session
 from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
-from routes.auth import oauth2_scheme
-from role_utils import get_user_allowed_grade_ids, check_grade_access
+from routes.auth import oauth2_scheme, get_access_scope
+from role_utils import AccessScope
 from typing import List, Optional
 from datetime import datetime
 
 router = APIRouter()
 
 @router.get("/", response_model=List[DisciplinaryActionResponse])
-async def get_disciplinary_actions(
+def get_disciplinary_actions(
     student_id: Optional[int] = Query(None),
     severity_level: Optional[int] = Query(None),
     is_resolved: Optional[int] = Query(None),
     limit: Optional[int] = Query(100),
     offset: Optional[int] = Query(0),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get disciplinary actions with optional filters"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
 
     query = db.query(DisciplinaryActionInDB)
 
@@ -77,15 +73,13 @@ async def get_disciplinary_actions(
     return result
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_disciplinary_action(
+def create_disciplinary_action(
     action: CreateDisciplinaryAction,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Create a new disciplinary action"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_data = scope.user_data
     
     # Check if the user is an admin or teacher
     if user_data.get("type") not in ["admin", "teacher", "curator"]:
@@ -103,7 +97,7 @@ async def create_disciplinary_action(
         raise HTTPException(status_code=404, detail="Student not found")
 
     # Non-admins can only act on students in grades they have access to.
-    if not check_grade_access(user_data, student.grade_id, db):
+    if not scope.can_access_grade(student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     # Validate severity level
@@ -118,7 +112,7 @@ async def create_disciplinary_action(
         action_type=action.action_type,
         description=action.description,
         severity_level=action.severity_level,
-        issued_by=user_data.get("id"),
+        issued_by=scope.user_id,
         action_date=action.action_date or datetime.utcnow()
     )
     
@@ -129,16 +123,14 @@ async def create_disciplinary_action(
     return {"id": db_action.id, "message": "Disciplinary action created successfully"}
 
 @router.put("/{action_id}", status_code=status.HTTP_200_OK)
-async def update_disciplinary_action(
+def update_disciplinary_action(
     action_id: int,
     update_data: UpdateDisciplinaryAction,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Update a disciplinary action by ID"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_data = scope.user_data
     
     # Check if the user is an admin, teacher, or curator
     if user_data.get("type") not in ["admin", "teacher", "curator"]:
@@ -154,11 +146,11 @@ async def update_disciplinary_action(
         raise HTTPException(status_code=404, detail="Disciplinary action not found")
 
     target_student = db.query(StudentInDB).filter(StudentInDB.id == action.student_id).first()
-    if target_student and not check_grade_access(user_data, target_student.grade_id, db):
+    if target_student and not scope.can_access_grade(target_student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     # Only admin or the original issuer can update
-    if user_data.get("type") != "admin" and action.issued_by != user_data.get("id"):
+    if user_data.get("type") != "admin" and action.issued_by != scope.user_id:
         raise HTTPException(
             status_code=403,
             detail="You can only update your own disciplinary actions"
@@ -185,7 +177,7 @@ async def update_disciplinary_action(
     return {"message": "Disciplinary action updated successfully"}
 
 @router.delete("/{action_id}", status_code=status.HTTP_200_OK)
-async def delete_disciplinary_action(
+def delete_disciplinary_action(
     action_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -215,22 +207,18 @@ async def delete_disciplinary_action(
     return {"message": "Disciplinary action deleted successfully"}
 
 @router.get("/student/{student_id}", response_model=List[DisciplinaryActionResponse])
-async def get_student_disciplinary_actions(
+def get_student_disciplinary_actions(
     student_id: int,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get all disciplinary actions for a specific student"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    
     # Verify student exists
     student = db.query(StudentInDB).filter(StudentInDB.id == student_id).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    if not check_grade_access(user_data, student.grade_id, db):
+    if not scope.can_access_grade(student.grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this student")
 
     actions = db.query(DisciplinaryActionInDB).filter(
@@ -262,17 +250,13 @@ async def get_student_disciplinary_actions(
     return result
 
 @router.get("/statistics", response_model=dict)
-async def get_discipline_statistics(
+def get_discipline_statistics(
     grade_id: Optional[int] = Query(None),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get disciplinary action statistics"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
 
     query = db.query(DisciplinaryActionInDB)
     joined_students = False
@@ -6,19 +6,51 @@ from config import get_db
 from schemas.models import *
 from sqlalchemy import or_, and_
 from auth_utils import verify_access_token
-from routes.auth import oauth2_scheme
+from routes.auth import oauth2_scheme, get_access_scope
+from routes.import_jobs import import_job_accepted
 from role_utils import (
-    get_user_allowed_grade_ids,
-    get_user_allowed_subject_ids,
-    get_user_allowed_subject_group_ids,
-    check_grade_access,
+    AccessScope,
+    bump_access_scope_version,
     get_user_from_token,
     compute_show_subject_groups_nav_for_user,
 )
-from services.school_year import get_current_academic_year
+from response_cache import cached_response
+from etag_utils import ANALYTICS_MODELS, GRADE_LIST_MODELS, conditional_get
+from services.reference_data import (
+    cached_academic_year,
+    cached_excel_column_aliases,
+    cached_prediction_weights,
+    cached_subject,
+    cached_subject_by_name,
+    cached_subjects,
+    current_academic_year,
+    excel_column_aliases,
+    prediction_weights,
+)
+from key_utils import normalize_student_name, student_name_key
 import pandas as pd
-from io import BytesIO, StringIO
+from io import StringIO
 from services.analyze import analyze_excel
+from services.class_analytics import (
+    build_class_data,
+    enrich_students,
+    enrich_students_with_details,
+    students_by_danger_level,
+)
+from services.grade_import import import_parsed_grades
+from services.score_store import upsert_scores
+from services.score_recalc import recalculate_all_score_predictions
+from services.excel_stream import ExcelWorkbook, column_names, upload_on_disk
+from services.process_pool import map_in_process, run_in_process
+from services.import_jobs import ImportJobProgress, create_import_job, register_import_handler
+from services.roster_parser import parse_students_roster
+from services.grade_batch import (
+    EXCEL_EXTENSIONS,
+    GRADE_BATCH_MAX_SHEETS,
+    expand_grade_batch,
+    grade_index,
+    resolve_sheet,
+)
 from services.excel_parser import (
     parse_excel_grades,
     generate_excel_template,
@@ -27,6 +59,10 @@ from services.excel_parser import (
 )
 from typing import Optional, List, Set, Dict
 import re
+import csv
+import os
+import shutil
+import tempfile
 
 router = APIRouter()
 
@@ -42,7 +78,7 @@ def _sync_score_prediction_with_actual(score: ScoresInDB, db: Session) -> None:
         act = row
     elif not isinstance(act, list):
         act = []
-    weights = load_prediction_weights_from_db(db)
+    weights = cached_prediction_weights(db)
     pred, dlevel, dpct = recalculate_predicted_and_danger_from_actual(
         act,
         score.previous_class_score,
@@ -135,50 +171,17 @@ def _extract_grade_parallel_from_class_text(class_text: str) -> tuple[Optional[s
     return grade_part, parallel_part
 
 
-def _normalize_grade_key(grade_text: str, parallel_text: Optional[str]) -> tuple[str, str, str]:
-    grade_raw = str(grade_text or "").strip()
-    parallel_raw = str(parallel_text or "").strip().upper()
-
-    compact_grade = re.sub(r"\s+", "", grade_raw)
-    match = re.match(r"^(\d{1,2})([A-Za-zА-Яа-яЁёІіҢңҒғҚқӨөҰұҮүҺһ]?)$", compact_grade)
-    if match:
-        num = match.group(1)
-        letter = (match.group(2) or parallel_raw).upper()
-        canonical = f"{num}{letter}" if letter else num
-        return canonical, num, letter
-
-    num_match = re.match(r"^(\d{1,2})", grade_raw)
-    if num_match:
-        num = num_match.group(1)
-        letter = parallel_raw
-        canonical = f"{num}{letter}" if letter else num
-        return canonical, num, letter
-
-    fallback = f"{grade_raw} {parallel_raw}".strip()
-    return fallback, grade_raw, parallel_raw
-
-
-def _normalize_student_name(value: object) -> str:
-    if value is None:
-        return ""
-
-    text = str(value).strip()
-    if not text or text.lower() == "nan":
-        return ""
-    return " ".join(text.split())
-
-
 def _find_existing_student_by_name_grade(
     db: Session,
     grade_id: int,
     student_name: str
 ) -> Optional[StudentInDB]:
-    normalized_name = _normalize_student_name(student_name)
-    if not normalized_name:
+    name_key = student_name_key(student_name)
+    if not name_key:
         return None
     return db.query(StudentInDB).filter(
         StudentInDB.grade_id == grade_id,
-        func.lower(func.trim(StudentInDB.name)) == normalized_name.lower()
+        StudentInDB.normalized_name == name_key
     ).first()
 
 
@@ -216,151 +219,31 @@ def _find_or_create_grade_for_students_import(
     return new_grade
 
 
-@router.post("/students/bulk-upload", status_code=status.HTTP_201_CREATED)
-async def bulk_upload_students(
-    file: UploadFile = File(...),
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    """
-    Bulk upload students from Excel.
-    Expected format supports these columns:
-    - "Класс и литер" (required)
-    - "ФИО" (required)
-    Other columns are ignored.
-    """
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    if user_data.get("type") != "admin":
-        raise HTTPException(status_code=403, detail="Only admins can bulk upload students")
-
-    filename = (file.filename or "").lower()
-    if not filename.endswith((".xlsx", ".xls")):
-        raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
+def _import_students_file(
+    db: Session,
+    user_data: dict,
+    path: str,
+    progress: Optional[ImportJobProgress] = None,
+) -> dict:
+    """Разбор списка учеников (в пуле процессов) и запись в БД; отчёт — как у /students/bulk-upload."""
+    progress = progress or ImportJobProgress()
 
     admin_user = db.query(UserInDB).filter(UserInDB.email == user_data.get("sub")).first()
     if not admin_user:
         admin_user = db.query(UserInDB).filter(UserInDB.id == user_data.get("id")).first()
     creator_id = admin_user.id if admin_user else user_data.get("id", 1)
 
-    file_content = await file.read()
-    if not file_content:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty")
-
-    def _find_header_row_index(preview: pd.DataFrame) -> Optional[int]:
-        if preview.empty:
-            return None
-
-        def has_token(value: object, token: str) -> bool:
-            if value is None:
-                return False
-            text = str(value).strip().lower()
-            if not text or text == "nan":
-                return False
-            return token in text
-
-        for idx in range(len(preview.index)):
-            row = preview.iloc[idx].tolist()
-            has_name = any(has_token(v, "фио") for v in row)
-            has_class = any(has_token(v, "класс") for v in row)
-            has_liter = any(has_token(v, "литер") for v in row) or any(has_token(v, "паралл") for v in row) or any(has_token(v, "букв") for v in row)
-            if has_name and (has_class or has_liter):
-                return int(idx)
-        return None
-
-    header_row: Optional[int] = None
-    try:
-        excel = pd.ExcelFile(BytesIO(file_content))
-        chosen_sheet: Optional[str] = None
-        chosen_header: Optional[int] = None
-
-        for sheet in excel.sheet_names:
-            preview = pd.read_excel(excel, sheet_name=sheet, header=None, nrows=30)
-            candidate_header = _find_header_row_index(preview)
-            if candidate_header is None:
-                continue
-            df_candidate = pd.read_excel(excel, sheet_name=sheet, header=candidate_header)
-            if df_candidate.empty:
-                continue
-            cols = [str(c).strip().lower() for c in df_candidate.columns]
-            has_name = any("фио" in c for c in cols)
-            has_class_and_liter = any(("класс" in c and "литер" in c) for c in cols)
-            has_class = any("класс" in c for c in cols)
-            if has_name and (has_class_and_liter or has_class):
-                chosen_sheet = sheet
-                chosen_header = candidate_header
-                break
-
-        if chosen_sheet is None:
-            preview0 = pd.read_excel(excel, sheet_name=excel.sheet_names[0], header=None, nrows=30)
-            chosen_sheet = excel.sheet_names[0]
-            chosen_header = _find_header_row_index(preview0)
-            if chosen_header is None:
-                chosen_header = 1
-
-        header_row = chosen_header
-        dataframe = pd.read_excel(excel, sheet_name=chosen_sheet, header=chosen_header)
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail=f"Failed to read Excel: {str(exc)}")
-
-    if dataframe.empty:
-        raise HTTPException(status_code=400, detail="Excel file has no data rows")
-
-    # Handle merged cells in "Класс и литер"
-    dataframe = dataframe.fillna("")
-    dataframe.columns = [str(column).strip() for column in dataframe.columns]
-
-    class_column = next(
-        (column for column in dataframe.columns if "класс" in column.lower() and "литер" in column.lower()),
-        None
-    )
-    class_number_column = next(
-        (column for column in dataframe.columns if "класс" in column.lower() and "литер" not in column.lower() and "паралл" not in column.lower()),
-        None
-    )
-    liter_column = next(
-        (
-            column
-            for column in dataframe.columns
-            if ("литер" in column.lower() or "паралл" in column.lower() or "букв" in column.lower())
-        ),
-        None,
-    )
-    name_column = next(
-        (column for column in dataframe.columns if "фио" in column.lower()),
-        None
-    )
-
-    if not name_column or (not class_column and not class_number_column):
-        raise HTTPException(
-            status_code=400,
-            detail=f"Excel must contain student name and class columns. Expected 'ФИО' and either 'Класс и литер' or separate class columns. Available columns: {list(dataframe.columns)}"
-        )
-
-    if class_column:
-        dataframe[class_column] = dataframe[class_column].replace("", pd.NA).ffill()
-    if class_number_column:
-        dataframe[class_number_column] = dataframe[class_number_column].replace("", pd.NA).ffill()
-    if liter_column:
-        dataframe[liter_column] = dataframe[liter_column].replace("", pd.NA).ffill()
+    # Разбор файла — в пуле процессов; здесь только запись в БД
+    records = run_in_process(parse_students_roster, path)
+    progress.phase("writing", rows_total=len(records))
 
     created_count = 0
     updated_count = 0
     skipped_count = 0
     errors: List[dict] = []
 
-    for row_index, row in dataframe.iterrows():
-        excel_row_number = int(row_index) + (int(header_row) + 2 if "header_row" in locals() and header_row is not None else 3)
-        raw_class_value = row.get(class_column) if class_column else None
-        if raw_class_value is None:
-            base_class = row.get(class_number_column) if class_number_column else ""
-            base_liter = row.get(liter_column) if liter_column else ""
-            raw_class_value = f"{base_class}{base_liter}".strip()
-        raw_name_value = row.get(name_column)
-
-        student_name = _normalize_student_name(raw_name_value)
+    for processed, (excel_row_number, raw_class_value, student_name) in enumerate(records):
+        progress.rows(processed)
         if not student_name:
             skipped_count += 1
             continue
@@ -433,8 +316,56 @@ async def bulk_upload_students(
         "errors": errors
     }
 
+
+def _run_students_import_job(db: Session, user_data: dict, params: dict, path: str, progress: ImportJobProgress) -> dict:
+    # Роль — из БД на момент запуска (import_jobs._job_user_data)
+    if user_data.get("type") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can bulk upload students")
+    return _import_students_file(db, user_data, path, progress)
+
+
+register_import_handler("students", _run_students_import_job)
+
+
+@router.post("/students/bulk-upload", status_code=status.HTTP_201_CREATED)
+def bulk_upload_students(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Import as a background job: 202 with job id, poll GET /import-jobs/{id}"),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """
+    Bulk upload students from Excel.
+    Expected format supports these columns:
+    - "Класс и литер" (required)
+    - "ФИО" (required)
+    Other columns are ignored.
+    With ?background=true the file is imported by a background job (202 + job id).
+    """
+    user_data = verify_access_token(token)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    if user_data.get("type") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can bulk upload students")
+
+    filename = (file.filename or "").lower()
+    if not filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
+
+    file.file.seek(0, 2)
+    if not file.file.tell():
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+
+    if background:
+        job = create_import_job(db, kind="students", upload=file.file, file_name=file.filename, user_data=user_data)
+        return import_job_accepted(job)
+
+    with upload_on_disk(file.file, suffix=os.path.splitext(filename)[1]) as path:
+        return _import_students_file(db, user_data, path)
+
 @router.post("/send/")
-async def send_excel_as_csv_to_openai(
+def send_excel_as_csv_to_openai(
     grade: str = Form(...),
     curator: str = Form(...),
     subject: str = Form(...),
@@ -447,15 +378,16 @@ async def send_excel_as_csv_to_openai(
         if not user_data:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-        contents = await file.read()
-        excel_data = BytesIO(contents)
-
-        # Читаем только первый лист
-        df = pd.read_excel(excel_data, sheet_name=0)
-
-        # Конвертируем в CSV
+        # Читаем только первый лист и построчно пишем в CSV (без DataFrame)
         csv_data = StringIO()
-        df.to_csv(csv_data, index=False)
+        writer = csv.writer(csv_data, lineterminator="\n")
+        with ExcelWorkbook(file.file) as workbook:
+            rows = workbook.rows(workbook.sheet_names[0])
+            columns = column_names(next(rows, ()))
+            writer.writerow(columns)
+            for row in rows:
+                values = ["" if value is None else value for value in row]
+                writer.writerow(values + [""] * (len(columns) - len(values)))
         csv_text = csv_data.getvalue()
         print("csv text:", csv_text)
 
@@ -482,7 +414,11 @@ async def send_excel_as_csv_to_openai(
             db.commit()
             db.refresh(db_grade)
 
-        current_ay = get_current_academic_year(db)
+        current_ay = cached_academic_year(db)
+        db_subject = cached_subject_by_name(db, subject)
+        subject_id = db_subject.id if db_subject else None
+        teacher_name = user.name or user.email
+        score_rows = []
         # Обработка данных студентов
         for analysis_item in json_response['students']:
             student_name = analysis_item["student_name"]
@@ -526,37 +462,27 @@ async def send_excel_as_csv_to_openai(
                 db.commit()
                 db.refresh(db_student)
 
-            # Обновляем или создаем запись с оценками ПО ПРЕДМЕТУ (текущий учебный год)
-            db_score = db.query(ScoresInDB).filter(
-                ScoresInDB.student_id == db_student.id,
-                ScoresInDB.subject_name == subject,
-                ScoresInDB.academic_year == current_ay,
-            ).first()
-            if db_score:
-                db_score.actual_scores = actual_score
-                db_score.predicted_scores = predicted_scores
-                db_score.danger_level = danger_level
-                db_score.delta_percentage = round(percentage_difference, 1)
-                db_score.academic_year = current_ay
-            else:
-                new_score = ScoresInDB(
-                    subject_name=subject,
-                    actual_scores=actual_score,
-                    predicted_scores=predicted_scores,
-                    danger_level=danger_level,
-                    delta_percentage=round(percentage_difference, 1),
-                    student_id=db_student.id,
-                    grade_id=db_grade.id,
-                    semester=1,
-                    academic_year=current_ay,
-                )
-                print(new_score)
-
-                db.add(new_score)
-
-            if db_score:
-                print(db_score)
+            # Запись с оценками ПО ПРЕДМЕТУ (текущий учебный год) — одним upsert после цикла
+            score_rows.append({
+                "teacher_name": teacher_name,
+                "subject_name": subject,
+                "subject_id": subject_id,
+                "actual_scores": actual_score,
+                "predicted_scores": predicted_scores,
+                "danger_level": danger_level,
+                "delta_percentage": round(percentage_difference, 1),
+                "student_id": db_student.id,
+                "grade_id": db_grade.id,
+                "semester": 1,
+                "academic_year": current_ay,
+                "subject_group_id": None,
+            })
 
+        upsert_scores(
+            db,
+            score_rows,
+            update_columns=("actual_scores", "predicted_scores", "danger_level", "delta_percentage"),
+        )
         db.commit()
 
         return {"analysis": json_response}
@@ -565,210 +491,21 @@ async def send_excel_as_csv_to_openai(
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-@router.get("/get_class")
+@router.get("/get_class", dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])
+@cached_response("grades.get_class")
 def get_class_data(
     subject: Optional[str] = Query(None, description="Filter by subject name"),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     try:
-        user_data = verify_access_token(token)  
-        if not user_data:
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
-        
-        allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-        allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
-
-        grades_query = db.query(GradeInDB)
-        if allowed_grade_ids is not None:
-            if not allowed_grade_ids:
-                return {"class_data": []}
-            grades_query = grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
-
-        if allowed_subject_ids is not None and not allowed_subject_ids:
-            return {"class_data": []}
-
-        db_grades = grades_query.all()
-
-        if not db_grades:
-            return {"class_data": []}
-
-        class_data = []
-
-        for grade in db_grades:
-            students = db.query(StudentInDB).filter(StudentInDB.grade_id == grade.id).all()
-            student_info_list = []
-
-            for student in students:
-                scores_query = db.query(ScoresInDB).filter(ScoresInDB.student_id == student.id)
-                if subject:
-                    scores_query = scores_query.filter(ScoresInDB.subject_name == subject)
-                if allowed_subject_ids is not None:
-                    scores_query = scores_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-                student_scores = scores_query.all()
-
-                all_valid_scores = []
-                overall_danger_level = 0
-                danger_count = 0
-                
-                actual_scores = []
-                predicted_scores = []
-                previous_class_score = None
-                danger_level = None
-                delta_percentage = None
-
-                for score in student_scores:
-                    if score.actual_scores and isinstance(score.actual_scores, list):
-                        valid_scores = [s for s in score.actual_scores if s is not None and s > 0]
-                        all_valid_scores.extend(valid_scores)
-                    
-                    if score.danger_level is not None:
-                        overall_danger_level += score.danger_level
-                        danger_count += 1
-                    
-                    if score.actual_scores:
-                        actual_scores = score.actual_scores if isinstance(score.actual_scores, list) else []
-                    if score.predicted_scores:
-                        predicted_scores = score.predicted_scores if isinstance(score.predicted_scores, list) else []
-                    if score.previous_class_score is not None:
-                        previous_class_score = score.previous_class_score
-                    danger_level = score.danger_level  
-                    delta_percentage = score.delta_percentage
-                
-                avg_percentage = None
-                if all_valid_scores:
-                    avg_percentage = round(sum(all_valid_scores) / len(all_valid_scores), 1)
-                
-                if danger_count > 0:
-                    danger_level = round(overall_danger_level / danger_count)
-
-                canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-                student_info_list.append({
-                    "id": student.id,
-                    "student_name": student.name,
-                    "email": student.email,
-                    "previous_class_score": previous_class_score,
-                    "actual_score": actual_scores,
-                    "actual_scores": actual_scores,
-                    "predicted_scores": predicted_scores,
-                    "avg_percentage": avg_percentage,
-                    "danger_level": danger_level,
-                    "delta_percentage": delta_percentage,
-                    "class_liter": canonical,
-                    "grade_id": grade.id,
-                    "source_grade_id": grade.id,
-                })
-
-            grade_canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-            class_data.append({
-                "curator_name": grade.curator_name,
-                "subject_name": subject,
-                "grade_liter": grade_canonical,
-                "grade_id": grade.id,
-                "is_subject_group": False,
-                "class": student_info_list
-            })
-
-        # Subject groups as "virtual classes" for analytics:
-        # each group is a separate class-like bucket across real classes.
-        allowed_group_ids = get_user_allowed_subject_group_ids(user_data, db)
-        if allowed_group_ids is not None and not allowed_group_ids:
-            subject_groups = []
-        else:
-            groups_query = db.query(SubjectGroupInDB).filter(SubjectGroupInDB.is_active == 1)
-            if allowed_group_ids is not None:
-                groups_query = groups_query.filter(SubjectGroupInDB.id.in_(allowed_group_ids))
-            if allowed_subject_ids is not None:
-                groups_query = groups_query.filter(SubjectGroupInDB.subject_id.in_(allowed_subject_ids))
-            if subject:
-                groups_query = groups_query.join(
-                    SubjectInDB, SubjectInDB.id == SubjectGroupInDB.subject_id
-                ).filter(SubjectInDB.name == subject)
-            subject_groups = groups_query.all()
-
-        for sg in subject_groups:
-            member_rows = db.query(StudentSubjectGroupMembershipInDB).filter(
-                StudentSubjectGroupMembershipInDB.subject_group_id == sg.id,
-                StudentSubjectGroupMembershipInDB.is_active == 1
-            ).all()
-            student_info_list = []
-
-            for member in member_rows:
-                student = db.query(StudentInDB).filter(StudentInDB.id == member.student_id).first()
-                if not student:
-                    continue
-
-                scores_query = db.query(ScoresInDB).filter(
-                    ScoresInDB.student_id == student.id,
-                    ScoresInDB.subject_group_id == sg.id
-                )
-                if subject:
-                    scores_query = scores_query.filter(ScoresInDB.subject_name == subject)
-                student_scores = scores_query.all()
-
-                all_valid_scores = []
-                overall_danger_level = 0
-                danger_count = 0
-
-                actual_scores = []
-                predicted_scores = []
-                previous_class_score = None
-                danger_level = None
-                delta_percentage = None
-
-                for score in student_scores:
-                    if score.actual_scores and isinstance(score.actual_scores, list):
-                        valid_scores = [s for s in score.actual_scores if s is not None and s > 0]
-                        all_valid_scores.extend(valid_scores)
-
-                    if score.danger_level is not None:
-                        overall_danger_level += score.danger_level
-                        danger_count += 1
-
-                    if score.actual_scores:
-                        actual_scores = score.actual_scores if isinstance(score.actual_scores, list) else []
-                    if score.predicted_scores:
-                        predicted_scores = score.predicted_scores if isinstance(score.predicted_scores, list) else []
-                    if score.previous_class_score is not None:
-                        previous_class_score = score.previous_class_score
-                    danger_level = score.danger_level
-                    delta_percentage = score.delta_percentage
-
-                avg_percentage = None
-                if all_valid_scores:
-                    avg_percentage = round(sum(all_valid_scores) / len(all_valid_scores), 1)
-
-                if danger_count > 0:
-                    danger_level = round(overall_danger_level / danger_count)
-
-                student_info_list.append({
-                    "id": student.id,
-                    "student_name": student.name,
-                    "email": student.email,
-                    "previous_class_score": previous_class_score,
-                    "actual_score": actual_scores,
-                    "actual_scores": actual_scores,
-                    "predicted_scores": predicted_scores,
-                    "avg_percentage": avg_percentage,
-                    "danger_level": danger_level,
-                    "delta_percentage": delta_percentage,
-                    "class_liter": sg.name,
-                    # virtual class id to keep group isolated in analytics filters
-                    "grade_id": -(sg.id),
-                    "source_grade_id": student.grade_id,
-                })
-
-            class_data.append({
-                "curator_name": None,
-                "subject_name": subject or (sg.subject.name if getattr(sg, "subject", None) else None),
-                "grade_liter": sg.name,
-                "grade_id": -(sg.id),
-                "is_subject_group": True,
-                "subject_group_id": sg.id,
-                "parallel_num": str(_parallel_int_from_grade_row_local(db.query(GradeInDB).filter(GradeInDB.id == sg.grade_id).first()) or ""),
-                "class": student_info_list
-            })
-        
+        class_data = build_class_data(
+            db,
+            subject=subject,
+            allowed_grade_ids=scope.grade_ids,
+            allowed_subject_ids=scope.subject_ids,
+            allowed_group_ids=scope.subject_group_ids,
+        )
         return {"class_data": class_data}
 
     except HTTPException as e:
@@ -777,96 +514,53 @@ def get_class_data(
         raise HTTPException(status_code=500, detail="An error occurred while fetching class data")
 
 @router.get("/get_students_danger")
+@cached_response("grades.get_students_danger")
 def get_students_by_danger_level(
     level: int = Query(...),  # Change to Query
-    token: str = Depends(oauth2_scheme),  # Токен пользователя для авторизации
+    subject: Optional[str] = Query(None, description="Filter by subject name"),
+    academic_year: Optional[str] = Query(None, description="Учебный год, например 2025-2026"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Размер страницы; без limit — все записи"),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)  # Сессия базы данных
 ):
-    try:
-        # Проверяем токен
-        user_data = verify_access_token(token)
-        if not user_data:
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-        # Get allowed grade IDs for role-based filtering
-        allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-        allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
-
-        # Build query with role-based filtering
-        grades_query = db.query(GradeInDB)
-        if allowed_grade_ids is not None:  # Not admin
-            if not allowed_grade_ids:  # Empty set - no access
-                return {"filtered_class_data": []}
-            grades_query = grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
-
-        if allowed_subject_ids is not None and not allowed_subject_ids:
-            return {"filtered_class_data": []}
-
-        db_grades = grades_query.all()
-        if not db_grades:
-            return {"filtered_class_data": []}
-
-        class_data = []
-
-        for grade in db_grades:
-            # Получаем студентов в классе
-            students = db.query(StudentInDB).filter(StudentInDB.grade_id == grade.id).all()
-            student_info_list = []
-            subject_name = None  # Инициализируем переменную
-
-            for student in students:
-                # Получаем записи с оценками для студента
-                scores_q = db.query(ScoresInDB).filter(ScoresInDB.student_id == student.id)
-                if allowed_subject_ids is not None:
-                    scores_q = scores_q.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-                student_scores = scores_q.all()
-
-                # Ищем студентов с уровнем опасности выше указанного
-                for score in student_scores:
-                    if score.danger_level == level:
-                        subject_name = score.subject_name  # Обновляем subject_name
-                        canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-                        student_info_list.append({
-                            "id": student.id,
-                            "student_name": student.name,
-                            "actual_score": score.actual_scores,
-                            "predicted_score": score.predicted_scores,
-                            "danger_level": score.danger_level,
-                            "delta_percentage": score.delta_percentage,
-                            "class_liter": canonical,
-                            "grade_id": grade.id,
-                        })
-
-            if student_info_list:
-                grade_canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-                class_data.append({
-                    "curator_name": grade.curator_name,
-                    "subject_name": subject_name,
-                    "grade_liter": grade_canonical,
-                    "class": student_info_list
-                })
-        
-        if not class_data:
-            class_data = []
+    after = None
+    if cursor:
+        try:
+            grade_id, student_id, score_id = (int(part) for part in cursor.split(":"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after = (grade_id, student_id, score_id)
 
-        return {"filtered_class_data": class_data}
+    try:
+        class_data, next_after = students_by_danger_level(
+            db,
+            level,
+            allowed_grade_ids=scope.grade_ids,
+            allowed_subject_ids=scope.subject_ids,
+            subject=subject,
+            academic_year=academic_year,
+            limit=limit,
+            after=after,
+        )
+        return {
+            "filtered_class_data": class_data,
+            "next_cursor": ":".join(map(str, next_after)) if next_after else None,
+        }
 
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail="An error occurred while fetching class data")
 
-def _parallel_int_from_grade_row_local(grade: GradeInDB) -> Optional[int]:
-    """Параллель из поля grade (как в subject_groups.parallel_int_from_grade_row)."""
-    if not grade or grade.grade is None:
-        return None
-    m = re.match(r"^(\d+)", str(grade.grade).strip())
-    return int(m.group(1)) if m else None
-
-
-@router.get("/all", response_model=List[dict])
-async def get_all_grades(
-    token: str = Depends(oauth2_scheme),
+@router.get(
+    "/all",
+    response_model=List[dict],
+    dependencies=[Depends(conditional_get(GRADE_LIST_MODELS, per_user=True))],
+)
+@cached_response("grades.all", per_user=True)
+def get_all_grades(
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db),
     purpose: Optional[str] = Query(
         None,
@@ -874,61 +568,85 @@ async def get_all_grades(
     ),
 ):
     """Get information about all grades/classes (filtered by user role)"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_data = scope.user_data
 
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
 
     # Учитель может не иметь 11–12 в назначениях, но якорь группы должен быть параллель 11 или 12
-    if purpose == "subject_group_anchors" and user_data.get("type") == "teacher":
+    include_anchors = False
+    if purpose == "subject_group_anchors" and user_data.get("type") == "teacher" and allowed_grade_ids is not None:
         user = get_user_from_token(user_data, db)
-        if user and compute_show_subject_groups_nav_for_user(db, user):
-            anchor_ids: Set[int] = set()
-            for g in db.query(GradeInDB).all():
-                p = _parallel_int_from_grade_row_local(g)
-                if p in (11, 12):
-                    anchor_ids.add(g.id)
-            if allowed_grade_ids is not None:
-                allowed_grade_ids = allowed_grade_ids | anchor_ids
-
-    # Build query with optional filtering
-    grades_query = db.query(GradeInDB)
-    if allowed_grade_ids is not None:  # Not admin
-        if not allowed_grade_ids:  # Empty set - no access
-            return []
-        grades_query = grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
-    
-    grades = grades_query.all()
-    
+        include_anchors = bool(user and compute_show_subject_groups_nav_for_user(db, user))
+
+    if allowed_grade_ids is not None and not allowed_grade_ids and not include_anchors:
+        return []  # Empty set - no access
+
+    # Условие доступа к классу — и для списка классов, и для подсчёта учеников
+    def grade_filter(grade_id_column):
+        if allowed_grade_ids is None:  # Admin
+            return None
+        condition = grade_id_column.in_(allowed_grade_ids)
+        if include_anchors:
+            anchors = db.query(GradeInDB.id).filter(GradeInDB.parallel_number.in_((11, 12)))
+            condition = or_(condition, grade_id_column.in_(anchors))
+        return condition
+
+    student_counts = db.query(
+        StudentInDB.grade_id.label("grade_id"),
+        func.count(StudentInDB.id).label("actual_student_count"),
+    )
+    students_condition = grade_filter(StudentInDB.grade_id)
+    if students_condition is not None:
+        student_counts = student_counts.filter(students_condition)
+    student_counts = student_counts.group_by(StudentInDB.grade_id).subquery()
+
+    # Классы, число учеников и куратор — одним запросом
+    rows_query = (
+        db.query(
+            GradeInDB.id,
+            GradeInDB.canonical_key,
+            GradeInDB.letter,
+            GradeInDB.parallel,
+            GradeInDB.curator_id,
+            GradeInDB.curator_name,
+            GradeInDB.student_count,
+            func.coalesce(student_counts.c.actual_student_count, 0),
+            UserInDB.id,
+            UserInDB.name,
+            UserInDB.first_name,
+            UserInDB.last_name,
+            UserInDB.email,
+            UserInDB.shanyrak,
+        )
+        .outerjoin(student_counts, student_counts.c.grade_id == GradeInDB.id)
+        .outerjoin(UserInDB, UserInDB.id == GradeInDB.curator_id)
+    )
+    grades_condition = grade_filter(GradeInDB.id)
+    if grades_condition is not None:
+        rows_query = rows_query.filter(grades_condition)
+
     grouped: dict[str, dict] = {}
-    for grade in grades:
-        # Count actual students in this grade
-        actual_student_count = db.query(func.count(StudentInDB.id)).filter(StudentInDB.grade_id == grade.id).scalar()
-        
-        # Get curator information if assigned
+    for (grade_id, canonical, letter, parallel, curator_id, curator_name, student_count, actual_student_count,
+         curator_user_id, name, first_name, last_name, email, shanyrak) in rows_query.order_by(GradeInDB.id):
         curator_info = None
-        if grade.curator_id:
-            curator = db.query(UserInDB).filter(UserInDB.id == grade.curator_id).first()
-            if curator:
-                curator_info = {
-                    "id": curator.id,
-                    "name": curator.name,
-                    "first_name": curator.first_name,
-                    "last_name": curator.last_name,
-                    "email": curator.email,
-                    "shanyrak": curator.shanyrak
-                }
-        
-        canonical, _, canonical_parallel = _normalize_grade_key(grade.grade, grade.parallel)
+        if curator_user_id is not None:
+            curator_info = {
+                "id": curator_user_id,
+                "name": name,
+                "first_name": first_name,
+                "last_name": last_name,
+                "email": email,
+                "shanyrak": shanyrak
+            }
+
         existing = grouped.get(canonical)
         row_payload = {
-            "id": grade.id,
+            "id": grade_id,
             "grade": canonical,
-            "parallel": canonical_parallel or grade.parallel,
-            "curator_id": grade.curator_id,
-            "curator_name": grade.curator_name,
-            "student_count": int(grade.student_count or 0),
+            "parallel": letter or parallel,
+            "curator_id": curator_id,
+            "curator_name": curator_name,
+            "student_count": int(student_count or 0),
             "actual_student_count": int(actual_student_count or 0),
             "curator_info": curator_info
         }
@@ -947,11 +665,11 @@ async def get_all_grades(
             grouped[canonical] = row_payload
 
     result = list(grouped.values())
-    result.sort(key=lambda item: _normalize_grade_key(item["grade"], item["parallel"])[0])
+    result.sort(key=lambda item: item["grade"])
     return result
 
 @router.get("/curators", response_model=List[dict])
-async def get_available_curators(
+def get_available_curators(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -986,7 +704,7 @@ async def get_available_curators(
     return result
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_grade(
+def create_grade(
     record: CreateGrade,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -1037,29 +755,27 @@ async def create_grade(
     
     db.add(db_grade)
     db.commit()
+    if db_grade.curator_id:
+        bump_access_scope_version()
     db.refresh(db_grade)
     
     return {"id": db_grade.id, "message": "Grade created successfully"}
 
 @router.get("/subjects", response_model=List[str])
-async def get_subjects(
-    token: str = Depends(oauth2_scheme),
+def get_subjects(
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get list of all unique subjects"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    allowed_subject_ids = scope.subject_ids
 
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
-
-    base = db.query(SubjectInDB.name).filter(SubjectInDB.is_active == 1)
-    if allowed_subject_ids is not None:
-        if not allowed_subject_ids:
-            return []
-        base = base.filter(SubjectInDB.id.in_(allowed_subject_ids))
-    subjects = base.all()
-    subject_list = [s[0] for s in subjects if s[0] is not None]
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return []
+    subject_list = [
+        s.name for s in cached_subjects(db)
+        if s.is_active and s.name is not None
+        and (allowed_subject_ids is None or s.id in allowed_subject_ids)
+    ]
 
     if not subject_list and allowed_subject_ids is None:
         scores_subjects = db.query(ScoresInDB.subject_name).distinct().all()
@@ -1068,7 +784,7 @@ async def get_subjects(
     return sorted(subject_list)
 
 @router.get("/parallels", response_model=List[str])
-async def get_parallels(
+def get_parallels(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -1093,146 +809,17 @@ async def get_parallels(
     parallel_list.sort(key=lambda x: int(x) if x.isdigit() else 999)
     return parallel_list
 
-def enrich_student_data(
-    student: StudentInDB,
-    db: Session,
-    subject: Optional[str] = None,
-    allowed_subject_ids: Optional[Set[int]] = None,
-):
-    average_percentage = None
-    predicted_average = None
-    danger_level = None
-    delta_percentage = None
-    subject_name = "Все" if not subject else subject
-    semester = None
-    actual_scores = []
-    predicted_scores = []
-    previous_class_score = None
-    score_id = None
-
-    # Teacher subject scoping: empty set means no access to any subject.
-    if allowed_subject_ids is not None and not allowed_subject_ids:
-        return {
-            "id": student.id,
-            "name": student.name,
-            "email": student.email,
-            "grade_id": student.grade_id,
-            "previous_class_score": None,
-            "actual_scores": [],
-            "predicted_scores": [],
-            "avg_percentage": None,
-            "predicted_avg": None,
-            "danger_level": None,
-            "delta_percentage": None,
-            "last_subject": subject_name,
-            "last_semester": None,
-            "score_id": None,
-        }
-
-    if subject:
-        # Fetch specific subject score
-        score_query = db.query(ScoresInDB).filter(
-            ScoresInDB.student_id == student.id,
-            ScoresInDB.subject_name == subject,
-        )
-        if allowed_subject_ids is not None:
-            score_query = score_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-        score = score_query.first()
-
-        if score:
-            score_id = score.id
-            actual_scores = score.actual_scores or []
-            predicted_scores = score.predicted_scores or []
-            previous_class_score = score.previous_class_score
-            delta_percentage = score.delta_percentage
-            danger_level = score.danger_level
-            subject_name = score.subject_name
-            semester = score.semester
-
-            # Calculate averages for this subject
-            valid_actual_scores = []
-            if isinstance(actual_scores, list):
-                valid_actual_scores = [s for s in actual_scores if s is not None and s > 0]
-                if valid_actual_scores:
-                    average_percentage = round(sum(valid_actual_scores) / len(valid_actual_scores), 1)
-            
-            if isinstance(predicted_scores, list):
-                    num_completed = len(valid_actual_scores)
-                    if num_completed > 0 and len(predicted_scores) >= num_completed:
-                        predicted_average = round(sum(predicted_scores[:num_completed]) / num_completed, 1)
-                    elif predicted_scores:
-                        predicted_average = round(sum(predicted_scores) / len(predicted_scores), 1)
-    else:
-        # Aggregated logic
-        scores_query = db.query(ScoresInDB).filter(
-            ScoresInDB.student_id == student.id
-        )
-        if allowed_subject_ids is not None:
-            scores_query = scores_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-        all_scores = scores_query.all()
-
-        all_valid_scores = []
-        overall_danger_level = 0
-        danger_count = 0
-
-        for score in all_scores:
-            if score.actual_scores and isinstance(score.actual_scores, list):
-                valid_scores = [s for s in score.actual_scores if s is not None and s > 0]
-                all_valid_scores.extend(valid_scores)
-
-            if score.danger_level is not None:
-                overall_danger_level += score.danger_level
-                danger_count += 1
-
-        if all_valid_scores:
-            average_percentage = round(sum(all_valid_scores) / len(all_valid_scores), 1)
-
-        if danger_count > 0:
-            danger_level = round(overall_danger_level / danger_count)
-
-        # Get latest score for displaying 'last_subject' if no subject filter is applied
-        latest_query = db.query(ScoresInDB).filter(
-            ScoresInDB.student_id == student.id
-        )
-        if allowed_subject_ids is not None:
-            latest_query = latest_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-        latest_score = latest_query.order_by(ScoresInDB.updated_at.desc()).first()
-        
-        if latest_score:
-            subject_name = latest_score.subject_name
-            semester = latest_score.semester
-
-    return {
-        "id": student.id,
-        "name": student.name,
-        "email": student.email,
-        "grade_id": student.grade_id,
-        "previous_class_score": previous_class_score,
-        "actual_scores": actual_scores,
-        "predicted_scores": predicted_scores,
-        "avg_percentage": average_percentage,
-        "predicted_avg": predicted_average,
-        "danger_level": danger_level,
-        "delta_percentage": delta_percentage,
-        "last_subject": subject_name,
-        "last_semester": semester,
-        "score_id": score_id
-    }
-
-@router.get("/students-list")
-async def get_students_unified(
+@router.get("/students-list", dependencies=[Depends(conditional_get(ANALYTICS_MODELS))])
+@cached_response("grades.students_list")
+def get_students_unified(
     grade_id: Optional[int] = Query(None),
     parallel: Optional[str] = Query(None),
     subject: Optional[str] = Query(None),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    allowed_grade_ids = get_user_allowed_grade_ids(user_data, db)
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
+    allowed_grade_ids = scope.grade_ids
+    allowed_subject_ids = scope.subject_ids
 
     query = db.query(StudentInDB).join(GradeInDB)
 
@@ -1249,65 +836,42 @@ async def get_students_unified(
              (GradeInDB.grade.like(f"{parallel}_%"))
         )
 
-    students = query.all()
+    students = query.order_by(StudentInDB.id).all()
 
     if subject:
-        return [enrich_student_data(student, db, subject, allowed_subject_ids) for student in students]
+        return enrich_students(db, students, subject, allowed_subject_ids)
 
-    summary = []
-    details = []
-    for student in students:
-        # Summary row (aggregated)
-        summary.append(enrich_student_data(student, db, None, allowed_subject_ids))
+    # Summary rows (aggregated) + detail rows (one per subject) — for teachers, only their subjects
+    summary, details = enrich_students_with_details(db, students, allowed_subject_ids)
 
-        # Detail rows (one per subject) — for teachers, only their subjects
-        subj_q = db.query(ScoresInDB.subject_name).filter(
-            ScoresInDB.student_id == student.id
-        )
-        if allowed_subject_ids is not None:
-            subj_q = subj_q.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
-        student_scores = subj_q.distinct().all()
-
-        for (subj_name,) in student_scores:
-            if subj_name:
-                details.append(enrich_student_data(student, db, subj_name, allowed_subject_ids))
-    
     return {
         "summary": summary,
         "details": details
     }
 
 @router.get("/{grade_id}/subjects", response_model=List[str])
-async def get_grade_subjects(
+def get_grade_subjects(
     grade_id: int,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get all subjects available in the system"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    
     # Check access
-    if not check_grade_access(user_data, grade_id, db):
+    if not scope.can_access_grade(grade_id):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
+    allowed_subject_ids = scope.subject_ids
 
     # For teachers, restrict to their assigned subjects only.
     if allowed_subject_ids is not None:
         if not allowed_subject_ids:
             return []
-        rows = db.query(SubjectInDB.name).filter(
-            SubjectInDB.id.in_(allowed_subject_ids),
-            SubjectInDB.is_active == 1,
-        ).all()
-        return [s[0] for s in rows if s[0]]
+        return [s.name for s in cached_subjects(db) if s.is_active and s.id in allowed_subject_ids and s.name]
 
     # Admin/curator: return ALL subjects from the system if available
-    subjects = db.query(SubjectInDB.name).filter(SubjectInDB.is_active == 1).all()
+    subjects = [s.name for s in cached_subjects(db) if s.is_active]
     if subjects:
-        return [s[0] for s in subjects]
+        return subjects
 
     # Fallback to distinct subjects for this grade via students -> scores
     subjects_fallback = db.query(ScoresInDB.subject_name).distinct() \
@@ -1319,32 +883,28 @@ async def get_grade_subjects(
     return [s[0] for s in subjects_fallback]
 
 @router.get("/students/{grade_id}", response_model=List[dict])
-async def get_students_by_grade(
+def get_students_by_grade(
     grade_id: int,
     subject: Optional[str] = Query(None),
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get all students in a specific grade with optional subject filtering"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    
     # Check role-based access
-    if not check_grade_access(user_data, grade_id, db):
+    if not scope.can_access_grade(grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this grade")
 
     grade = db.query(GradeInDB).filter(GradeInDB.id == grade_id).first()
     if not grade:
         raise HTTPException(status_code=404, detail="Grade not found")
 
-    allowed_subject_ids = get_user_allowed_subject_ids(user_data, db)
-    students = db.query(StudentInDB).filter(StudentInDB.grade_id == grade_id).all()
+    allowed_subject_ids = scope.subject_ids
+    students = db.query(StudentInDB).filter(StudentInDB.grade_id == grade_id).order_by(StudentInDB.id).all()
 
-    return [enrich_student_data(student, db, subject, allowed_subject_ids) for student in students]
+    return enrich_students(db, students, subject, allowed_subject_ids)
 
 @router.get("/template")
-async def download_excel_template(
+def download_excel_template(
     grade_id: Optional[int] = None,
     subject_group_id: Optional[int] = None,
     token: str = Depends(oauth2_scheme),
@@ -1397,7 +957,7 @@ async def download_excel_template(
             if grade:
                 filename = f"template_{grade.grade}.xlsx"
 
-        template_content = generate_excel_template(student_names if student_names else None)
+        template_content = run_in_process(generate_excel_template, student_names if student_names else None)
 
         return Response(
             content=template_content,
@@ -1409,18 +969,14 @@ async def download_excel_template(
         raise HTTPException(status_code=500, detail=f"Error generating template: {str(e)}")
 
 @router.get("/{grade_id}", response_model=dict)
-async def get_grade_by_id(
+def get_grade_by_id(
     grade_id: int,
-    token: str = Depends(oauth2_scheme),
+    scope: AccessScope = Depends(get_access_scope),
     db: Session = Depends(get_db)
 ):
     """Get a grade/class by ID"""
-    user_data = verify_access_token(token)
-    if not user_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-    
     # Check role-based access
-    if not check_grade_access(user_data, grade_id, db):
+    if not scope.can_access_grade(grade_id):
         raise HTTPException(status_code=403, detail="You don't have access to this grade")
     
     grade = db.query(GradeInDB).filter(GradeInDB.id == grade_id).first()
@@ -1459,7 +1015,7 @@ async def get_grade_by_id(
     }
 
 @router.put("/{grade_id}", status_code=status.HTTP_200_OK)
-async def update_grade(
+def update_grade(
     grade_id: int,
     update_data: UpdateGrade,
     token: str = Depends(oauth2_scheme),
@@ -1490,6 +1046,8 @@ async def update_grade(
             print(f"Warning: Grade has no attribute {key}")
     
     db.commit()
+    if "curator_id" in update_dict:
+        bump_access_scope_version()
     db.refresh(grade)
     
     print("Updated grade data:", {
@@ -1503,7 +1061,7 @@ async def update_grade(
     return {"message": "Grade updated successfully"}
 
 @router.delete("/{grade_id}", status_code=status.HTTP_200_OK)
-async def delete_grade(
+def delete_grade(
     grade_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -1528,7 +1086,7 @@ async def delete_grade(
     return {"message": "Grade deleted successfully"}
 
 @router.put("/{grade_id}/student-count", status_code=status.HTTP_200_OK)
-async def update_student_count(
+def update_student_count(
     grade_id: int,
     student_count: int = Body(..., embed=True),
     token: str = Depends(oauth2_scheme),
@@ -1560,7 +1118,7 @@ async def update_student_count(
     }
 
 @router.put("/students/{student_id}", status_code=status.HTTP_200_OK)
-async def update_student(
+def update_student(
     student_id: int,
     update_data: UpdateStudent,
     token: str = Depends(oauth2_scheme),
@@ -1608,7 +1166,7 @@ async def update_student(
     }
 
 @router.delete("/students/{student_id}", status_code=status.HTTP_200_OK)
-async def delete_student(
+def delete_student(
     student_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -1636,7 +1194,7 @@ async def delete_student(
     return {"message": "Student deleted successfully"}
 
 @router.get("/debug/students-grades", response_model=dict)
-async def debug_students_grades(
+def debug_students_grades(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -1689,7 +1247,7 @@ async def debug_students_grades(
 
 
 @router.post("/students/", status_code=status.HTTP_201_CREATED)
-async def create_student(
+def create_student(
     student_data: CreateStudent,
     grade_id: int = Body(...),
     token: str = Depends(oauth2_scheme),
@@ -1742,7 +1300,7 @@ async def create_student(
     }
 
 @router.get("/student/{student_id}", response_model=dict)
-async def get_student_by_id(
+def get_student_by_id(
     student_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -1771,10 +1329,11 @@ async def get_student_by_id(
     }
 
 @router.get("/student/{student_id}/scores", response_model=List[dict])
-async def get_student_scores(
+def get_student_scores(
     student_id: int,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_year: str = Depends(current_academic_year),
 ):
     """Get scores for a specific student"""
     user_data = verify_access_token(token)
@@ -1785,7 +1344,6 @@ async def get_student_scores(
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
         
-    current_year = get_current_academic_year(db)
     rows = db.query(ScoresInDB).filter(
         ScoresInDB.student_id == student_id,
         ScoresInDB.academic_year == current_year,
@@ -1796,7 +1354,7 @@ async def get_student_scores(
         key = (row.subject_id, row.subject_group_id)
         grouped.setdefault(key, []).append(row)
 
-    weights = load_prediction_weights_from_db(db)
+    weights = cached_prediction_weights(db)
     result = []
     for grouped_rows in grouped.values():
         merged = _merge_scores_for_display(grouped_rows, weights)
@@ -1820,7 +1378,7 @@ async def get_student_scores(
     return result
 
 @router.put("/scores/{score_id}", status_code=status.HTTP_200_OK)
-async def update_score(
+def update_score(
     score_id: int,
     update_data: UpdateScore,
     token: str = Depends(oauth2_scheme),
@@ -1919,13 +1477,15 @@ async def update_score(
     }
 
 @router.post("/scores", status_code=status.HTTP_201_CREATED)
-async def create_score(
+def create_score(
     student_id: int = Body(...),
     subject_id: int = Body(...),
     subject_group_id: Optional[int] = Body(default=None),
     actual_scores: dict = Body(default=None),
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_year: str = Depends(current_academic_year),
+    weights: Dict[str, float] = Depends(prediction_weights),
 ):
     """Create a new score record for a student - for admins or assigned teachers"""
     user_data = verify_access_token(token)
@@ -1938,7 +1498,7 @@ async def create_score(
         raise HTTPException(status_code=404, detail="Student not found")
     
     # Get subject
-    subject = db.query(SubjectInDB).filter(SubjectInDB.id == subject_id).first()
+    subject = cached_subject(db, subject_id)
     if not subject:
         raise HTTPException(status_code=404, detail="Subject not found")
     
@@ -2001,7 +1561,6 @@ async def create_score(
     else:
         raise HTTPException(status_code=403, detail="Only admins and teachers can create scores")
     
-    current_year = get_current_academic_year(db)
     # Одна запись на ученика / предмет / текущий учебный год (история прошлых лет хранится отдельными строками)
     existing_score = db.query(ScoresInDB).filter(
         ScoresInDB.student_id == student_id,
@@ -2052,7 +1611,6 @@ async def create_score(
             val = actual_scores.get(key, 0)
             scores_list[i-1] = float(val) if val is not None else 0.0
 
-    weights = load_prediction_weights_from_db(db)
     pred_list, dlevel, dpct = recalculate_predicted_and_danger_from_actual(
         scores_list,
         None,
@@ -2060,25 +1618,27 @@ async def create_score(
         weights,
     )
 
-    # Create new score
-    new_score = ScoresInDB(
-        teacher_name=teacher_name,
-        subject_name=subject.name,
-        subject_id=subject_id,
-        student_id=student_id,
-        grade_id=student.grade_id,
-        subject_group_id=subject_group_id,
-        actual_scores=scores_list,
-        predicted_scores=pred_list,
-        danger_level=dlevel,
-        delta_percentage=dpct,
-        semester=1,
-        academic_year=current_year,
+    # Create new score (параллельный запрос с тем же ключом превращается в обновление)
+    score_ids = upsert_scores(
+        db,
+        [{
+            "teacher_name": teacher_name,
+            "subject_name": subject.name,
+            "subject_id": subject_id,
+            "student_id": student_id,
+            "grade_id": student.grade_id,
+            "subject_group_id": subject_group_id,
+            "actual_scores": scores_list,
+            "predicted_scores": pred_list,
+            "danger_level": dlevel,
+            "delta_percentage": dpct,
+            "semester": 1,
+            "academic_year": current_year,
+        }],
+        update_columns=("teacher_name", "grade_id", "actual_scores", "predicted_scores", "danger_level", "delta_percentage"),
     )
-
-    db.add(new_score)
     db.commit()
-    db.refresh(new_score)
+    new_score = db.query(ScoresInDB).filter(ScoresInDB.id == score_ids[0]).first()
 
     return {
         "message": "Score created successfully",
@@ -2097,7 +1657,7 @@ async def create_score(
     }
 
 @router.get("/teacher/my-assignments")
-async def get_teacher_assignments(
+def get_teacher_assignments(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -2124,7 +1684,7 @@ async def get_teacher_assignments(
     
     result = []
     for assignment in assignments:
-        subject = db.query(SubjectInDB).filter(SubjectInDB.id == assignment.subject_id).first()
+        subject = cached_subject(db, assignment.subject_id)
         grade = db.query(GradeInDB).filter(GradeInDB.id == assignment.grade_id).first() if assignment.grade_id else None
         subgroup = db.query(SubgroupInDB).filter(SubgroupInDB.id == assignment.subgroup_id).first() if assignment.subgroup_id else None
         
@@ -2145,13 +1705,15 @@ async def get_teacher_assignments(
     return result
 
 @router.get("/teacher/students")
-async def get_teacher_students(
+def get_teacher_students(
     subject_id: int = Query(...),
     grade_id: Optional[int] = Query(None),
     subgroup_id: Optional[int] = Query(None),
     subject_group_id: Optional[int] = Query(None),
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_year: str = Depends(current_academic_year),
+    weights: Dict[str, float] = Depends(prediction_weights),
 ):
     """Get students that a teacher can grade for a specific subject/grade/subgroup/subject_group"""
     user_data = verify_access_token(token)
@@ -2232,12 +1794,9 @@ async def get_teacher_students(
 
     students = student_query.all()
 
-    current_year = get_current_academic_year(db)
-
     # Get subject info
-    subject = db.query(SubjectInDB).filter(SubjectInDB.id == subject_id).first()
+    subject = cached_subject(db, subject_id)
     
-    weights = load_prediction_weights_from_db(db)
     result = []
     for student in students:
         # Оценка за текущий учебный год (история хранится в других строках)
@@ -2276,8 +1835,264 @@ async def get_teacher_students(
     
     return result
 
+def _resolve_grades_upload(
+    db: Session,
+    user_data: dict,
+    *,
+    grade_id: Optional[int],
+    subject_id: int,
+    subgroup_id: Optional[int],
+    subject_group_id: Optional[int],
+    filename: Optional[str],
+) -> dict:
+    """
+    Права и проверки /grades/upload до чтения файла. Возвращает класс, предмет и (для
+    бесклассовой группы) участников группы — всё, что нужно _import_grades_file.
+    """
+    user_type = user_data.get("type")
+    user_email = user_data.get("sub")
+
+    if user_type not in ["admin", "teacher"]:
+        raise HTTPException(status_code=403, detail="Only admins and teachers can upload grades")
+
+    # Get user_id for teacher permission check
+    user = db.query(UserInDB).filter(UserInDB.email == user_email).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # If subject_group is chosen, it becomes the source of truth for grade/subject scope.
+    # A subject group can be either grade-scoped (within-class subdivision for 7-10 or
+    # an anchored 11/12 elective) OR classless (cross-class 11/12 group with grade_id=None).
+    effective_grade_id = grade_id
+    subject_group = None
+    is_classless_group = False
+    group_member_student_ids: List[int] = []
+    if subject_group_id:
+        subject_group = db.query(SubjectGroupInDB).filter(
+            SubjectGroupInDB.id == subject_group_id,
+            SubjectGroupInDB.subject_id == subject_id,
+            SubjectGroupInDB.is_active == 1
+        ).first()
+        if not subject_group:
+            raise HTTPException(status_code=404, detail="Subject group not found or doesn't belong to the specified subject")
+        if subject_group.grade_id is not None:
+            # Grade-anchored group: override any caller-supplied grade_id
+            effective_grade_id = subject_group.grade_id
+        else:
+            # Classless cross-class group: students span multiple grades; match by membership
+            is_classless_group = True
+            membership_rows = db.query(StudentSubjectGroupMembershipInDB).filter(
+                StudentSubjectGroupMembershipInDB.subject_group_id == subject_group_id,
+                StudentSubjectGroupMembershipInDB.is_active == 1,
+            ).all()
+            group_member_student_ids = [m.student_id for m in membership_rows]
+
+    if effective_grade_id is None and not is_classless_group:
+        raise HTTPException(status_code=400, detail="Specify grade_id or choose subject_group_id")
+
+    # If teacher, check if they have assignment for this subject/grade/subgroup/subject_group
+    if user_type == "teacher":
+        assignment_filters = [
+            TeacherAssignmentInDB.teacher_id == user.id,
+            TeacherAssignmentInDB.subject_id == subject_id,
+            TeacherAssignmentInDB.is_active == 1,
+        ]
+        # For classless groups the concept of per-grade assignment doesn't apply —
+        # the subject_group_id filter below is sufficient.
+        if not is_classless_group:
+            assignment_filters.append(
+                or_(
+                    TeacherAssignmentInDB.grade_id == effective_grade_id,
+                    TeacherAssignmentInDB.grade_id == None
+                )
+            )
+        if subgroup_id:
+            assignment_filters.append(
+                or_(
+                    TeacherAssignmentInDB.subgroup_id == subgroup_id,
+                    TeacherAssignmentInDB.subgroup_id == None
+                )
+            )
+        if subject_group_id:
+            assignment_filters.append(
+                or_(
+                    TeacherAssignmentInDB.subject_group_id == subject_group_id,
+                    TeacherAssignmentInDB.subject_group_id == None
+                )
+            )
+        assignment = db.query(TeacherAssignmentInDB).filter(and_(*assignment_filters)).first()
+
+        if not assignment:
+            raise HTTPException(
+                status_code=403,
+                detail="You don't have permission to upload grades for this subject and class"
+            )
+
+    # Validate file type
+    if not (filename or "").lower().endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
+
+    # Validate grade exists (grade-scoped path only)
+    grade = None
+    if effective_grade_id is not None:
+        grade = db.query(GradeInDB).filter(GradeInDB.id == effective_grade_id).first()
+        if not grade:
+            raise HTTPException(status_code=404, detail="Grade not found")
+
+    # Validate subject exists
+    subject = cached_subject(db, subject_id)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    # Validate subject applicable for grade parallel (skip for classless groups)
+    if grade is not None:
+        try:
+            grade_parallel_int = int(grade.parallel)
+        except Exception:
+            grade_parallel_int = None
+        if grade_parallel_int is not None:
+            applicable = subject.applicable_parallels or []
+            if len(applicable) > 0 and grade_parallel_int not in applicable:
+                raise HTTPException(status_code=400, detail=f"Subject '{subject.name}' is not applicable for parallel {grade.parallel}")
+
+    # Validate subgroup if provided (incompatible with classless groups)
+    if subgroup_id:
+        if is_classless_group:
+            raise HTTPException(status_code=400, detail="Subgroup cannot be combined with a classless subject group")
+        subgroup = db.query(SubgroupInDB).filter(
+            SubgroupInDB.id == subgroup_id,
+            SubgroupInDB.grade_id == effective_grade_id
+        ).first()
+        if not subgroup:
+            raise HTTPException(status_code=404, detail="Subgroup not found or doesn't belong to the specified grade")
+
+    # Validate subject_group consistency with resolved grade (only for grade-anchored groups)
+    if subject_group_id and not is_classless_group:
+        if subject_group is None:
+            raise HTTPException(status_code=404, detail="Subject group not found")
+        if subject_group.grade_id != effective_grade_id:
+            raise HTTPException(status_code=400, detail="Subject group grade mismatch")
+
+    return {
+        "grade_id": effective_grade_id,
+        "subject": subject,
+        "group_member_student_ids": group_member_student_ids if is_classless_group else None,
+    }
+
+
+def _expected_grade_columns(column_aliases: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    expected_columns = {
+        'name': ['фио', 'имя', 'name', 'student', 'студент', 'ученик'],
+        'previous_class': ['процент за 1 предыдущий класс', 'previous class', 'previous year', 'предыдущий класс', 'предыдущий год', 'prev class'],
+        'q1': ['q1', 'четверть 1', 'quarter 1', '1 четверть', 'ч1'],
+        'q2': ['q2', 'четверть 2', 'quarter 2', '2 четверть', 'ч2'],
+        'q3': ['q3', 'четверть 3', 'quarter 3', '3 четверть', 'ч3'],
+        'q4': ['q4', 'четверть 4', 'quarter 4', '4 четверть', 'ч4'],
+        'teacher': ['учитель', 'teacher', 'преподаватель', 'препод']
+    }
+
+    # Override with database mappings if available
+    for field_name, aliases in column_aliases.items():
+        if field_name in expected_columns:
+            expected_columns[field_name] = aliases
+    return expected_columns
+
+
+def _import_grades_file(
+    db: Session,
+    target: dict,
+    path: str,
+    *,
+    subject_id: int,
+    teacher_name: str,
+    semester: int,
+    subgroup_id: Optional[int],
+    subject_group_id: Optional[int],
+    current_year: str,
+    weights: Dict[str, float],
+    column_aliases: Dict[str, List[str]],
+    progress: Optional[ImportJobProgress] = None,
+) -> ExcelUploadResponse:
+    """Разбор файла (в пуле процессов) и запись оценок; target — из _resolve_grades_upload."""
+    progress = progress or ImportJobProgress()
+
+    # Read and parse Excel file (в пуле процессов)
+    parsed_data = run_in_process(parse_excel_grades, path, _expected_grade_columns(column_aliases), weights)
+    progress.phase("writing", rows_total=len(parsed_data['students']))
+
+    # Пакетная запись: ученики и оценки — несколькими запросами в одной транзакции
+    warnings = parsed_data.get('warnings', [])
+    errors = parsed_data.get('errors', [])
+    result = import_parsed_grades(
+        db,
+        parsed_data['students'],
+        weights=weights,
+        subject_id=subject_id,
+        subject_name=target["subject"].name,
+        teacher_name=teacher_name,
+        semester=semester,
+        academic_year=current_year,
+        grade_id=target["grade_id"],
+        subgroup_id=subgroup_id,
+        subject_group_id=subject_group_id,
+        group_member_student_ids=target["group_member_student_ids"],
+    )
+    imported_count = result["imported_count"]
+    errors.extend(result["errors"])
+    danger_distribution = result["danger_distribution"]
+
+    db.commit()
+
+    # Prepare response
+    success = imported_count > 0
+    message = f"Successfully imported {imported_count} student records"
+    if warnings:
+        message += f" with {len(warnings)} warnings"
+    if errors:
+        message += f" and {len(errors)} errors"
+
+    return ExcelUploadResponse(
+        success=success,
+        message=message,
+        imported_count=imported_count,
+        warnings=warnings,
+        errors=errors,
+        danger_distribution={str(k): v for k, v in danger_distribution.items()}
+    )
+
+
+def _run_grades_import_job(db: Session, user_data: dict, params: dict, path: str, progress: ImportJobProgress) -> ExcelUploadResponse:
+    # Проверки повторяются: между постановкой в очередь и запуском могли измениться права и данные
+    target = _resolve_grades_upload(
+        db,
+        user_data,
+        grade_id=params.get("grade_id"),
+        subject_id=params["subject_id"],
+        subgroup_id=params.get("subgroup_id"),
+        subject_group_id=params.get("subject_group_id"),
+        filename=params.get("file_name"),
+    )
+    return _import_grades_file(
+        db,
+        target,
+        path,
+        subject_id=params["subject_id"],
+        teacher_name=params["teacher_name"],
+        semester=params.get("semester", 1),
+        subgroup_id=params.get("subgroup_id"),
+        subject_group_id=params.get("subject_group_id"),
+        current_year=cached_academic_year(db),
+        weights=cached_prediction_weights(db),
+        column_aliases=cached_excel_column_aliases(db),
+        progress=progress,
+    )
+
+
+register_import_handler("grades", _run_grades_import_job)
+
+
 @router.post("/upload", response_model=ExcelUploadResponse)
-async def upload_excel_grades(
+def upload_excel_grades(
     grade_id: Optional[int] = Form(None),
     subject_id: int = Form(...),
     teacher_name: str = Form(...),
@@ -2285,306 +2100,280 @@ async def upload_excel_grades(
     subgroup_id: Optional[int] = Form(None),
     subject_group_id: Optional[int] = Form(None),
     file: UploadFile = File(...),
+    background: bool = Query(False, description="Import as a background job: 202 with job id, poll GET /import-jobs/{id}"),
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
+    current_year: str = Depends(current_academic_year),
+    weights: Dict[str, float] = Depends(prediction_weights),
+    column_aliases: Dict[str, List[str]] = Depends(excel_column_aliases),
 ):
     """
     Upload Excel file with student grades
     Requires: subject_id, teacher_name, file
     Optional: grade_id (if omitted, can be derived from subject_group_id),
     semester (default 1), subgroup_id, subject_group_id
+    With ?background=true the file is imported by a background job (202 + job id)
     """
     try:
         # Verify access (admin or teacher)
         user_data = verify_access_token(token)
         if not user_data:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
-        
-        user_type = user_data.get("type")
-        user_email = user_data.get("sub")
-        
-        if user_type not in ["admin", "teacher"]:
-            raise HTTPException(status_code=403, detail="Only admins and teachers can upload grades")
-        
-        # Get user_id for teacher permission check
-        user = db.query(UserInDB).filter(UserInDB.email == user_email).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # If subject_group is chosen, it becomes the source of truth for grade/subject scope.
-        # A subject group can be either grade-scoped (within-class subdivision for 7-10 or
-        # an anchored 11/12 elective) OR classless (cross-class 11/12 group with grade_id=None).
-        effective_grade_id = grade_id
-        subject_group = None
-        is_classless_group = False
-        group_member_student_ids: List[int] = []
-        if subject_group_id:
-            from schemas.models import SubjectGroupInDB
-            subject_group = db.query(SubjectGroupInDB).filter(
-                SubjectGroupInDB.id == subject_group_id,
-                SubjectGroupInDB.subject_id == subject_id,
-                SubjectGroupInDB.is_active == 1
-            ).first()
-            if not subject_group:
-                raise HTTPException(status_code=404, detail="Subject group not found or doesn't belong to the specified subject")
-            if subject_group.grade_id is not None:
-                # Grade-anchored group: override any caller-supplied grade_id
-                effective_grade_id = subject_group.grade_id
-            else:
-                # Classless cross-class group: students span multiple grades; match by membership
-                is_classless_group = True
-                membership_rows = db.query(StudentSubjectGroupMembershipInDB).filter(
-                    StudentSubjectGroupMembershipInDB.subject_group_id == subject_group_id,
-                    StudentSubjectGroupMembershipInDB.is_active == 1,
-                ).all()
-                group_member_student_ids = [m.student_id for m in membership_rows]
-
-        if effective_grade_id is None and not is_classless_group:
-            raise HTTPException(status_code=400, detail="Specify grade_id or choose subject_group_id")
-
-        # If teacher, check if they have assignment for this subject/grade/subgroup/subject_group
-        if user_type == "teacher":
-            assignment_filters = [
-                TeacherAssignmentInDB.teacher_id == user.id,
-                TeacherAssignmentInDB.subject_id == subject_id,
-                TeacherAssignmentInDB.is_active == 1,
-            ]
-            # For classless groups the concept of per-grade assignment doesn't apply —
-            # the subject_group_id filter below is sufficient.
-            if not is_classless_group:
-                assignment_filters.append(
-                    or_(
-                        TeacherAssignmentInDB.grade_id == effective_grade_id,
-                        TeacherAssignmentInDB.grade_id == None
-                    )
-                )
-            if subgroup_id:
-                assignment_filters.append(
-                    or_(
-                        TeacherAssignmentInDB.subgroup_id == subgroup_id,
-                        TeacherAssignmentInDB.subgroup_id == None
-                    )
-                )
-            if subject_group_id:
-                assignment_filters.append(
-                    or_(
-                        TeacherAssignmentInDB.subject_group_id == subject_group_id,
-                        TeacherAssignmentInDB.subject_group_id == None
-                    )
-                )
-            assignment = db.query(TeacherAssignmentInDB).filter(and_(*assignment_filters)).first()
 
-            if not assignment:
-                raise HTTPException(
-                    status_code=403,
-                    detail="You don't have permission to upload grades for this subject and class"
-                )
-        
-        # Validate file type
-        if not file.filename.lower().endswith(('.xlsx', '.xls')):
-            raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) are allowed")
-        
-        # Validate grade exists (grade-scoped path only)
-        grade = None
-        if effective_grade_id is not None:
-            grade = db.query(GradeInDB).filter(GradeInDB.id == effective_grade_id).first()
-            if not grade:
-                raise HTTPException(status_code=404, detail="Grade not found")
-
-        # Validate subject exists
-        subject = db.query(SubjectInDB).filter(SubjectInDB.id == subject_id).first()
-        if not subject:
-            raise HTTPException(status_code=404, detail="Subject not found")
+        target = _resolve_grades_upload(
+            db,
+            user_data,
+            grade_id=grade_id,
+            subject_id=subject_id,
+            subgroup_id=subgroup_id,
+            subject_group_id=subject_group_id,
+            filename=file.filename,
+        )
 
-        # Validate subject applicable for grade parallel (skip for classless groups)
-        if grade is not None:
-            try:
-                grade_parallel_int = int(grade.parallel)
-            except Exception:
-                grade_parallel_int = None
-            if grade_parallel_int is not None:
-                applicable = subject.applicable_parallels or []
-                if len(applicable) > 0 and grade_parallel_int not in applicable:
-                    raise HTTPException(status_code=400, detail=f"Subject '{subject.name}' is not applicable for parallel {grade.parallel}")
-
-        # Validate subgroup if provided (incompatible with classless groups)
-        subgroup = None
-        if subgroup_id:
-            if is_classless_group:
-                raise HTTPException(status_code=400, detail="Subgroup cannot be combined with a classless subject group")
-            subgroup = db.query(SubgroupInDB).filter(
-                SubgroupInDB.id == subgroup_id,
-                SubgroupInDB.grade_id == effective_grade_id
-            ).first()
-            if not subgroup:
-                raise HTTPException(status_code=404, detail="Subgroup not found or doesn't belong to the specified grade")
-
-        # Validate subject_group consistency with resolved grade (only for grade-anchored groups)
-        if subject_group_id and not is_classless_group:
-            if subject_group is None:
-                raise HTTPException(status_code=404, detail="Subject group not found")
-            if subject_group.grade_id != effective_grade_id:
-                raise HTTPException(status_code=400, detail="Subject group grade mismatch")
-        
-        weights = load_prediction_weights_from_db(db)
-        
-        # Load Excel column mappings from database
-        column_mappings = db.query(ExcelColumnMapping).filter(
-            ExcelColumnMapping.is_active == 1
-        ).all()
-        
-        expected_columns = {
-            'name': ['фио', 'имя', 'name', 'student', 'студент', 'ученик'],
-            'previous_class': ['процент за 1 предыдущий класс', 'previous class', 'previous year', 'предыдущий класс', 'предыдущий год', 'prev class'],
-            'q1': ['q1', 'четверть 1', 'quarter 1', '1 четверть', 'ч1'],
-            'q2': ['q2', 'четверть 2', 'quarter 2', '2 четверть', 'ч2'],
-            'q3': ['q3', 'четверть 3', 'quarter 3', '3 четверть', 'ч3'],
-            'q4': ['q4', 'четверть 4', 'quarter 4', '4 четверть', 'ч4'],
-            'teacher': ['учитель', 'teacher', 'преподаватель', 'препод']
-        }
-        
-        # Override with database mappings if available
-        for mapping in column_mappings:
-            if mapping.field_name in expected_columns and mapping.column_aliases:
-                expected_columns[mapping.field_name] = mapping.column_aliases
-        
-        # Read and parse Excel file
-        file_content = await file.read()
-        parsed_data = parse_excel_grades(file_content, expected_columns, weights)
-        
-        # Process students data
-        imported_count = 0
-        warnings = parsed_data.get('warnings', [])
-        errors = parsed_data.get('errors', [])
-        danger_distribution = {0: 0, 1: 0, 2: 0, 3: 0}
-        current_year = get_current_academic_year(db)
-
-        for student_data in parsed_data['students']:
-            try:
-                student_name = student_data["student_name"]
-                actual_scores = student_data["actual_scores"]
-                previous_class_score = student_data.get("previous_class_score")
-                teacher_percent = student_data.get("teacher_percent")
-
-                predicted_scores, danger_level, percentage_difference = recalculate_predicted_and_danger_from_actual(
-                    actual_scores,
-                    previous_class_score,
-                    teacher_percent,
-                    weights,
-                )
+        if background:
+            job = create_import_job(
+                db,
+                kind="grades",
+                upload=file.file,
+                file_name=file.filename,
+                user_data=user_data,
+                params={
+                    "grade_id": grade_id,
+                    "subject_id": subject_id,
+                    "teacher_name": teacher_name,
+                    "semester": semester,
+                    "subgroup_id": subgroup_id,
+                    "subject_group_id": subject_group_id,
+                    "file_name": file.filename,
+                },
+            )
+            return import_job_accepted(job)
+
+        with upload_on_disk(file.file, suffix=os.path.splitext(file.filename or "")[1] or ".xlsx") as path:
+            return _import_grades_file(
+                db,
+                target,
+                path,
+                subject_id=subject_id,
+                teacher_name=teacher_name,
+                semester=semester,
+                subgroup_id=subgroup_id,
+                subject_group_id=subject_group_id,
+                current_year=current_year,
+                weights=weights,
+                column_aliases=column_aliases,
+            )
 
-                danger_distribution[danger_level] += 1
-                
-                # Find student.
-                # Classless groups: match by name against group members (any grade).
-                # Grade-scoped (including 7-10 subject subgroups): match by name within that grade.
-                db_student = None
-                if is_classless_group:
-                    if group_member_student_ids:
-                        normalized_name = _normalize_student_name(student_name)
-                        if normalized_name:
-                            db_student = db.query(StudentInDB).filter(
-                                StudentInDB.id.in_(group_member_student_ids),
-                                func.lower(func.trim(StudentInDB.name)) == normalized_name.lower(),
-                            ).first()
-                    if not db_student:
-                        errors.append(
-                            f"Student '{student_name}' is not a member of the selected subject group"
-                        )
-                        continue
-                    score_grade_id = db_student.grade_id
-                else:
-                    db_student = _find_existing_student_by_name_grade(
-                        db=db,
-                        grade_id=effective_grade_id,
-                        student_name=student_name,
-                    )
-                    if not db_student:
-                        db_student = StudentInDB(
-                            name=student_name,
-                            grade_id=effective_grade_id,
-                            subgroup_id=subgroup_id,
-                        )
-                        db.add(db_student)
-                        db.commit()
-                        db.refresh(db_student)
-                    else:
-                        if subgroup_id and db_student.subgroup_id != subgroup_id:
-                            db_student.subgroup_id = subgroup_id
-                    score_grade_id = effective_grade_id
-
-                # Одна запись на ученика / предмет / семестр / учебный год / (subject_group)
-                score_query = db.query(ScoresInDB).filter(
-                    ScoresInDB.student_id == db_student.id,
-                    ScoresInDB.subject_id == subject_id,
-                    ScoresInDB.semester == semester,
-                    ScoresInDB.academic_year == current_year,
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred during upload: {str(e)}")
+
+
+def _import_grades_batch(
+    db: Session,
+    user_data: dict,
+    path: str,
+    file_name: str,
+    *,
+    subject_id: Optional[int],
+    teacher_name: str,
+    semester: int,
+    current_year: str,
+    weights: Dict[str, float],
+    column_aliases: Dict[str, List[str]],
+    progress: Optional[ImportJobProgress] = None,
+) -> GradeBatchUploadResponse:
+    """
+    Пакет: книги и листы — в пуле процессов (листы параллельно), запись — по листу в своём
+    savepoint и одним commit в конце. Лист с ошибкой (класс не найден, нет прав, битые данные)
+    попадает в отчёт как failed и не мешает остальным.
+    """
+    progress = progress or ImportJobProgress()
+    default_subject = cached_subject(db, subject_id) if subject_id is not None else None
+    workdir = tempfile.mkdtemp(prefix="grade-batch-")
+    try:
+        books = run_in_process(expand_grade_batch, path, file_name, workdir)
+        sheets = [(book, sheet) for book in books for sheet in book["sheets"]]
+        if len(sheets) > GRADE_BATCH_MAX_SHEETS:
+            raise HTTPException(status_code=400, detail=f"Batch contains more than {GRADE_BATCH_MAX_SHEETS} sheets")
+
+        expected_columns = _expected_grade_columns(column_aliases)
+        parsed_sheets = map_in_process(
+            parse_excel_grades,
+            [(book["path"], expected_columns, weights, sheet, True) for book, sheet in sheets],
+        )
+        progress.phase("writing", rows_total=sum(
+            len(parsed["students"]) for parsed in parsed_sheets if not isinstance(parsed, HTTPException)
+        ))
+
+        reports: List[GradeBatchSheetResult] = [
+            GradeBatchSheetResult(file=book["file"], status="failed", detail=book["error"])
+            for book in books if book["error"]
+        ]
+        grades = grade_index(db)
+        subjects = cached_subjects(db)
+        rows_processed = 0
+        for (book, sheet), parsed in zip(sheets, parsed_sheets):
+            report = GradeBatchSheetResult(file=book["file"], sheet=sheet, status="failed")
+            reports.append(report)
+            if isinstance(parsed, HTTPException):
+                report.detail = str(parsed.detail)
+                continue
+
+            report.warnings = parsed["warnings"]
+            report.errors = list(parsed["errors"])
+            grade, subject = resolve_sheet(parsed["preamble"], sheet, book["file"], grades, subjects)
+            subject = subject or default_subject
+            if grade is not None:
+                report.grade_id, report.grade = grade.id, grade.canonical_key or grade.grade
+            if subject is not None:
+                report.subject_id, report.subject = subject.id, subject.name
+            if grade is None or subject is None:
+                report.detail = "Could not determine the " + ("class" if grade is None else "subject") + \
+                    " from the sheet name, file name or cells above the header"
+                continue
+
+            try:
+                target = _resolve_grades_upload(
+                    db,
+                    user_data,
+                    grade_id=grade.id,
+                    subject_id=subject.id,
+                    subgroup_id=None,
+                    subject_group_id=None,
+                    filename=book["file"],
                 )
-                if subject_group_id is not None:
-                    score_query = score_query.filter(ScoresInDB.subject_group_id == subject_group_id)
-                else:
-                    score_query = score_query.filter(ScoresInDB.subject_group_id.is_(None))
-                db_score = score_query.first()
-
-                if db_score:
-                    db_score.teacher_name = teacher_name
-                    db_score.subject_name = subject.name
-                    db_score.previous_class_score = previous_class_score
-                    db_score.teacher_percent = teacher_percent
-                    db_score.actual_scores = actual_scores
-                    db_score.predicted_scores = predicted_scores
-                    db_score.danger_level = danger_level
-                    db_score.delta_percentage = round(percentage_difference, 1)
-                    db_score.grade_id = score_grade_id
-                    db_score.subgroup_id = subgroup_id
-                    db_score.academic_year = current_year
-                    if subject_group_id is not None:
-                        db_score.subject_group_id = subject_group_id
-                else:
-                    new_score = ScoresInDB(
-                        teacher_name=teacher_name,
+                with db.begin_nested():
+                    result = import_parsed_grades(
+                        db,
+                        parsed["students"],
+                        weights=weights,
+                        subject_id=subject.id,
                         subject_name=subject.name,
-                        subject_id=subject_id,
-                        previous_class_score=previous_class_score,
-                        teacher_percent=teacher_percent,
-                        actual_scores=actual_scores,
-                        predicted_scores=predicted_scores,
-                        danger_level=danger_level,
-                        delta_percentage=round(percentage_difference, 1),
+                        teacher_name=teacher_name,
                         semester=semester,
                         academic_year=current_year,
-                        student_id=db_student.id,
-                        grade_id=score_grade_id,
-                        subgroup_id=subgroup_id,
-                        subject_group_id=subject_group_id,
+                        grade_id=target["grade_id"],
+                        group_member_student_ids=target["group_member_student_ids"],
                     )
-                    db.add(new_score)
-                
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Error processing student {student_data.get('student_name', 'Unknown')}: {str(e)}")
-                continue
-        
+            except HTTPException as exc:
+                report.detail = str(exc.detail)
+            except Exception as exc:
+                report.detail = f"Failed to import sheet: {str(exc)}"
+            else:
+                report.status = "imported"
+                report.imported_count = result["imported_count"]
+                report.errors.extend(result["errors"])
+                report.danger_distribution = {str(k): v for k, v in result["danger_distribution"].items()}
+
+            rows_processed += len(parsed["students"])
+            progress.rows(rows_processed)
+
         db.commit()
-        
-        # Prepare response
-        success = imported_count > 0
-        message = f"Successfully imported {imported_count} student records"
-        if warnings:
-            message += f" with {len(warnings)} warnings"
-        if errors:
-            message += f" and {len(errors)} errors"
-        
-        return ExcelUploadResponse(
-            success=success,
-            message=message,
-            imported_count=imported_count,
-            warnings=warnings,
-            errors=errors,
-            danger_distribution={str(k): v for k, v in danger_distribution.items()}
-        )
-        
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    imported = [report for report in reports if report.status == "imported"]
+    failed = [report for report in reports if report.status == "failed"]
+    imported_count = sum(report.imported_count for report in imported)
+    message = f"Imported {imported_count} student records from {len(imported)} of {len(reports)} sheets"
+    if failed:
+        message += f", {len(failed)} sheets failed"
+
+    return GradeBatchUploadResponse(
+        success=imported_count > 0,
+        message=message,
+        total_sheets=len(reports),
+        imported_sheets=len(imported),
+        failed_sheets=len(failed),
+        imported_count=imported_count,
+        errors=[" / ".join(filter(None, [report.file, report.sheet])) + f": {report.detail}" for report in failed],
+        sheets=reports,
+    )
+
+
+def _run_grades_batch_import_job(db: Session, user_data: dict, params: dict, path: str, progress: ImportJobProgress) -> GradeBatchUploadResponse:
+    return _import_grades_batch(
+        db,
+        user_data,
+        path,
+        params["file_name"],
+        subject_id=params.get("subject_id"),
+        teacher_name=params["teacher_name"],
+        semester=params.get("semester", 1),
+        current_year=cached_academic_year(db),
+        weights=cached_prediction_weights(db),
+        column_aliases=cached_excel_column_aliases(db),
+        progress=progress,
+    )
+
+
+register_import_handler("grades_batch", _run_grades_batch_import_job)
+
+
+@router.post("/upload-batch", response_model=GradeBatchUploadResponse)
+def upload_excel_grades_batch(
+    teacher_name: str = Form(...),
+    semester: int = Form(1),
+    subject_id: Optional[int] = Form(None),
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Import as a background job: 202 with job id, poll GET /import-jobs/{id}"),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+    current_year: str = Depends(current_academic_year),
+    weights: Dict[str, float] = Depends(prediction_weights),
+    column_aliases: Dict[str, List[str]] = Depends(excel_column_aliases),
+):
+    """
+    Whole-school grade upload: a workbook with one sheet per class/subject or a ZIP of such workbooks
+    Class and subject of each sheet are taken from the cells above the header ("Класс: 10А",
+    "Предмет: Физика"), the sheet name or the file name; subject_id is the fallback subject
+    Returns a per-sheet report; with ?background=true — 202 + job id
+    """
+    try:
+        user_data = verify_access_token(token)
+        if not user_data:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        if user_data.get("type") not in ["admin", "teacher"]:
+            raise HTTPException(status_code=403, detail="Only admins and teachers can upload grades")
+
+        extension = os.path.splitext(file.filename or "")[1].lower()
+        if extension not in EXCEL_EXTENSIONS + (".zip",):
+            raise HTTPException(status_code=400, detail="Only Excel files (.xlsx, .xls) or a ZIP of them are allowed")
+        if subject_id is not None and not cached_subject(db, subject_id):
+            raise HTTPException(status_code=404, detail="Subject not found")
+
+        if background:
+            job = create_import_job(
+                db,
+                kind="grades_batch",
+                upload=file.file,
+                file_name=file.filename,
+                user_data=user_data,
+                params={
+                    "subject_id": subject_id,
+                    "teacher_name": teacher_name,
+                    "semester": semester,
+                    "file_name": file.filename,
+                },
+            )
+            return import_job_accepted(job)
+
+        with upload_on_disk(file.file, suffix=extension) as path:
+            return _import_grades_batch(
+                db,
+                user_data,
+                path,
+                file.filename,
+                subject_id=subject_id,
+                teacher_name=teacher_name,
+                semester=semester,
+                current_year=current_year,
+                weights=weights,
+                column_aliases=column_aliases,
+            )
+
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -2592,7 +2381,7 @@ async def upload_excel_grades(
 
 
 @router.post("/admin/recalculate-predictions")
-async def recalculate_all_predictions(
+def recalculate_all_predictions(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -2603,13 +2392,8 @@ async def recalculate_all_predictions(
     
     try:
         weights = load_prediction_weights_from_db(db)
-        scores = db.query(ScoresInDB).all()
-        updated_count = 0
-        
-        for score in scores:
-            if score.actual_scores:
-                _sync_score_prediction_with_actual(score, db)
-                updated_count += 1
+        result = recalculate_all_score_predictions(db, weights)
+        updated_count = result["updated_count"]
         
         db.commit()
         
@@ -2624,7 +2408,7 @@ async def recalculate_all_predictions(
 
 
 @router.get("/admin/invalid-students")
-async def get_invalid_students(
+def get_invalid_students(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -2690,7 +2474,7 @@ async def get_invalid_students(
 
 
 @router.delete("/admin/invalid-students")
-async def delete_invalid_students(
+def delete_invalid_students(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from config import get_db
+from schemas.models import *
+from auth_utils import verify_access_token
+from routes.auth import oauth2_scheme
+from services.import_jobs import import_job_payload
+from typing import List, Optional
+
+router = APIRouter()
+
+
+def import_job_accepted(job: ImportJobInDB) -> JSONResponse:
+    """202 для эндпоинтов загрузки с background=true: id задачи и ссылка для опроса."""
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(import_job_payload(job)),
+        headers={"Location": f"/import-jobs/{job.id}"},
+    )
+
+
+def _current_user(token: str, db: Session) -> tuple:
+    user_data = verify_access_token(token)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user = db.query(UserInDB).filter(UserInDB.email == user_data.get("sub")).first()
+    return user_data, user
+
+
+@router.get("/", response_model=List[ImportJobResponse])
+def get_import_jobs(
+    kind: Optional[str] = Query(None),
+    job_status: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(20, ge=1, le=100),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """Recent import jobs of the current user (admins see all jobs)"""
+    user_data, user = _current_user(token, db)
+
+    query = db.query(ImportJobInDB)
+    if user_data.get("type") != "admin":
+        if not user:
+            return []
+        query = query.filter(ImportJobInDB.created_by == user.id)
+    if kind:
+        query = query.filter(ImportJobInDB.kind == kind)
+    if job_status:
+        query = query.filter(ImportJobInDB.status == job_status)
+
+    jobs = query.order_by(ImportJobInDB.created_at.desc()).limit(limit).all()
+    return [import_job_payload(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=ImportJobResponse)
+def get_import_job(
+    job_id: str,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """
+    Import job status: phase, rows processed, warnings/errors and, when finished,
+    the response of the synchronous endpoint (result) or the error (error).
+    """
+    user_data, user = _current_user(token, db)
+
+    job = db.query(ImportJobInDB).filter(ImportJobInDB.id == job_id).first()
+    # Чужие задачи не раскрываем: для не-админа — тот же 404
+    if not job or (user_data.get("type") != "admin" and (not user or job.created_by != user.id)):
+        raise HTTPException(status_code=404, detail="Import job not found")
+
+    return import_job_payload(job)
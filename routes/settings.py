@@ -4,18 +4,22 @@ from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
 from routes.auth import oauth2_scheme
-from typing import List
+from typing import Dict, List
 
 from services.school_year import (
     get_current_academic_year,
     next_academic_year_label,
-    promote_all_students_to_next_grade,
+    apply_promotion_plan,
+    build_promotion_plan,
 )
+from services.excel_parser import load_prediction_weights_from_db
+from services.reference_data import bump_reference_data_version
+from services.weights_simulation import simulate_prediction_weights
 
 router = APIRouter()
 
 @router.get("/", response_model=SystemSettingsResponse)
-async def get_system_settings(
+def get_system_settings(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -38,13 +42,14 @@ async def get_system_settings(
         )
         db.add(default_settings)
         db.commit()
+        bump_reference_data_version()
         db.refresh(default_settings)
         settings = default_settings
     
     return settings
 
 @router.put("/", response_model=SystemSettingsResponse)
-async def update_system_settings(
+def update_system_settings(
     update_data: UpdateSystemSettings,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -93,13 +98,14 @@ async def update_system_settings(
             setattr(settings, key, value)
     
     db.commit()
+    bump_reference_data_version()
     db.refresh(settings)
     
     return settings
 
 
 @router.post("/advance-academic-year", response_model=AdvanceAcademicYearResponse)
-async def advance_academic_year(
+def advance_academic_year(
     dry_run: bool = Query(False, description="Только проверка, без изменений в БД"),
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -125,7 +131,7 @@ async def advance_academic_year(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    preview = promote_all_students_to_next_grade(db, dry_run=True)
+    preview = build_promotion_plan(db)
     if dry_run:
         return AdvanceAcademicYearResponse(
             dry_run=True,
@@ -145,9 +151,10 @@ async def advance_academic_year(
             },
         )
 
-    promote_all_students_to_next_grade(db, dry_run=False)
+    apply_promotion_plan(db, preview)
     settings.academic_year = next_label
     db.commit()
+    bump_reference_data_version()
     db.refresh(settings)
 
     return AdvanceAcademicYearResponse(
@@ -161,7 +168,7 @@ async def advance_academic_year(
 
 
 @router.get("/available-classes", response_model=AvailableClassesResponse)
-async def get_available_classes(
+def get_available_classes(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -195,7 +202,7 @@ async def get_available_classes(
     )
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_system_settings(
+def create_system_settings(
     settings_data: CreateSystemSettings,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -235,12 +242,38 @@ async def create_system_settings(
     
     db.add(db_settings)
     db.commit()
+    bump_reference_data_version()
     db.refresh(db_settings)
     
     return {"id": db_settings.id, "message": "System settings created successfully"}
 
+def _validate_prediction_weights(weights: Dict[str, float]) -> None:
+    # Validate keys: only current formula keys are allowed
+    required_keys = {'previous_class', 'teacher'}
+    provided_keys = set(weights.keys())
+    extra_keys = provided_keys - required_keys
+    if extra_keys:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unexpected weight keys: {extra_keys}. Allowed keys: {required_keys}"
+        )
+
+    if not required_keys.issubset(provided_keys):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Missing required weight keys. Required: {required_keys}, provided: {provided_keys}"
+        )
+
+    # Validate weights sum to approximately 1.0
+    total = sum(weights.values())
+    if abs(total - 1.0) > 0.01:  # Allow small floating point errors
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Weights must sum to 1.0, but they sum to {total}"
+        )
+
 @router.get("/prediction-weights", response_model=PredictionWeightsResponse)
-async def get_prediction_weights(
+def get_prediction_weights(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -267,13 +300,14 @@ async def get_prediction_weights(
         )
         db.add(default_settings)
         db.commit()
+        bump_reference_data_version()
         db.refresh(default_settings)
         settings = default_settings
     
     return settings
 
 @router.put("/prediction-weights", response_model=PredictionWeightsResponse)
-async def update_prediction_weights(
+def update_prediction_weights(
     update_data: UpdatePredictionWeights,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -286,30 +320,8 @@ async def update_prediction_weights(
     if user_data.get("type") != "admin":
         raise HTTPException(status_code=403, detail="Only admins can update prediction weights")
     
-    # Validate keys: only current formula keys are allowed
     weights = update_data.weights
-    required_keys = {'previous_class', 'teacher'}
-    provided_keys = set(weights.keys())
-    extra_keys = provided_keys - required_keys
-    if extra_keys:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unexpected weight keys: {extra_keys}. Allowed keys: {required_keys}"
-        )
-
-    if not required_keys.issubset(provided_keys):
-        raise HTTPException(
-            status_code=400,
-            detail=f"Missing required weight keys. Required: {required_keys}, provided: {provided_keys}"
-        )
-
-    # Validate weights sum to approximately 1.0
-    total = sum(weights.values())
-    if abs(total - 1.0) > 0.01:  # Allow small floating point errors
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Weights must sum to 1.0, but they sum to {total}"
-        )
+    _validate_prediction_weights(weights)
     
     # Get or create prediction settings
     settings = db.query(PredictionSettings).filter(PredictionSettings.is_active == 1).first()
@@ -326,12 +338,41 @@ async def update_prediction_weights(
             settings.name = update_data.name
     
     db.commit()
+    bump_reference_data_version()
     db.refresh(settings)
     
     return settings
 
+@router.post("/prediction-weights/simulate", response_model=PredictionWeightsSimulationResponse)
+def simulate_prediction_weights_endpoint(
+    simulation: SimulatePredictionWeights,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """
+    What-if: распределение danger_level по классам/предметам при новых весах
+    (текущий учебный год, без изменений в БД). Admin only.
+    """
+    user_data = verify_access_token(token)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    if user_data.get("type") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can simulate prediction weights")
+    
+    _validate_prediction_weights(simulation.weights)
+    total = sum(simulation.weights.values())
+    candidate_weights = {key: value / total for key, value in simulation.weights.items()}
+    
+    return simulate_prediction_weights(
+        db,
+        academic_year=get_current_academic_year(db),
+        current_weights=load_prediction_weights_from_db(db),
+        candidate_weights=candidate_weights,
+    )
+
 @router.get("/excel-mapping", response_model=List[ExcelColumnMappingResponse])
-async def get_excel_column_mappings(
+def get_excel_column_mappings(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -348,7 +389,7 @@ async def get_excel_column_mappings(
     return mappings
 
 @router.put("/excel-mapping/{field_name}", response_model=ExcelColumnMappingResponse)
-async def update_excel_column_mapping(
+def update_excel_column_mapping(
     field_name: str,
     update_data: UpdateExcelColumnMapping,
     token: str = Depends(oauth2_scheme),
@@ -380,12 +421,13 @@ async def update_excel_column_mapping(
         mapping.is_active = update_data.is_active
     
     db.commit()
+    bump_reference_data_version()
     db.refresh(mapping)
     
     return mapping
 
 @router.post("/excel-mapping", status_code=status.HTTP_201_CREATED, response_model=ExcelColumnMappingResponse)
-async def create_excel_column_mapping(
+def create_excel_column_mapping(
     mapping_data: CreateExcelColumnMapping,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -421,6 +463,7 @@ async def create_excel_column_mapping(
     
     db.add(new_mapping)
     db.commit()
+    bump_reference_data_version()
     db.refresh(new_mapping)
     
     return new_mapping
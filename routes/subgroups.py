@@ -9,7 +9,7 @@ from typing import List
 router = APIRouter()
 
 @router.get("/{grade_id}", response_model=List[SubgroupResponse])
-async def get_subgroups_by_grade(
+def get_subgroups_by_grade(
     grade_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -32,7 +32,7 @@ async def get_subgroups_by_grade(
     return subgroups
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_subgroup(
+def create_subgroup(
     subgroup: CreateSubgroup,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -76,7 +76,7 @@ async def create_subgroup(
     return {"id": db_subgroup.id, "message": "Subgroup created successfully"}
 
 @router.put("/{subgroup_id}", status_code=status.HTTP_200_OK)
-async def update_subgroup(
+def update_subgroup(
     subgroup_id: int,
     update_data: UpdateSubgroup,
     token: str = Depends(oauth2_scheme),
@@ -122,7 +122,7 @@ async def update_subgroup(
     return {"message": "Subgroup updated successfully"}
 
 @router.delete("/{subgroup_id}", status_code=status.HTTP_200_OK)
-async def delete_subgroup(
+def delete_subgroup(
     subgroup_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -160,7 +160,7 @@ async def delete_subgroup(
     return {"message": "Subgroup deleted successfully"}
 
 @router.get("/{subgroup_id}/students", response_model=List[dict])
-async def get_subgroup_students(
+def get_subgroup_students(
     subgroup_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
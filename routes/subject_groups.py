@@ -9,6 +9,7 @@ from role_utils import (
     get_user_allowed_grade_ids,
     get_user_allowed_subject_ids,
     get_user_allowed_subject_group_ids,
+    bump_access_scope_version,
 )
 from typing import List, Optional
 
@@ -17,10 +18,9 @@ GROUP_NAME_PATTERN = re.compile(r"^Группа \d+$")
 
 
 def parallel_int_from_grade_row(grade: Optional[GradeInDB]) -> Optional[int]:
-    if not grade or grade.grade is None:
+    if not grade:
         return None
-    m = re.match(r"^(\d+)", str(grade.grade).strip())
-    return int(m.group(1)) if m else None
+    return grade.parallel_number
 
 
 def _grade_allows_subject_groups(grade: GradeInDB) -> bool:
@@ -39,9 +39,7 @@ def _grade_allows_classless_groups(grade: GradeInDB) -> bool:
 
 
 def _canonical_grade_name(grade: GradeInDB) -> str:
-    from routes.grades import _normalize_grade_key
-    canonical, _, _ = _normalize_grade_key(grade.grade, grade.parallel)
-    return canonical
+    return grade.canonical_key
 
 
 def _serialize_subject_group(db: Session, g: SubjectGroupInDB) -> dict:
@@ -147,21 +145,22 @@ def _ensure_teacher_assignment_for_subject_group(
     )
     db.add(row)
     db.commit()
+    bump_access_scope_version()
 
 
 def _group_anchor_parallel(db: Session, group: SubjectGroupInDB) -> Optional[int]:
     if group.grade_id is None:
         return None
-    g = db.query(GradeInDB).filter(GradeInDB.id == group.grade_id).first()
-    return parallel_int_from_grade_row(g)
+    return db.query(GradeInDB.parallel_number).filter(GradeInDB.id == group.grade_id).scalar()
 
 
 def _student_parallel(db: Session, student_id: int) -> Optional[int]:
-    st = db.query(StudentInDB).filter(StudentInDB.id == student_id).first()
-    if not st:
-        return None
-    g = db.query(GradeInDB).filter(GradeInDB.id == st.grade_id).first()
-    return parallel_int_from_grade_row(g)
+    return (
+        db.query(GradeInDB.parallel_number)
+        .join(StudentInDB, StudentInDB.grade_id == GradeInDB.id)
+        .filter(StudentInDB.id == student_id)
+        .scalar()
+    )
 
 
 def _can_teacher_manage_group(db: Session, user: UserInDB, group: SubjectGroupInDB) -> bool:
@@ -171,7 +170,7 @@ def _can_teacher_manage_group(db: Session, user: UserInDB, group: SubjectGroupIn
 
 
 @router.get("/", response_model=List[SubjectGroupResponse])
-async def get_subject_groups(
+def get_subject_groups(
     grade_id: Optional[int] = Query(None),
     subject_id: Optional[int] = Query(None),
     token: str = Depends(oauth2_scheme),
@@ -205,7 +204,7 @@ async def get_subject_groups(
 
 
 @router.get("/my", response_model=List[SubjectGroupResponse])
-async def get_my_subject_groups(
+def get_my_subject_groups(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
 ):
@@ -241,7 +240,7 @@ async def get_my_subject_groups(
 
 
 @router.get("/by-grade/{grade_id}", response_model=List[SubjectGroupResponse])
-async def get_subject_groups_by_grade(
+def get_subject_groups_by_grade(
     grade_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -278,7 +277,7 @@ async def get_subject_groups_by_grade(
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_subject_group(
+def create_subject_group(
     data: CreateSubjectGroup,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -327,12 +326,13 @@ async def create_subject_group(
     )
     db.add(db_group)
     db.commit()
+    bump_access_scope_version()
     db.refresh(db_group)
     return {"id": db_group.id, "message": "Subject group created successfully"}
 
 
 @router.post("/teacher", status_code=status.HTTP_201_CREATED)
-async def create_subject_group_teacher(
+def create_subject_group_teacher(
     data: CreateTeacherSubjectGroup,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -385,6 +385,7 @@ async def create_subject_group_teacher(
     )
     db.add(db_group)
     db.commit()
+    bump_access_scope_version()
     db.refresh(db_group)
 
     _ensure_teacher_assignment_for_subject_group(db, user.id, data.subject_id, db_group.id)
@@ -393,7 +394,7 @@ async def create_subject_group_teacher(
 
 
 @router.put("/{group_id}", status_code=status.HTTP_200_OK)
-async def update_subject_group(
+def update_subject_group(
     group_id: int,
     update_data: UpdateSubjectGroup,
     token: str = Depends(oauth2_scheme),
@@ -438,12 +439,13 @@ async def update_subject_group(
         if hasattr(group, key):
             setattr(group, key, value)
     db.commit()
+    bump_access_scope_version()
     db.refresh(group)
     return {"message": "Subject group updated successfully"}
 
 
 @router.delete("/{group_id}", status_code=status.HTTP_200_OK)
-async def delete_subject_group(
+def delete_subject_group(
     group_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -468,6 +470,7 @@ async def delete_subject_group(
 
     group.is_active = 0
     db.commit()
+    bump_access_scope_version()
     return {"message": "Subject group deleted successfully"}
 
 
@@ -480,7 +483,7 @@ def _require_group_manage_members(db: Session, user_data: dict, user: UserInDB,
 
 
 @router.get("/{group_id}/members", response_model=List[SubjectGroupMemberResponse])
-async def get_subject_group_members(
+def get_subject_group_members(
     group_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -525,7 +528,7 @@ async def get_subject_group_members(
 
 
 @router.post("/{group_id}/members", status_code=status.HTTP_200_OK)
-async def add_subject_group_members(
+def add_subject_group_members(
     group_id: int,
     body: SubjectGroupMembersBulk,
     token: str = Depends(oauth2_scheme),
@@ -591,11 +594,12 @@ async def add_subject_group_members(
         added += 1
 
     db.commit()
+    bump_access_scope_version()
     return {"message": "Members updated", "added_or_reactivated": added, "errors": errors}
 
 
 @router.delete("/{group_id}/members/{student_id}", status_code=status.HTTP_200_OK)
-async def remove_subject_group_member(
+def remove_subject_group_member(
     group_id: int,
     student_id: int,
     token: str = Depends(oauth2_scheme),
@@ -628,6 +632,7 @@ async def remove_subject_group_member(
 
     row.is_active = 0
     db.commit()
+    bump_access_scope_version()
     return {"message": "Member removed from group"}
 
 
@@ -636,7 +641,7 @@ def _grade_display_name(g: GradeInDB) -> str:
 
 
 @router.get("/{group_id}/parallel-students", response_model=List[SubjectGroupParallelStudentItem])
-async def get_subject_group_parallel_students(
+def get_subject_group_parallel_students(
     group_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -656,8 +661,7 @@ async def get_subject_group_parallel_students(
 
     _require_group_manage_members(db, user_data, user, group)
 
-    all_grades = db.query(GradeInDB).all()
-    grade_ids = [g.id for g in all_grades if parallel_int_from_grade_row(g) in (11, 12)]
+    grade_ids = [gid for (gid,) in db.query(GradeInDB.id).filter(GradeInDB.parallel_number.in_((11, 12)))]
     if not grade_ids:
         return []
 
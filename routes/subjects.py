@@ -4,12 +4,18 @@ from config import get_db
 from schemas.models import *
 from auth_utils import verify_access_token
 from routes.auth import oauth2_scheme
+from services.reference_data import bump_reference_data_version
+from etag_utils import SUBJECT_MODELS, conditional_get
 from typing import List
 
 router = APIRouter()
 
-@router.get("/", response_model=List[SubjectResponse])
-async def get_all_subjects(
+@router.get(
+    "/",
+    response_model=List[SubjectResponse],
+    dependencies=[Depends(conditional_get(SUBJECT_MODELS))],
+)
+def get_all_subjects(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -22,7 +28,7 @@ async def get_all_subjects(
     return subjects
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_subject(
+def create_subject(
     subject: CreateSubject,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -57,12 +63,13 @@ async def create_subject(
     
     db.add(db_subject)
     db.commit()
+    bump_reference_data_version()
     db.refresh(db_subject)
     
     return {"id": db_subject.id, "message": "Subject created successfully"}
 
 @router.get("/{subject_id}", response_model=SubjectResponse)
-async def get_subject(
+def get_subject(
     subject_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -79,7 +86,7 @@ async def get_subject(
     return subject
 
 @router.put("/{subject_id}", status_code=status.HTTP_200_OK)
-async def update_subject(
+def update_subject(
     subject_id: int,
     update_data: UpdateSubject,
     token: str = Depends(oauth2_scheme),
@@ -122,12 +129,13 @@ async def update_subject(
             setattr(subject, key, value)
     
     db.commit()
+    bump_reference_data_version()
     db.refresh(subject)
     
     return {"message": "Subject updated successfully"}
 
 @router.delete("/{subject_id}", status_code=status.HTTP_200_OK)
-async def delete_subject(
+def delete_subject(
     subject_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -148,5 +156,6 @@ async def delete_subject(
     # Hard delete - physically remove from database
     db.delete(subject)
     db.commit()
+    bump_reference_data_version()
     
     return {"message": "Subject deleted successfully"}
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Body
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
@@ -9,11 +9,13 @@ from datetime import timedelta
 from typing import List, Optional, Tuple
 import re
 from routes.auth import oauth2_scheme
+from role_utils import bump_access_scope_version
+from services.reference_data import bump_reference_data_version
 
 router = APIRouter()
 
 @router.get("/", response_model=List[dict])
-async def get_all_users(
+def get_all_users(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -48,7 +50,7 @@ async def get_all_users(
     return result
 
 @router.get("/by-type/{user_type}", response_model=List[dict])
-async def get_users_by_type(
+def get_users_by_type(
     user_type: str,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -121,7 +123,7 @@ async def get_users_by_type(
     return result
 
 @router.get("/{user_id}", response_model=dict)
-async def get_user(
+def get_user(
     user_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -154,7 +156,7 @@ class UserCreate(BaseModel):
     type: str
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_user(
+def create_user(
     user_data: UserCreate,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -185,6 +187,7 @@ async def create_user(
     
     db.add(new_user)
     db.commit()
+    bump_access_scope_version()
     db.refresh(new_user)
     
     return {
@@ -199,7 +202,7 @@ class UserUpdate(BaseModel):
     type: Optional[str] = None
 
 @router.put("/{user_id}", status_code=status.HTTP_200_OK)
-async def update_user(
+def update_user(
     user_id: int,
     update_data: UserUpdate,
     token: str = Depends(oauth2_scheme),
@@ -241,6 +244,7 @@ async def update_user(
         user.hashed_password = hash_password(update_data.password)
     
     db.commit()
+    bump_access_scope_version()
     db.refresh(user)
     
     return {
@@ -248,7 +252,7 @@ async def update_user(
     }
 
 @router.delete("/{user_id}", status_code=status.HTTP_200_OK)
-async def delete_user(
+def delete_user(
     user_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
@@ -272,6 +276,7 @@ async def delete_user(
     
     db.delete(user)
     db.commit()
+    bump_access_scope_version()
     
     return {
         "message": "User deleted successfully"
@@ -280,6 +285,12 @@ async def delete_user(
 from fastapi import File, UploadFile
 import openpyxl
 import io
+import os
+from services.excel_stream import upload_on_disk
+from services.process_pool import run_in_process
+from services.roster_parser import parse_teachers_workbook
+from services.import_jobs import ImportJobProgress, create_import_job, register_import_handler
+from routes.import_jobs import import_job_accepted
 
 class BulkUploadRowResult(BaseModel):
     row: int
@@ -402,84 +413,32 @@ def _get_or_create_subject_group(db: Session, grade_id: int, subject_id: int, na
     return new_group
 
 
-@router.post("/bulk-upload-teachers", response_model=BulkUploadResult)
-async def bulk_upload_teachers(
-    file: UploadFile = File(...),
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    """
-    Bulk upload teachers from Excel file.
-    Expected columns: ФИО | Email | Классы (через запятую) | Предмет
-    A teacher with multiple subjects appears on multiple rows (same ФИО/Email, different subject/classes).
-    """
-    admin_data = verify_access_token(token)
-    if not admin_data:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+def _import_teachers_file(
+    db: Session,
+    user_data: dict,
+    path: str,
+    progress: Optional[ImportJobProgress] = None,
+) -> BulkUploadResult:
+    """Разбор шаблона учителей (в пуле процессов) и запись учителей и назначений одной транзакцией."""
+    progress = progress or ImportJobProgress()
 
-    if admin_data.get("type") != "admin":
-        raise HTTPException(status_code=403, detail="Only admins can bulk upload users")
-
-    if not file.filename.endswith((".xlsx", ".xls")):
-        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
-
-    creator_user = db.query(UserInDB).filter(UserInDB.email == admin_data.get("sub")).first()
+    creator_user = db.query(UserInDB).filter(UserInDB.email == user_data.get("sub")).first()
     if not creator_user:
-        creator_user = db.query(UserInDB).filter(UserInDB.id == admin_data.get("id")).first()
-    creator_id = creator_user.id if creator_user else admin_data.get("id", 1)
-
-    # Load list of valid subjects from the "Предметы" sheet (if present)
-    valid_subjects: set = set()
+        creator_user = db.query(UserInDB).filter(UserInDB.id == user_data.get("id")).first()
+    creator_id = creator_user.id if creator_user else user_data.get("id", 1)
 
     try:
-        contents = await file.read()
-        workbook = openpyxl.load_workbook(io.BytesIO(contents))
-
-        # Collect valid subjects from the reference sheet
-        for sname in ("Предметы", "предметы", "Subjects"):
-            if sname in workbook.sheetnames:
-                subj_sheet = workbook[sname]
-                for row in subj_sheet.iter_rows(min_row=2, values_only=True):
-                    val = row[0] if row else None
-                    if val and str(val).strip():
-                        valid_subjects.add(str(val).strip())
-                break
-
-        # Find the teachers data sheet (first sheet, or named "Учителя"/"Teachers")
-        sheet = workbook.active
-        for sname in ("Учителя", "учителя", "Teachers"):
-            if sname in workbook.sheetnames:
-                sheet = workbook[sname]
-                break
+        # Разбор файла — в пуле процессов; здесь только запись в БД
+        parsed = run_in_process(parse_teachers_workbook, path)
+        progress.phase("writing", rows_total=len(parsed["rows"]))
+        # List of valid subjects from the "Предметы" sheet (if present)
+        valid_subjects = set(parsed["valid_subjects"])
 
         created_users = []
         errors = []
         row_results = []
         total_processed = 0
 
-        # Detect header row: find row containing "ФИО"
-        header_row_idx = 1
-        for check_row_idx, row in enumerate(sheet.iter_rows(min_row=1, max_row=10, values_only=True), start=1):
-            if row and any(cell and "фио" in str(cell).strip().lower() for cell in row):
-                header_row_idx = check_row_idx
-                break
-
-        # Build column index map from header
-        header = [str(c).strip().lower() if c else "" for c in next(sheet.iter_rows(min_row=header_row_idx, max_row=header_row_idx, values_only=True))]
-        col_map = {}
-        for idx, h in enumerate(header):
-            if "фио" in h or h == "имя" or h == "name":
-                col_map["fio"] = idx
-            elif "email" in h or "почта" in h or "e-mail" in h:
-                col_map["email"] = idx
-            elif "класс" in h or "class" in h:
-                col_map["classes"] = idx
-            elif "предмет" in h or "subject" in h:
-                col_map["subject"] = idx
-
-        if "fio" not in col_map or "email" not in col_map:
-            raise HTTPException(status_code=400, detail="Не найдены обязательные столбцы: ФИО и Email. Проверьте заголовки.")
-
         try:
             # ── Overwrite mode: deactivate ALL existing teacher assignments ──
             db.query(TeacherAssignmentInDB).filter(
@@ -487,17 +446,10 @@ async def bulk_upload_teachers(
             ).update({"is_active": 0})
             db.flush()
 
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=header_row_idx + 1, values_only=True), start=header_row_idx + 1):
-                if not row or all(cell is None or str(cell).strip() == "" for cell in row):
-                    continue
-
+            for row_idx, fio, email, class_cell, subject_cell in parsed["rows"]:
+                progress.rows(total_processed)
                 total_processed += 1
 
-                fio = str(row[col_map["fio"]]).strip() if col_map.get("fio") is not None and len(row) > col_map["fio"] and row[col_map["fio"]] else None
-                email = str(row[col_map["email"]]).strip().lower() if col_map.get("email") is not None and len(row) > col_map["email"] and row[col_map["email"]] else None
-                class_cell = row[col_map["classes"]] if col_map.get("classes") is not None and len(row) > col_map["classes"] else None
-                subject_cell = str(row[col_map["subject"]]).strip() if col_map.get("subject") is not None and len(row) > col_map["subject"] and row[col_map["subject"]] else None
-
                 if not fio or not email:
                     err = {"row": row_idx, "error": "Отсутствуют обязательные поля (ФИО или Email)", "data": {"fio": fio, "email": email}}
                     errors.append(err)
@@ -623,6 +575,8 @@ async def bulk_upload_teachers(
 
             # Single commit at the end — all or nothing
             db.commit()
+            bump_access_scope_version()
+            bump_reference_data_version()
 
         except HTTPException:
             db.rollback()
@@ -649,13 +603,54 @@ async def bulk_upload_teachers(
         raise HTTPException(status_code=500, detail=f"Failed to process Excel file: {str(e)}")
 
 
+def _run_teachers_import_job(db: Session, user_data: dict, params: dict, path: str, progress: ImportJobProgress) -> BulkUploadResult:
+    # Роль — из БД на момент запуска (import_jobs._job_user_data): импорт снимает все назначения учителей
+    if user_data.get("type") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can bulk upload users")
+    return _import_teachers_file(db, user_data, path, progress)
+
+
+register_import_handler("teachers", _run_teachers_import_job)
+
+
+@router.post("/bulk-upload-teachers", response_model=BulkUploadResult)
+def bulk_upload_teachers(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Import as a background job: 202 with job id, poll GET /import-jobs/{id}"),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """
+    Bulk upload teachers from Excel file.
+    Expected columns: ФИО | Email | Классы (через запятую) | Предмет
+    A teacher with multiple subjects appears on multiple rows (same ФИО/Email, different subject/classes).
+    With ?background=true the file is imported by a background job (202 + job id).
+    """
+    admin_data = verify_access_token(token)
+    if not admin_data:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    if admin_data.get("type") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can bulk upload users")
+
+    if not file.filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
+
+    if background:
+        job = create_import_job(db, kind="teachers", upload=file.file, file_name=file.filename, user_data=admin_data)
+        return import_job_accepted(job)
+
+    with upload_on_disk(file.file, suffix=os.path.splitext(file.filename)[1]) as path:
+        return _import_teachers_file(db, admin_data, path)
+
+
 from fastapi.responses import StreamingResponse
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.worksheet.datavalidation import DataValidation
 
 
 @router.get("/teachers-template")
-async def download_teachers_template(
+def download_teachers_template(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -1,10 +1,11 @@
-from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Index, Text
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Index, Text, event, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List, Dict, Any
+from key_utils import grade_key_columns, student_name_key
 
 Base = declarative_base()
 
@@ -35,6 +36,10 @@ class GradeInDB(Base):
     id = Column(Integer, primary_key=True, index=True)
     grade = Column(String(50), nullable=False, index=True)
     parallel = Column(String(50), nullable=False, index=True)
+    # Вычисляются из grade/parallel (key_utils.normalize_grade_key): «10 А» → 10А / 10 / А
+    canonical_key = Column(String(101), nullable=True, index=True)
+    parallel_number = Column(Integer, nullable=True)
+    letter = Column(String(50), nullable=True)
     curator_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
     curator_name = Column(String(255), nullable=True, index=True)  # Keep for backward compatibility
     student_count = Column(Integer, default=0)
@@ -54,13 +59,26 @@ class GradeInDB(Base):
     # Composite index for better query performance
     __table_args__ = (
         Index('ix_grades_grade_parallel', 'grade', 'parallel'),
+        Index('ix_grades_parallel_number_letter', 'parallel_number', 'letter'),
     )
 
+# canonical_key / parallel_number / letter всегда вычисляются из grade и parallel
+@event.listens_for(GradeInDB.grade, "set")
+def _sync_grade_keys_from_grade(target, value, oldvalue, initiator):
+    for key, key_value in grade_key_columns(value, target.parallel).items():
+        setattr(target, key, key_value)
+
+@event.listens_for(GradeInDB.parallel, "set")
+def _sync_grade_keys_from_parallel(target, value, oldvalue, initiator):
+    for key, key_value in grade_key_columns(target.grade, value).items():
+        setattr(target, key, key_value)
+
 class StudentInDB(Base):
     __tablename__ = "students"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, index=True)
+    normalized_name = Column(String(255), nullable=True)  # key_utils.student_name_key(name), для сопоставления при импорте
     email = Column(String(255), nullable=True, index=True)
     student_id_number = Column(String(50), nullable=True, unique=True, index=True)
     phone = Column(String(20), nullable=True)
@@ -81,6 +99,15 @@ class StudentInDB(Base):
     scores = relationship("ScoresInDB", back_populates="student", cascade="all, delete-orphan")
     subject_group_memberships = relationship("StudentSubjectGroupMembershipInDB", back_populates="student", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index('ix_students_grade_normalized_name', 'grade_id', 'normalized_name'),
+    )
+
+# normalized_name всегда вычисляется из name (ORM: конструктор, присваивание, setattr)
+@event.listens_for(StudentInDB.name, "set")
+def _sync_student_normalized_name(target, value, oldvalue, initiator):
+    target.normalized_name = student_name_key(value)
+
 class ScoresInDB(Base):
     __tablename__ = "scores"
 
@@ -117,6 +144,57 @@ class ScoresInDB(Base):
         Index('ix_scores_predicted_scores_gin', 'predicted_scores', postgresql_using='gin'),
         Index('ix_scores_student_subject', 'student_id', 'subject_name'),
         Index('ix_scores_grade_semester', 'grade_id', 'semester'),
+        Index('ix_scores_danger_year_student', 'danger_level', 'academic_year', 'student_id'),
+        # Одна запись на ученика / предмет / семестр / учебный год / (subject_group); NULL == NULL
+        Index(
+            'uq_scores_identity',
+            'student_id',
+            text('COALESCE(subject_id, 0)'),
+            'semester',
+            'academic_year',
+            text('COALESCE(subject_group_id, 0)'),
+            unique=True,
+        ),
+    )
+
+class DataVersionInDB(Base):
+    """
+    Версия данных таблицы для ETag и кэша ответов. Увеличивается триггером при commit каждой
+    транзакции, изменившей таблицу (миграция q3r4s5t6u7v8), поэтому порядок версий — порядок commit.
+    """
+    __tablename__ = "data_versions"
+
+    table_name = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class ScoreDangerRollupInDB(Base):
+    """
+    Сводка по оценкам: класс (scores.grade_id) × предмет × учебный год × danger_level.
+    Поддерживается триггерами на scores (миграция n0p1q2r3s4t5) в той же транзакции, что и запись оценок.
+    """
+    __tablename__ = "score_danger_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Без внешних ключей: каскадное удаление оценок само обнуляет и удаляет строки сводки
+    grade_id = Column(Integer, nullable=False)
+    subject_id = Column(Integer, nullable=True)
+    subject_name = Column(String(100), nullable=False)
+    academic_year = Column(String(10), nullable=False)
+    danger_level = Column(Integer, nullable=False)
+    score_count = Column(Integer, nullable=False, default=0)
+    delta_sum = Column(Float, nullable=False, default=0.0)  # сумма непустых delta_percentage
+    delta_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index(
+            'uq_score_danger_rollup_key',
+            'grade_id',
+            text('COALESCE(subject_id, 0)'),
+            'subject_name',
+            'academic_year',
+            'danger_level',
+            unique=True,
+        ),
     )
 
 class SubjectInDB(Base):
@@ -518,6 +596,31 @@ class AchievementInDB(Base):
     student = relationship("StudentInDB", back_populates="achievements")
     awarder = relationship("UserInDB", foreign_keys=[awarded_by])
 
+class ImportJobInDB(Base):
+    """Фоновый импорт Excel (services/import_jobs.py): состояние переживает перезапуск воркера."""
+    __tablename__ = "import_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex — клиент опрашивает GET /import-jobs/{id}
+    kind = Column(String(32), nullable=False, index=True)  # "grades", "students", "teachers"
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued | running | succeeded | failed
+    phase = Column(String(20), nullable=False, default="queued")  # queued | parsing | writing | done
+    file_name = Column(String(255), nullable=True)
+    file_path = Column(String(500), nullable=True)  # копия загруженного файла, удаляется по завершении
+    params = Column(JSONB, nullable=False, default={})  # поля формы эндпоинта
+    user_data = Column(JSONB, nullable=False, default={})  # claims токена автора (без самого токена)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    rows_total = Column(Integer, nullable=True)
+    rows_processed = Column(Integer, nullable=False, default=0)
+    warnings = Column(JSONB, nullable=False, default=[])
+    errors = Column(JSONB, nullable=False, default=[])
+    result = Column(JSONB, nullable=True)  # ответ синхронного эндпоинта (ExcelUploadResponse и т.п.)
+    error = Column(JSONB, nullable=True)  # {"status_code": ..., "detail": ...} для status = failed
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 
 
 # ==================== PYDANTIC MODELS FOR NEW ENTITIES ====================
@@ -728,6 +831,49 @@ class ExcelUploadResponse(BaseModel):
     errors: List[str] = []
     danger_distribution: Dict[str, int] = {}
 
+class GradeBatchSheetResult(BaseModel):
+    file: str
+    sheet: Optional[str] = None
+    status: str  # imported | failed
+    grade_id: Optional[int] = None
+    grade: Optional[str] = None
+    subject_id: Optional[int] = None
+    subject: Optional[str] = None
+    imported_count: int = 0
+    warnings: List[str] = []
+    errors: List[str] = []
+    danger_distribution: Dict[str, int] = {}
+    detail: Optional[str] = None  # причина для failed
+
+class GradeBatchUploadResponse(BaseModel):
+    success: bool
+    message: str
+    total_sheets: int
+    imported_sheets: int
+    failed_sheets: int
+    imported_count: int
+    warnings: List[str] = []
+    errors: List[str] = []  # «файл / лист: причина» для каждого failed
+    sheets: List[GradeBatchSheetResult] = []
+
+class ImportJobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    phase: str
+    file_name: Optional[str] = None
+    rows_total: Optional[int] = None
+    rows_processed: int = 0
+    warnings: List[Any] = []
+    errors: List[Any] = []
+    result: Optional[Dict[str, Any]] = None  # для kind = "grades" — ExcelUploadResponse, "grades_batch" — GradeBatchUploadResponse
+    error: Optional[Dict[str, Any]] = None
+    attempts: int = 0
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 class PredictionWeightsResponse(BaseModel):
     id: int
     name: str
@@ -743,6 +889,23 @@ class UpdatePredictionWeights(BaseModel):
     weights: Dict[str, float]
     name: Optional[str] = None
 
+class SimulatePredictionWeights(BaseModel):
+    weights: Dict[str, float]
+
+class PredictionWeightsSimulationResponse(BaseModel):
+    """Что изменится при новых весах (по оценкам текущего учебного года, без записи в БД)."""
+    academic_year: str
+    current_weights: Dict[str, float]
+    candidate_weights: Dict[str, float]
+    total_scores: int
+    scores_level_changed: int
+    scores_danger_changed: int
+    students_total: int
+    students_level_changed: int
+    danger_distribution_current: Dict[str, int]
+    danger_distribution_simulated: Dict[str, int]
+    by_grade_subject: List[Dict[str, Any]]
+
 class ExcelColumnMappingResponse(BaseModel):
     id: int
     field_name: str
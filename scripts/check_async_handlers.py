@@ -0,0 +1,95 @@
+"""
+Регрессионная проверка: блокирующая работа внутри async-обработчиков.
+
+Сессии SQLAlchemy (config.get_db), pandas/openpyxl и bcrypt синхронные. Обработчик,
+объявленный как `async def`, выполняет их прямо в event loop и блокирует все остальные
+запросы воркера. Обычные `def`-обработчики FastAPI выполняет в пуле потоков.
+
+Запуск из корня проекта:
+    python scripts/check_async_handlers.py
+Код возврата 1, если найдены нарушения.
+"""
+import ast
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SCAN = [ROOT / "app.py", *sorted((ROOT / "routes").glob("*.py"))]
+
+# Синхронные зависимости и вызовы, которым не место в корутине
+BLOCKING_DEPENDENCIES = {"get_db"}
+BLOCKING_CALLS = {
+    "hash_password",
+    "verify_password",
+    "read_excel",
+    "load_workbook",
+    "ExcelFile",
+    "parse_excel_grades",
+    "generate_excel_template",
+    "analyze_excel",
+}
+BLOCKING_ATTRIBUTES = {"query", "commit", "execute", "flush", "refresh", "scalar"}
+
+
+def _is_route(node: ast.AsyncFunctionDef) -> bool:
+    for dec in node.decorator_list:
+        target = dec.func if isinstance(dec, ast.Call) else dec
+        if isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name):
+            if target.value.id in ("router", "app"):
+                return True
+    return False
+
+
+def _call_name(call: ast.Call) -> str:
+    func = call.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return ""
+
+
+def _problems(node: ast.AsyncFunctionDef) -> list:
+    found = []
+    defaults = node.args.defaults + node.args.kw_defaults
+    for default in defaults:
+        if isinstance(default, ast.Call) and _call_name(default) == "Depends" and default.args:
+            dep = default.args[0]
+            if isinstance(dep, ast.Name) and dep.id in BLOCKING_DEPENDENCIES:
+                found.append(f"depends on sync {dep.id}")
+    for sub in ast.walk(node):
+        if not isinstance(sub, ast.Call):
+            continue
+        name = _call_name(sub)
+        if name in BLOCKING_CALLS:
+            found.append(f"calls {name}()")
+        elif (
+            name in BLOCKING_ATTRIBUTES
+            and isinstance(sub.func, ast.Attribute)
+            and isinstance(sub.func.value, ast.Name)
+            and sub.func.value.id == "db"
+        ):
+            found.append(f"calls db.{name}()")
+    return sorted(set(found))
+
+
+def main() -> int:
+    violations = 0
+    for path in SCAN:
+        tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.AsyncFunctionDef) and _is_route(node):
+                problems = _problems(node)
+                if problems:
+                    violations += 1
+                    rel = path.relative_to(ROOT)
+                    print(f"{rel}:{node.lineno} async def {node.name}: {', '.join(problems)}")
+    if violations:
+        print(f"\n{violations} async handler(s) block the event loop; declare them with plain `def`.")
+        return 1
+    print("OK: no blocking calls in async handlers")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
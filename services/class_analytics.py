@@ -0,0 +1,537 @@
+"""
+Сводка оценок по классам и предметным группам за фиксированное число запросов
+(вместо запроса на каждого ученика).
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from schemas.models import (
+    GradeInDB,
+    ScoresInDB,
+    StudentInDB,
+    StudentSubjectGroupMembershipInDB,
+    SubjectGroupInDB,
+    SubjectInDB,
+)
+
+# Колонки оценок, нужные для сводки (без загрузки ORM-объектов)
+_SUMMARY_COLUMNS = (
+    ScoresInDB.actual_scores,
+    ScoresInDB.predicted_scores,
+    ScoresInDB.previous_class_score,
+    ScoresInDB.danger_level,
+    ScoresInDB.delta_percentage,
+)
+
+
+def summarize_scores(rows: Iterable[tuple]) -> Dict[object, dict]:
+    """
+    Свёртка строк (key, actual, predicted, previous, danger, delta), упорядоченных по id оценки.
+
+    Средний % — по всем положительным четвертям, риск — округлённое среднее,
+    остальные поля берутся из последней записи (как при обходе оценок ученика по одной).
+    """
+    acc: Dict[object, dict] = {}
+    for key, actual, predicted, previous, danger, delta in rows:
+        item = acc.get(key)
+        if item is None:
+            item = acc[key] = {
+                "valid": [],
+                "danger_sum": 0,
+                "danger_count": 0,
+                "actual_scores": [],
+                "predicted_scores": [],
+                "previous_class_score": None,
+                "danger_level": None,
+                "delta_percentage": None,
+            }
+
+        if actual and isinstance(actual, list):
+            item["valid"].extend(s for s in actual if s is not None and s > 0)
+        if danger is not None:
+            item["danger_sum"] += danger
+            item["danger_count"] += 1
+
+        if actual:
+            item["actual_scores"] = actual if isinstance(actual, list) else []
+        if predicted:
+            item["predicted_scores"] = predicted if isinstance(predicted, list) else []
+        if previous is not None:
+            item["previous_class_score"] = previous
+        item["danger_level"] = danger
+        item["delta_percentage"] = delta
+
+    summary: Dict[object, dict] = {}
+    for key, item in acc.items():
+        valid = item.pop("valid")
+        danger_sum = item.pop("danger_sum")
+        danger_count = item.pop("danger_count")
+        item["avg_percentage"] = round(sum(valid) / len(valid), 1) if valid else None
+        if danger_count > 0:
+            item["danger_level"] = round(danger_sum / danger_count)
+        summary[key] = item
+    return summary
+
+
+_EMPTY_SUMMARY = {
+    "actual_scores": [],
+    "predicted_scores": [],
+    "previous_class_score": None,
+    "danger_level": None,
+    "delta_percentage": None,
+    "avg_percentage": None,
+}
+
+
+def _student_info(student: tuple, summary: Optional[dict], class_liter: str, grade_id: int) -> dict:
+    student_id, name, email, source_grade_id = student
+    s = summary or _EMPTY_SUMMARY
+    return {
+        "id": student_id,
+        "student_name": name,
+        "email": email,
+        "previous_class_score": s["previous_class_score"],
+        "actual_score": s["actual_scores"],
+        "actual_scores": s["actual_scores"],
+        "predicted_scores": s["predicted_scores"],
+        "avg_percentage": s["avg_percentage"],
+        "danger_level": s["danger_level"],
+        "delta_percentage": s["delta_percentage"],
+        "class_liter": class_liter,
+        "grade_id": grade_id,
+        "source_grade_id": source_grade_id,
+    }
+
+
+def build_class_data(
+    db: Session,
+    *,
+    subject: Optional[str],
+    allowed_grade_ids: Optional[Set[int]],
+    allowed_subject_ids: Optional[Set[int]],
+    allowed_group_ids: Optional[Set[int]],
+) -> List[dict]:
+    """
+    Данные для /grades/get_class: реальные классы и предметные группы («виртуальные классы»).
+    Шесть запросов независимо от числа учеников; порядок — по id.
+    """
+    if allowed_grade_ids is not None and not allowed_grade_ids:
+        return []
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return []
+
+    grades_query = db.query(GradeInDB.id, GradeInDB.canonical_key, GradeInDB.curator_name)
+    if allowed_grade_ids is not None:
+        grades_query = grades_query.filter(GradeInDB.id.in_(allowed_grade_ids))
+    grades = grades_query.order_by(GradeInDB.id).all()
+    if not grades:
+        return []
+
+    grade_ids = [g.id for g in grades]
+    if allowed_grade_ids is None:
+        student_grade_filter = StudentInDB.grade_id.isnot(None)
+    else:
+        student_grade_filter = StudentInDB.grade_id.in_(grade_ids)
+
+    students = (
+        db.query(StudentInDB.id, StudentInDB.name, StudentInDB.email, StudentInDB.grade_id)
+        .filter(student_grade_filter)
+        .order_by(StudentInDB.id)
+        .all()
+    )
+
+    scores_query = (
+        db.query(ScoresInDB.student_id, *_SUMMARY_COLUMNS)
+        .join(StudentInDB, StudentInDB.id == ScoresInDB.student_id)
+        .filter(student_grade_filter)
+    )
+    if subject:
+        scores_query = scores_query.filter(ScoresInDB.subject_name == subject)
+    if allowed_subject_ids is not None:
+        scores_query = scores_query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    student_summary = summarize_scores(scores_query.order_by(ScoresInDB.id).yield_per(2000))
+
+    students_by_grade: Dict[int, List[tuple]] = {}
+    for student in students:
+        students_by_grade.setdefault(student.grade_id, []).append(tuple(student))
+
+    class_data: List[dict] = []
+    for grade in grades:
+        canonical = grade.canonical_key
+        class_data.append({
+            "curator_name": grade.curator_name,
+            "subject_name": subject,
+            "grade_liter": canonical,
+            "grade_id": grade.id,
+            "is_subject_group": False,
+            "class": [
+                _student_info(student, student_summary.get(student[0]), canonical, grade.id)
+                for student in students_by_grade.get(grade.id, [])
+            ],
+        })
+
+    # Предметные группы как «виртуальные классы» (grade_id = -id группы)
+    if allowed_group_ids is not None and not allowed_group_ids:
+        return class_data
+
+    groups_query = (
+        db.query(
+            SubjectGroupInDB.id,
+            SubjectGroupInDB.name,
+            SubjectInDB.name.label("subject_name"),
+            GradeInDB.parallel_number.label("anchor_parallel"),
+        )
+        .outerjoin(SubjectInDB, SubjectInDB.id == SubjectGroupInDB.subject_id)
+        .outerjoin(GradeInDB, GradeInDB.id == SubjectGroupInDB.grade_id)
+        .filter(SubjectGroupInDB.is_active == 1)
+    )
+    if allowed_group_ids is not None:
+        groups_query = groups_query.filter(SubjectGroupInDB.id.in_(allowed_group_ids))
+    if allowed_subject_ids is not None:
+        groups_query = groups_query.filter(SubjectGroupInDB.subject_id.in_(allowed_subject_ids))
+    if subject:
+        groups_query = groups_query.filter(SubjectInDB.name == subject)
+    groups = groups_query.order_by(SubjectGroupInDB.id).all()
+    if not groups:
+        return class_data
+
+    group_ids = [sg.id for sg in groups]
+    members = (
+        db.query(
+            StudentSubjectGroupMembershipInDB.subject_group_id,
+            StudentInDB.id,
+            StudentInDB.name,
+            StudentInDB.email,
+            StudentInDB.grade_id,
+        )
+        .join(StudentInDB, StudentInDB.id == StudentSubjectGroupMembershipInDB.student_id)
+        .filter(
+            StudentSubjectGroupMembershipInDB.subject_group_id.in_(group_ids),
+            StudentSubjectGroupMembershipInDB.is_active == 1,
+        )
+        .order_by(StudentSubjectGroupMembershipInDB.id)
+        .all()
+    )
+    members_by_group: Dict[int, List[tuple]] = {}
+    for row in members:
+        members_by_group.setdefault(row[0], []).append(tuple(row[1:]))
+
+    group_scores_query = db.query(
+        ScoresInDB.subject_group_id, ScoresInDB.student_id, *_SUMMARY_COLUMNS
+    ).filter(ScoresInDB.subject_group_id.in_(group_ids))
+    if subject:
+        group_scores_query = group_scores_query.filter(ScoresInDB.subject_name == subject)
+    group_summary = summarize_scores(
+        ((row[0], row[1]), *row[2:])
+        for row in group_scores_query.order_by(ScoresInDB.id).yield_per(2000)
+    )
+
+    for sg in groups:
+        class_data.append({
+            "curator_name": None,
+            "subject_name": subject or sg.subject_name,
+            "grade_liter": sg.name,
+            "grade_id": -(sg.id),
+            "is_subject_group": True,
+            "subject_group_id": sg.id,
+            "parallel_num": str(sg.anchor_parallel or ""),
+            "class": [
+                _student_info(student, group_summary.get((sg.id, student[0])), sg.name, -(sg.id))
+                for student in members_by_group.get(sg.id, [])
+            ],
+        })
+
+    return class_data
+
+
+_ENRICH_COLUMNS = (
+    ScoresInDB.id,
+    ScoresInDB.student_id,
+    ScoresInDB.subject_name,
+    ScoresInDB.semester,
+    ScoresInDB.updated_at,
+    *_SUMMARY_COLUMNS,
+)
+_ENRICH_FRAME_COLUMNS = [
+    "id",
+    "student_id",
+    "subject_name",
+    "semester",
+    "updated_at",
+    "actual_scores",
+    "predicted_scores",
+    "previous_class_score",
+    "danger_level",
+    "delta_percentage",
+]
+
+
+def _load_student_scores(
+    db: Session,
+    student_ids: Sequence[int],
+    allowed_subject_ids: Optional[Set[int]],
+    subject: Optional[str] = None,
+) -> pd.DataFrame:
+    """Все оценки учеников одним запросом, в порядке id."""
+    if not student_ids:
+        return pd.DataFrame(columns=_ENRICH_FRAME_COLUMNS, dtype=object)
+    query = db.query(*_ENRICH_COLUMNS).filter(ScoresInDB.student_id.in_(student_ids))
+    if subject:
+        query = query.filter(ScoresInDB.subject_name == subject)
+    if allowed_subject_ids is not None:
+        query = query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    rows = query.order_by(ScoresInDB.id).all()
+    # dtype=object: значения остаются питоновскими (None, не NaN) — уходят в JSON как есть
+    return pd.DataFrame([tuple(r) for r in rows], columns=_ENRICH_FRAME_COLUMNS, dtype=object)
+
+
+def _valid_actual(actual: object) -> List[float]:
+    if actual and isinstance(actual, list):
+        return [s for s in actual if s is not None and s > 0]
+    return []
+
+
+def _predicted_average(predicted: object, num_completed: int) -> Optional[float]:
+    if not isinstance(predicted, list):
+        return None
+    if num_completed > 0 and len(predicted) >= num_completed:
+        return round(sum(predicted[:num_completed]) / num_completed, 1)
+    if predicted:
+        return round(sum(predicted) / len(predicted), 1)
+    return None
+
+
+def _empty_student_row(student: StudentInDB, subject_name: str) -> dict:
+    return {
+        "id": student.id,
+        "name": student.name,
+        "email": student.email,
+        "grade_id": student.grade_id,
+        "previous_class_score": None,
+        "actual_scores": [],
+        "predicted_scores": [],
+        "avg_percentage": None,
+        "predicted_avg": None,
+        "danger_level": None,
+        "delta_percentage": None,
+        "last_subject": subject_name,
+        "last_semester": None,
+        "score_id": None,
+    }
+
+
+def _subject_row(student: StudentInDB, score: dict) -> dict:
+    """Строка ученика по одному предмету (первая оценка по этому предмету)."""
+    actual = score["actual_scores"] or []
+    predicted = score["predicted_scores"] or []
+    valid = _valid_actual(actual) if isinstance(actual, list) else []
+    row = _empty_student_row(student, score["subject_name"])
+    row.update({
+        "previous_class_score": score["previous_class_score"],
+        "actual_scores": actual,
+        "predicted_scores": predicted,
+        "avg_percentage": round(sum(valid) / len(valid), 1) if valid else None,
+        "predicted_avg": _predicted_average(predicted, len(valid)),
+        "danger_level": score["danger_level"],
+        "delta_percentage": score["delta_percentage"],
+        "last_semester": score["semester"],
+        "score_id": score["id"],
+    })
+    return row
+
+
+def _summary_rows(students: Sequence[StudentInDB], frame: pd.DataFrame) -> List[dict]:
+    """
+    Сводная строка по всем предметам: средний % по всем положительным четвертям,
+    округлённый средний риск, последний предмет — по updated_at (NULL считается новейшим, как в PostgreSQL DESC).
+    """
+    n = len(students)
+    position = {student.id: i for i, student in enumerate(students)}
+    student_pos = frame["student_id"].map(position).to_numpy(dtype=np.int64)
+
+    valid_lists = [_valid_actual(actual) for actual in frame["actual_scores"]]
+    counts = np.fromiter((len(v) for v in valid_lists), dtype=np.int64, count=len(valid_lists))
+    values = np.fromiter((x for v in valid_lists for x in v), dtype=np.float64, count=int(counts.sum()))
+    value_pos = np.repeat(student_pos, counts)
+    valid_sum = np.bincount(value_pos, weights=values, minlength=n)
+    valid_count = np.bincount(value_pos, minlength=n)
+
+    danger = pd.to_numeric(frame["danger_level"], errors="coerce").to_numpy(dtype=np.float64)
+    has_danger = ~np.isnan(danger)
+    danger_sum = np.bincount(student_pos[has_danger], weights=danger[has_danger], minlength=n)
+    danger_count = np.bincount(student_pos[has_danger], minlength=n)
+
+    latest: Dict[int, dict] = {}
+    if not frame.empty:
+        updated = pd.to_datetime(frame["updated_at"])
+        ordered = frame.assign(
+            _null_updated=updated.isna(),
+            _updated=updated.fillna(pd.Timestamp.min),
+        ).sort_values(["_null_updated", "_updated", "id"], kind="mergesort")
+        for rec in ordered.groupby("student_id", sort=False).tail(1).to_dict("records"):
+            latest[rec["student_id"]] = rec
+
+    rows: List[dict] = []
+    for i, student in enumerate(students):
+        row = _empty_student_row(student, "Все")
+        if valid_count[i] > 0:
+            row["avg_percentage"] = round(float(valid_sum[i]) / int(valid_count[i]), 1)
+        if danger_count[i] > 0:
+            row["danger_level"] = round(float(danger_sum[i]) / int(danger_count[i]))
+        last = latest.get(student.id)
+        if last is not None:
+            row["last_subject"] = last["subject_name"]
+            row["last_semester"] = last["semester"]
+        rows.append(row)
+    return rows
+
+
+def _first_score_by_subject(frame: pd.DataFrame) -> Dict[Tuple[int, str], dict]:
+    """Первая (по id) оценка ученика по каждому предмету — как .first() в поштучной версии."""
+    if frame.empty:
+        return {}
+    first = frame.drop_duplicates(subset=["student_id", "subject_name"], keep="first")
+    return {(rec["student_id"], rec["subject_name"]): rec for rec in first.to_dict("records")}
+
+
+def enrich_students(
+    db: Session,
+    students: Sequence[StudentInDB],
+    subject: Optional[str] = None,
+    allowed_subject_ids: Optional[Set[int]] = None,
+) -> List[dict]:
+    """
+    Пакетная версия enrich_student_data: один запрос оценок на весь список учеников.
+    С предметом — строка по этому предмету, без — сводная строка по всем предметам.
+    """
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return [_empty_student_row(student, subject or "Все") for student in students]
+
+    frame = _load_student_scores(db, [s.id for s in students], allowed_subject_ids, subject)
+    if not subject:
+        return _summary_rows(students, frame)
+
+    first = _first_score_by_subject(frame)
+    rows: List[dict] = []
+    for student in students:
+        score = first.get((student.id, subject))
+        rows.append(_subject_row(student, score) if score else _empty_student_row(student, subject))
+    return rows
+
+
+def enrich_students_with_details(
+    db: Session,
+    students: Sequence[StudentInDB],
+    allowed_subject_ids: Optional[Set[int]] = None,
+) -> Tuple[List[dict], List[dict]]:
+    """Сводные строки учеников и строки по каждому их предмету — из одного запроса оценок."""
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return [_empty_student_row(student, "Все") for student in students], []
+
+    frame = _load_student_scores(db, [s.id for s in students], allowed_subject_ids)
+    summary = _summary_rows(students, frame)
+
+    first = _first_score_by_subject(frame)
+    subjects_by_student: Dict[int, List[str]] = {}
+    for student_id, subject_name in first:
+        if subject_name:
+            subjects_by_student.setdefault(student_id, []).append(subject_name)
+
+    details: List[dict] = []
+    for student in students:
+        for subject_name in subjects_by_student.get(student.id, []):
+            details.append(_subject_row(student, first[(student.id, subject_name)]))
+    return summary, details
+
+
+def students_by_danger_level(
+    db: Session,
+    level: int,
+    *,
+    allowed_grade_ids: Optional[Set[int]],
+    allowed_subject_ids: Optional[Set[int]],
+    subject: Optional[str] = None,
+    academic_year: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int, int]] = None,
+) -> Tuple[List[dict], Optional[Tuple[int, int, int]]]:
+    """
+    Оценки с заданным danger_level, сгруппированные по текущему классу ученика (students.grade_id,
+    как и доступ куратора: после перевода старые оценки ученика остаются в его новом классе),
+    одним запросом; оценки — по индексу (danger_level, academic_year, student_id).
+
+    Keyset-пагинация по (grade_id, student_id, score_id): after — ключ последней строки предыдущей
+    страницы. Возвращает (группы по классам, ключ для следующей страницы или None).
+    """
+    if allowed_grade_ids is not None and not allowed_grade_ids:
+        return [], None
+    if allowed_subject_ids is not None and not allowed_subject_ids:
+        return [], None
+
+    query = (
+        db.query(
+            ScoresInDB.id,
+            ScoresInDB.subject_name,
+            ScoresInDB.actual_scores,
+            ScoresInDB.predicted_scores,
+            ScoresInDB.danger_level,
+            ScoresInDB.delta_percentage,
+            StudentInDB.id,
+            StudentInDB.name,
+            StudentInDB.grade_id,
+            GradeInDB.canonical_key,
+            GradeInDB.curator_name,
+        )
+        .join(StudentInDB, StudentInDB.id == ScoresInDB.student_id)
+        .join(GradeInDB, GradeInDB.id == StudentInDB.grade_id)
+        .filter(ScoresInDB.danger_level == level)
+    )
+    if allowed_grade_ids is not None:
+        query = query.filter(StudentInDB.grade_id.in_(allowed_grade_ids))
+    if allowed_subject_ids is not None:
+        query = query.filter(ScoresInDB.subject_id.in_(allowed_subject_ids))
+    if subject:
+        query = query.filter(ScoresInDB.subject_name == subject)
+    if academic_year:
+        query = query.filter(ScoresInDB.academic_year == academic_year)
+    if after is not None:
+        query = query.filter(tuple_(StudentInDB.grade_id, StudentInDB.id, ScoresInDB.id) > tuple_(*after))
+    query = query.order_by(StudentInDB.grade_id, StudentInDB.id, ScoresInDB.id)
+    # На одну строку больше — чтобы узнать, есть ли следующая страница
+    rows = query.limit(limit + 1).all() if limit else query.all()
+
+    next_after = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = (rows[-1][8], rows[-1][6], rows[-1][0])
+
+    groups: Dict[int, dict] = {}
+    for (score_id, subject_name, actual, predicted, danger, delta,
+         student_id, student_name, grade_id, class_liter, curator_name) in rows:
+        group = groups.get(grade_id)
+        if group is None:
+            group = groups[grade_id] = {
+                "curator_name": curator_name,
+                "subject_name": subject_name,
+                "grade_liter": class_liter,
+                "class": [],
+            }
+        # Как раньше: предмет группы — предмет последней найденной оценки
+        group["subject_name"] = subject_name
+        group["class"].append({
+            "id": student_id,
+            "student_name": student_name,
+            "actual_score": actual,
+            "predicted_score": predicted,
+            "danger_level": danger,
+            "delta_percentage": delta,
+            "class_liter": class_liter,
+            "grade_id": grade_id,
+        })
+    return list(groups.values()), next_after
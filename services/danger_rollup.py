@@ -0,0 +1,39 @@
+"""
+Сводка danger_level по классам / предметам / учебным годам (таблица score_danger_rollup).
+В PostgreSQL её поддерживают триггеры на scores (миграция n0p1q2r3s4t5 заполняет её и из
+существующих оценок); здесь — чтение с фильтром по AccessScope.
+
+Класс в сводке — scores.grade_id (класс, в котором выставлена оценка), поэтому она годится для
+итогов по предметам. Агрегаты «по классу» на дашборде считаются по текущему классу ученика
+(students.grade_id): перевод на новый учебный год переносит учеников, но не их оценки.
+"""
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from sqlalchemy import case, cast, func, Float
+from sqlalchemy.orm import Query
+
+from schemas.models import ScoreDangerRollupInDB
+
+R = ScoreDangerRollupInDB
+
+# Агрегаты по строкам сводки — те же значения, что COUNT / AVG по исходным оценкам
+rollup_score_count = func.sum(R.score_count)
+rollup_avg_danger = cast(func.sum(R.danger_level * R.score_count), Float) / func.nullif(func.sum(R.score_count), 0)
+rollup_avg_delta = func.sum(R.delta_sum) / func.nullif(func.sum(R.delta_count), 0)
+rollup_at_risk_count = func.sum(case((R.danger_level >= 2, R.score_count), else_=0))
+
+
+def filter_rollup_by_scope(
+    query: Query,
+    grade_ids: Optional[Iterable[int]],
+    subject_ids: Optional[Iterable[int]],
+) -> Query:
+    """grade_ids / subject_ids как в AccessScope: None — без ограничения."""
+    if grade_ids is not None:
+        query = query.filter(R.grade_id.in_(list(grade_ids)))
+    if subject_ids is not None:
+        query = query.filter(R.subject_id.in_(list(subject_ids)))
+    return query
+
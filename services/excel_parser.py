@@ -1,10 +1,34 @@
+import numpy as np
 import pandas as pd
 from fastapi import HTTPException
 from io import BytesIO
+import itertools
 import json
 import re
 from typing import Dict, List, Optional, Tuple, Any, Union
 import unicodedata
+import zipfile
+
+from openpyxl.utils.exceptions import InvalidFileException
+
+from services.excel_stream import ExcelSource, ExcelWorkbook, Row, column_names, is_blank_row, row_value
+
+# Шаблоны normalize_name компилируются один раз, а не на каждую ячейку
+_INVALID_NAME_RE = re.compile(
+    r'^(?:'
+    r'\d+$'  # Only digits
+    r'|no\.?$'  # "No" or "No."
+    r'|n/a$'  # "N/A"
+    r'|-+$'  # Only dashes
+    r'|_+$'  # Only underscores
+    r'|\s*$'  # Only whitespace
+    r'|#\d+$'  # "#123" pattern
+    r'|unnamed'  # Excel unnamed columns
+    r')'
+)
+_NAME_LETTER_RE = re.compile(r'[а-яА-ЯёЁa-zA-Z]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
 
 def normalize_name(name: str) -> str:
     """Normalize student name for consistent storage with validation"""
@@ -15,24 +39,11 @@ def normalize_name(name: str) -> str:
     name = str(name).strip()
     
     # Filter out invalid names (numbers, "No", "N/A", etc.)
-    invalid_patterns = [
-        r'^\d+$',  # Only digits
-        r'^no\.?$',  # "No" or "No."
-        r'^n/a$',  # "N/A"
-        r'^-+$',  # Only dashes
-        r'^_+$',  # Only underscores
-        r'^\s*$',  # Only whitespace
-        r'^#\d+$',  # "#123" pattern
-        r'^unnamed',  # Excel unnamed columns
-    ]
-    
-    name_lower = name.lower()
-    for pattern in invalid_patterns:
-        if re.match(pattern, name_lower):
-            return ""
+    if _INVALID_NAME_RE.match(name.lower()):
+        return ""
     
     # Must contain at least one letter (Cyrillic or Latin)
-    if not re.search(r'[а-яА-ЯёЁa-zA-Z]', name):
+    if not _NAME_LETTER_RE.search(name):
         return ""
     
     # Name must be at least 2 characters
@@ -43,7 +54,7 @@ def normalize_name(name: str) -> str:
     name = unicodedata.normalize('NFKC', name)
     
     # Remove extra spaces between words
-    name = re.sub(r'\s+', ' ', name)
+    name = _WHITESPACE_RE.sub(' ', name)
     
     # Remove any trailing commas or periods
     name = name.rstrip('.,')
@@ -208,10 +219,101 @@ def recalculate_predicted_and_danger_from_actual(
     return predicted, danger_level, round(percentage_difference, 1)
 
 
+def _quarter_value(x: Any) -> float:
+    """Оценка за четверть как в recalculate_predicted_and_danger_from_actual (None / мусор → 0)."""
+    if x is None:
+        return 0.0
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def actual_scores_to_quarters(actual_scores: Any) -> List[float]:
+    """
+    actual_scores из БД (список или {"q1": ...}) → ровно 4 числа для пакетного пересчёта.
+    """
+    if isinstance(actual_scores, dict):
+        actual_scores = [actual_scores.get(f"q{i}", 0) for i in range(1, 5)]
+    elif not isinstance(actual_scores, list):
+        actual_scores = []
+    quarters = [_quarter_value(x) for x in actual_scores[:4]]
+    while len(quarters) < 4:
+        quarters.append(0.0)
+    return quarters
+
+
+def recalculate_predicted_and_danger_batch(
+    quarters: Any,
+    previous_class_scores: Any,
+    teacher_percents: Any,
+    weights: Optional[Dict[str, float]] = None,
+) -> Tuple[List[float], List[int], List[float]]:
+    """
+    recalculate_predicted_and_danger_from_actual для многих строк сразу (NumPy).
+
+    quarters — массив (N, 4) из actual_scores_to_quarters; previous_class_scores и teacher_percents —
+    N значений (None = нет данных). Возвращает уровень ученика (прогноз для каждой четверти),
+    danger_level и delta по строкам; результаты совпадают с построчной функцией.
+    """
+    raw = np.asarray(quarters, dtype=float).reshape(-1, 4)
+    prev = np.array([np.nan if v is None else v for v in previous_class_scores], dtype=float)
+    teacher = np.array([np.nan if v is None else v for v in teacher_percents], dtype=float)
+
+    w = weights or {"previous_class": 0.7, "teacher": 0.3}
+    w_prev = float(w.get("previous_class", 0.7) or 0.0)
+    w_teacher = float(w.get("teacher", 0.3) or 0.0)
+    effective_weight_sum = w_prev + w_teacher
+
+    has_prev = ~np.isnan(prev)
+    has_teacher = ~np.isnan(teacher)
+    with np.errstate(invalid="ignore"):
+        if effective_weight_sum > 0:
+            both = (w_prev * prev + w_teacher * teacher) / effective_weight_sum
+        else:
+            both = 0.7 * prev + 0.3 * teacher
+    level = np.where(
+        has_prev & has_teacher,
+        both,
+        np.where(has_prev, prev, np.where(has_teacher, teacher, 0.0)),
+    )
+    # round() Python (корректное округление), а не np.round
+    levels = [round(x, 1) for x in level.tolist()]
+    level = np.array(levels, dtype=float)
+
+    completed = raw > 0
+    num_completed = completed.sum(axis=1)
+    deltas = np.where(completed, raw - level[:, None], 0.0)
+    # Складываем по четвертям слева направо, как sum() в построчной версии
+    total = deltas[:, 0] + deltas[:, 1] + deltas[:, 2] + deltas[:, 3]
+    valid = (num_completed > 0) & (level > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = np.where(valid, total / np.maximum(num_completed, 1), 0.0)
+
+    danger = np.select([delta < -15, delta < -10, delta < -5], [3, 2, 1], default=0)
+    danger = np.where(valid, danger, 0)
+
+    return levels, danger.tolist(), [round(x, 1) for x in delta.tolist()]
+
+
+# find_header: заголовок ищется среди стольких первых строк листа
+_HEADER_SEARCH_ROWS = 10
+
+
+def _is_grades_header(row: Row, name_aliases: List[str]) -> bool:
+    return any(
+        any(alias in str(value).lower().strip() for alias in name_aliases)
+        for value in row
+        if value is not None
+    )
+
+
 def parse_excel_grades(
-    file_content: bytes,
+    file_content: ExcelSource,
     expected_columns: Dict[str, List[str]] = None,
-    weights: Dict[str, float] = None
+    weights: Dict[str, float] = None,
+    sheet_name: Optional[str] = None,
+    find_header: bool = False,
 ) -> Dict[str, Any]:
     """
     Parse Excel file for grade upload
@@ -226,9 +328,12 @@ def parse_excel_grades(
     - Учитель / Teacher / Teacher %
     
     Args:
-        file_content: Excel file content as bytes
+        file_content: Excel file as bytes or a seekable file object (e.g. UploadFile.file)
         expected_columns: Dictionary mapping field names to possible column name aliases
         weights: Dictionary with weights for prediction calculation
+        sheet_name: Sheet to read (default: the first one)
+        find_header: Header is the first row with a name column among the first 10 rows;
+            text of the rows above it is returned as "preamble" (batch upload: «Класс: 10А»)
     """
     
     if expected_columns is None:
@@ -249,89 +354,105 @@ def parse_excel_grades(
         }
     
     try:
-        # Read Excel file
-        excel_data = BytesIO(file_content)
-        df = pd.read_excel(excel_data, sheet_name=0, header=0)
-        
-        if df.empty:
-            raise HTTPException(status_code=400, detail="Excel file is empty")
-        
-        # Normalize column names for matching
-        df.columns = df.columns.astype(str)
-        normalized_columns = {col: col.lower().strip() for col in df.columns}
-        
-        # Find column mappings
-        column_mapping = {}
-        
-        for field, possible_names in expected_columns.items():
-            found = False
-            for col_name, normalized in normalized_columns.items():
-                if any(possible in normalized for possible in possible_names):
-                    column_mapping[field] = col_name
-                    found = True
-                    break
-            
-            if not found and field == 'name':
-                # Name column is required
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Required column not found: {field}. Available columns: {list(df.columns)}"
+        # Потоковое чтение листа: заголовок — первая строка, дальше строки по одной
+        with ExcelWorkbook(file_content) as workbook:
+            rows = workbook.rows(sheet_name if sheet_name is not None else workbook.sheet_names[0])
+            header = next(rows, None)
+            header_index = 0
+            preamble: List[str] = []
+            if find_header and header is not None and not _is_grades_header(header, expected_columns['name']):
+                # Заголовок — первая из первых строк с колонкой ФИО; не нашёлся — первая строка, как обычно
+                head = [header] + list(itertools.islice(rows, _HEADER_SEARCH_ROWS - 1))
+                found = next(
+                    (index for index, row in enumerate(head) if _is_grades_header(row, expected_columns['name'])),
+                    None,
                 )
-        
-        # Parse student data
-        students_data = []
-        warnings = []
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Skip empty rows
-                if row.isna().all():
-                    continue
-                
-                # Get student name (required)
-                student_name = normalize_name(row.get(column_mapping.get('name', '')))
-                if not student_name:
-                    warnings.append(f"Row {index + 2}: Missing student name, skipped")
+                if found is not None:
+                    preamble = [
+                        str(value).strip() for row in head[:found] for value in row
+                        if value is not None and str(value).strip()
+                    ]
+                    header, header_index = head[found], found
+                rows = itertools.chain(head[header_index + 1:], rows)
+            first_row = next(rows, None)
+            if first_row is None:
+                raise HTTPException(status_code=400, detail="Excel file is empty")
+            rows = itertools.chain([first_row], rows)
+            columns = column_names(header)
+            normalized_columns = {col: col.lower().strip() for col in columns}
+
+            # Find column mappings
+            column_mapping = {}
+
+            for field, possible_names in expected_columns.items():
+                found = False
+                for col_name, normalized in normalized_columns.items():
+                    if any(possible in normalized for possible in possible_names):
+                        column_mapping[field] = col_name
+                        found = True
+                        break
+
+                if not found and field == 'name':
+                    # Name column is required
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Required column not found: {field}. Available columns: {columns}"
+                    )
+
+            column_index = {field: columns.index(col_name) for field, col_name in column_mapping.items()}
+
+            # Parse student data
+            students_data = []
+            warnings = []
+            errors = []
+            total_rows = 0
+
+            for index, row in enumerate(rows, start=header_index):
+                total_rows += 1
+                try:
+                    # Skip empty rows
+                    if is_blank_row(row):
+                        continue
+
+                    # Get student name (required)
+                    student_name = normalize_name(row_value(row, column_index.get('name')))
+                    if not student_name:
+                        warnings.append(f"Row {index + 2}: Missing student name, skipped")
+                        continue
+
+                    # Parse percentages
+                    previous_class_score = validate_percentage(row_value(row, column_index.get('previous_class')))
+                    teacher_percent = validate_percentage(row_value(row, column_index.get('teacher')))
+
+                    # Parse quarterly grades
+                    quarters = [
+                        validate_percentage(row_value(row, column_index.get(quarter)))
+                        for quarter in ['q1', 'q2', 'q3', 'q4']
+                    ]
+
+                    # Calculate predicted scores for each quarter
+                    predicted_scores = calculate_predicted_scores_by_quarter(
+                        previous_class_score, quarters, teacher_percent, weights
+                    )
+
+                    # Prepare actual scores (replace None with 0.0 for calculations)
+                    actual_scores = [q if q is not None else 0.0 for q in quarters]
+
+                    student_data = {
+                        "student_name": student_name,
+                        "previous_class_score": previous_class_score,
+                        "current_quarters": quarters,
+                        "teacher_percent": teacher_percent,
+                        "actual_scores": actual_scores,
+                        "predicted_scores": predicted_scores
+                    }
+
+                    students_data.append(student_data)
+
+                except Exception as e:
+                    errors.append(f"Row {index + 2}: Error processing data - {str(e)}")
                     continue
-                
-                # Parse percentages
-                previous_class_score = validate_percentage(row.get(column_mapping.get('previous_class')))
-                teacher_percent = validate_percentage(row.get(column_mapping.get('teacher')))
-                
-                # Parse quarterly grades
-                quarters = []
-                for quarter in ['q1', 'q2', 'q3', 'q4']:
-                    col = column_mapping.get(quarter)
-                    if col:
-                        quarter_value = validate_percentage(row.get(col))
-                        quarters.append(quarter_value)
-                    else:
-                        quarters.append(None)
-                
-                # Calculate predicted scores for each quarter
-                predicted_scores = calculate_predicted_scores_by_quarter(
-                    previous_class_score, quarters, teacher_percent, weights
-                )
-                
-                # Prepare actual scores (replace None with 0.0 for calculations)
-                actual_scores = [q if q is not None else 0.0 for q in quarters]
-                
-                student_data = {
-                    "student_name": student_name,
-                    "previous_class_score": previous_class_score,
-                    "current_quarters": quarters,
-                    "teacher_percent": teacher_percent,
-                    "actual_scores": actual_scores,
-                    "predicted_scores": predicted_scores
-                }
-                
-                students_data.append(student_data)
-                
-            except Exception as e:
-                errors.append(f"Row {index + 2}: Error processing data - {str(e)}")
-                continue
-        
+
         if not students_data:
             raise HTTPException(
                 status_code=400, 
@@ -340,15 +461,18 @@ def parse_excel_grades(
         
         response = {
             "students": students_data,
-            "total_rows": len(df),
+            "total_rows": total_rows,
             "processed_rows": len(students_data),
             "warnings": warnings,
             "errors": errors,
-            "column_mapping": column_mapping
+            "column_mapping": column_mapping,
+            "preamble": preamble,
         }
         
         return response
         
+    except (zipfile.BadZipFile, InvalidFileException):
+        raise HTTPException(status_code=400, detail="Excel file is empty or corrupted")
     except pd.errors.EmptyDataError:
         raise HTTPException(status_code=400, detail="Excel file is empty or corrupted")
     except pd.errors.ParserError as e:
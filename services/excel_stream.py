@@ -0,0 +1,168 @@
+"""
+Потоковое чтение Excel: openpyxl read_only + iter_rows, строки отдаются по одной.
+Пиковая память не зависит от размера листа (кроме .xls — он читается через pandas целиком).
+
+Значения строк — как у pd.read_excel: пустые ячейки и строки "N/A", "nan", ... -> None,
+целые числа -> int; пустые строки в конце листа отбрасываются.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO
+from typing import IO, Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+ExcelSource = Union[bytes, str, IO[bytes]]
+Row = Tuple[object, ...]
+
+# Строки, которые pandas по умолчанию считает пропуском (na_values)
+_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+
+def _convert_cell(cell) -> object:
+    value = cell.value
+    if value is None or value == "" or cell.data_type == TYPE_ERROR:
+        return None
+    if cell.data_type == TYPE_NUMERIC:
+        as_int = int(value)
+        return as_int if as_int == value else float(value)
+    return value
+
+
+def _convert_value(value: object) -> object:
+    """Значение из DataFrame (путь .xls) -> как _convert_cell."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def is_blank_row(row: Sequence[object]) -> bool:
+    return all(value is None for value in row)
+
+
+def _na_to_none(row: Row) -> Row:
+    return tuple(None if isinstance(value, str) and value in _NA_STRINGS else value for value in row)
+
+
+def _without_trailing_blank_rows(rows: Iterator[Row]) -> Iterator[Row]:
+    """
+    Пустые строки придерживаются, пока не встретится непустая: хвост листа не отдаётся.
+    Как в pandas, строка из одних "N/A" / "NULL" не пустая (но её значения -> None).
+    """
+    pending: List[Row] = []
+    for row in rows:
+        if is_blank_row(row):
+            pending.append(row)
+            continue
+        yield from pending
+        pending.clear()
+        yield _na_to_none(row)
+
+
+class ExcelWorkbook:
+    """
+    Книга Excel для однопроходного чтения.
+    `with ExcelWorkbook(source) as book: for row in book.rows(book.sheet_names[0]): ...`
+    source — bytes, путь к файлу или файловый объект с seek (например, UploadFile.file).
+    """
+
+    def __init__(self, source: ExcelSource):
+        self._owned = open(source, "rb") if isinstance(source, str) else None
+        if self._owned is not None:
+            stream = self._owned
+        else:
+            stream = BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        stream.seek(0)
+        self._is_xlsx = zipfile.is_zipfile(stream)
+        stream.seek(0)
+        if self._is_xlsx:
+            self._book = openpyxl.load_workbook(stream, read_only=True, data_only=True, keep_links=False)
+            self.sheet_names = [sheet.title for sheet in self._book.worksheets]
+        else:
+            # .xls: xlrd не умеет читать построчно — лист загружается pandas при обращении
+            self._book = pd.ExcelFile(stream)
+            self.sheet_names = list(self._book.sheet_names)
+
+    def rows(self, sheet_name: str) -> Iterator[Row]:
+        """Строки листа с первой (A1), включая пустые внутри листа."""
+        if self._is_xlsx:
+            sheet = self._book[sheet_name]
+            sheet.reset_dimensions()
+            raw = (tuple(_convert_cell(cell) for cell in row) for row in sheet.rows)
+        else:
+            frame = pd.read_excel(self._book, sheet_name=sheet_name, header=None)
+            raw = (tuple(_convert_value(v) for v in values) for values in frame.itertuples(index=False))
+        return _without_trailing_blank_rows(raw)
+
+    def close(self) -> None:
+        self._book.close()
+        if self._owned is not None:
+            self._owned.close()
+
+    def __enter__(self) -> "ExcelWorkbook":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+@contextmanager
+def upload_on_disk(fileobj: IO[bytes], suffix: str = ".xlsx") -> Iterator[str]:
+    """Копия загруженного файла во временном файле (частями) — путь можно передать в другой процесс."""
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(fileobj, tmp, 1024 * 1024)
+    try:
+        yield tmp.name
+    finally:
+        os.unlink(tmp.name)
+
+
+def find_header_row(
+    rows: Iterator[Row],
+    is_header: Callable[[Row], bool],
+    max_rows: int = 30,
+) -> Optional[Tuple[int, Row]]:
+    """
+    Ищет строку заголовка среди первых max_rows строк (индекс с 0, как header= в pandas).
+    Прочитанные строки потребляются: после успешного поиска итератор стоит на первой строке данных.
+    """
+    for index, row in enumerate(rows):
+        if index >= max_rows:
+            return None
+        if is_header(row):
+            return index, row
+    return None
+
+
+def column_names(header: Row) -> List[str]:
+    """Имена колонок как у pandas: пустые — «Unnamed: i», повторы — «имя.1», «имя.2»."""
+    names: List[str] = []
+    seen: dict = {}
+    for index, value in enumerate(header):
+        name = f"Unnamed: {index}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+
+def row_value(row: Row, index: Optional[int]) -> object:
+    """Значение колонки index (None, если колонки нет или строка короче заголовка)."""
+    if index is None or index >= len(row):
+        return None
+    return row[index]
@@ -0,0 +1,170 @@
+"""
+Пакетная загрузка оценок всей школы: книга с листом на каждый класс/предмет или ZIP с такими книгами.
+
+Распаковка и список листов (expand_grade_batch) выполняются в пуле процессов, листы читаются
+там же параллельно (parse_excel_grades с find_header). Здесь же — определение класса и предмета
+листа по строкам над заголовком («Класс: 10А», «Предмет: Физика»), имени листа и имени файла.
+"""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import zipfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from schemas.models import GradeInDB
+from services.excel_stream import ExcelWorkbook
+from services.reference_data import SubjectRef
+
+GRADE_BATCH_MAX_FILES = int(os.getenv("GRADE_BATCH_MAX_FILES", "300"))
+GRADE_BATCH_MAX_SHEETS = int(os.getenv("GRADE_BATCH_MAX_SHEETS", "1000"))
+# Защита от zip-бомб: суммарный размер распакованных книг
+GRADE_BATCH_MAX_UNCOMPRESSED_BYTES = int(os.getenv("GRADE_BATCH_MAX_UNCOMPRESSED_MB", "300")) * 1024 * 1024
+
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+_LETTERS = "A-Za-zА-Яа-яЁёІіҢңҒғҚқӨөҰұҮүҺһӘә"
+# «10А», «10 А», «10-А», «Математика_7Б»; буква не должна продолжаться словом («10 Математика»)
+_CLASS_RE = re.compile(rf"(?<![\d{_LETTERS}])(\d{{1,2}})\s*[-–_]?\s*([{_LETTERS}])(?![{_LETTERS}])")
+# Класс без литеры: «10», «10 Математика»
+_CLASS_NUMBER_RE = re.compile(rf"(?<![\d{_LETTERS}])(\d{{1,2}})(?![\d{_LETTERS}])")
+# Латинские буквы, похожие на кириллические: «10A» и «10А» — один класс
+_LOOKALIKE_LETTERS = str.maketrans("ABCEHKMOPTX", "АВСЕНКМОРТХ")
+
+_CLASS_KEYWORDS = ("класс", "class", "сынып")
+_SUBJECT_KEYWORDS = ("предмет", "subject", "пән")
+
+
+def _member_name(info: zipfile.ZipInfo) -> str:
+    """Имя файла в архиве; архивы Windows без флага UTF-8 хранят кириллицу в cp866."""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp866")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _is_workbook_member(name: str) -> bool:
+    base = os.path.basename(name)
+    return (
+        name.lower().endswith(EXCEL_EXTENSIONS)
+        and not name.startswith("__MACOSX/")
+        and not base.startswith(("~$", "."))
+    )
+
+
+def _extract_workbooks(path: str, workdir: str) -> List[Tuple[str, str]]:
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="ZIP archive is empty or corrupted")
+
+    with archive:
+        members = [
+            (info, _member_name(info))
+            for info in archive.infolist()
+            if not info.is_dir() and _is_workbook_member(_member_name(info))
+        ]
+        if not members:
+            raise HTTPException(status_code=400, detail="ZIP archive contains no Excel files (.xlsx, .xls)")
+        if len(members) > GRADE_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"ZIP archive contains more than {GRADE_BATCH_MAX_FILES} Excel files")
+        if sum(info.file_size for info, _ in members) > GRADE_BATCH_MAX_UNCOMPRESSED_BYTES:
+            raise HTTPException(status_code=413, detail="ZIP archive is too large when unpacked")
+
+        books = []
+        for number, (info, name) in enumerate(members):
+            # Имя на диске — по номеру: пути из архива не используются
+            target = os.path.join(workdir, f"{number}{os.path.splitext(name)[1].lower()}")
+            with archive.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            books.append((name, target))
+    return books
+
+
+def expand_grade_batch(path: str, file_name: str, workdir: str) -> List[dict]:
+    """
+    Книги пакета: [{"file": имя для отчёта, "path": путь, "sheets": [листы], "error": None | текст}].
+    .xlsx / .xls — одна книга; .zip — книги из архива (в т.ч. из папок) распаковываются в workdir.
+    """
+    if file_name.lower().endswith(".zip"):
+        books = _extract_workbooks(path, workdir)
+    else:
+        books = [(file_name, path)]
+
+    result = []
+    for name, book_path in books:
+        try:
+            with ExcelWorkbook(book_path) as workbook:
+                sheets, error = list(workbook.sheet_names), None
+        except Exception as exc:
+            sheets, error = [], f"Failed to read Excel: {str(exc)}"
+        result.append({"file": name, "path": book_path, "sheets": sheets, "error": error})
+    return result
+
+
+def _letter_key(letter: Optional[str]) -> str:
+    return (letter or "").strip().upper().translate(_LOOKALIKE_LETTERS)
+
+
+def grade_index(db: Session) -> Dict[Tuple[int, str], GradeInDB]:
+    """Классы по (параллель, литера); при дублях — самый ранний."""
+    index: Dict[Tuple[int, str], GradeInDB] = {}
+    for grade in db.query(GradeInDB).order_by(GradeInDB.id):
+        if grade.parallel_number is not None:
+            index.setdefault((grade.parallel_number, _letter_key(grade.letter)), grade)
+    return index
+
+
+def _labels(preamble: Sequence[str], sheet_name: str, file_name: str, keywords: Tuple[str, ...]) -> List[str]:
+    # Порядок: подписанные ячейки над заголовком, имя листа, имя файла, остальные ячейки
+    tagged = [cell for cell in preamble if any(keyword in cell.lower() for keyword in keywords)]
+    rest = [cell for cell in preamble if cell not in tagged]
+    return tagged + [sheet_name, os.path.splitext(os.path.basename(file_name))[0]] + rest
+
+
+def _find_grade(labels: Sequence[str], grades: Dict[Tuple[int, str], GradeInDB]) -> Optional[GradeInDB]:
+    for label in labels:
+        for match in _CLASS_RE.finditer(label):
+            grade = grades.get((int(match.group(1)), _letter_key(match.group(2))))
+            if grade is not None:
+                return grade
+    for label in labels:
+        for match in _CLASS_NUMBER_RE.finditer(label):
+            grade = grades.get((int(match.group(1)), ""))
+            if grade is not None:
+                return grade
+    return None
+
+
+def _find_subject(labels: Sequence[str], subjects: Sequence[SubjectRef]) -> Optional[SubjectRef]:
+    for label in labels:
+        text = label.lower().replace("ё", "е")
+        # Название целиком, не часть слова; из нескольких — самое длинное («История Казахстана»)
+        found = [
+            subject for subject in subjects
+            if subject.is_active and re.search(
+                rf"(?<![^\W\d_]){re.escape(subject.name.lower().replace('ё', 'е'))}(?![^\W\d_])", text
+            )
+        ]
+        if found:
+            return max(found, key=lambda subject: len(subject.name))
+    return None
+
+
+def resolve_sheet(
+    preamble: Sequence[str],
+    sheet_name: str,
+    file_name: str,
+    grades: Dict[Tuple[int, str], GradeInDB],
+    subjects: Sequence[SubjectRef],
+) -> Tuple[Optional[GradeInDB], Optional[SubjectRef]]:
+    """Класс и предмет листа (None — не удалось определить)."""
+    grade = _find_grade(_labels(preamble, sheet_name, file_name, _CLASS_KEYWORDS), grades)
+    subject = _find_subject(_labels(preamble, sheet_name, file_name, _SUBJECT_KEYWORDS), subjects)
+    return grade, subject
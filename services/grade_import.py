@@ -0,0 +1,171 @@
+"""
+Запись распарсенного Excel с оценками в БД пакетно: ученики класса/группы загружаются
+одним запросом, недостающие создаются одним INSERT, оценки — одним upsert.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from schemas.models import StudentInDB
+from services.excel_parser import recalculate_predicted_and_danger_from_actual
+from services.score_store import upsert_scores
+from key_utils import student_name_key
+
+
+def import_parsed_grades(
+    db: Session,
+    students: Sequence[dict],
+    *,
+    weights: Dict[str, float],
+    subject_id: int,
+    subject_name: str,
+    teacher_name: str,
+    semester: int,
+    academic_year: str,
+    grade_id: Optional[int],
+    subgroup_id: Optional[int] = None,
+    subject_group_id: Optional[int] = None,
+    group_member_student_ids: Optional[Sequence[int]] = None,
+) -> dict:
+    """
+    Сохраняет строки parse_excel_grades()["students"] в рамках текущей транзакции (без commit).
+
+    grade_id — класс (в т.ч. для групп с якорным классом): неизвестные ученики создаются в нём.
+    group_member_student_ids — для бесклассовой группы: ученики ищутся только среди участников,
+    новые не создаются.
+
+    Возвращает imported_count, errors и danger_distribution.
+    """
+    is_classless_group = group_member_student_ids is not None
+    errors: List[str] = []
+    danger_distribution = {0: 0, 1: 0, 2: 0, 3: 0}
+
+    # 1. Прогноз по каждой строке
+    parsed_rows: List[dict] = []
+    for student_data in students:
+        try:
+            student_name = student_data["student_name"]
+            actual_scores = student_data["actual_scores"]
+            previous_class_score = student_data.get("previous_class_score")
+            teacher_percent = student_data.get("teacher_percent")
+
+            predicted_scores, danger_level, percentage_difference = recalculate_predicted_and_danger_from_actual(
+                actual_scores,
+                previous_class_score,
+                teacher_percent,
+                weights,
+            )
+            danger_distribution[danger_level] += 1
+
+            parsed_rows.append({
+                "key": student_name_key(student_name),
+                "student_name": student_name,
+                "previous_class_score": previous_class_score,
+                "teacher_percent": teacher_percent,
+                "actual_scores": actual_scores,
+                "predicted_scores": predicted_scores,
+                "danger_level": danger_level,
+                "delta_percentage": round(percentage_difference, 1),
+            })
+        except Exception as e:
+            errors.append(f"Error processing student {student_data.get('student_name', 'Unknown')}: {str(e)}")
+
+    # 2. Ученики из файла — одним запросом по (grade_id, normalized_name);
+    #    при совпадении имён берётся меньший id
+    keys = sorted({row["key"] for row in parsed_rows if row["key"]})
+    by_name: Dict[str, dict] = {}
+    if keys:
+        students_query = db.query(
+            StudentInDB.id, StudentInDB.normalized_name, StudentInDB.grade_id, StudentInDB.subgroup_id
+        ).filter(StudentInDB.normalized_name.in_(keys))
+        if is_classless_group:
+            member_ids = list(group_member_student_ids)
+            existing = students_query.filter(StudentInDB.id.in_(member_ids)).order_by(StudentInDB.id).all() if member_ids else []
+        else:
+            existing = students_query.filter(StudentInDB.grade_id == grade_id).order_by(StudentInDB.id).all()
+        for row in existing:
+            by_name.setdefault(row.normalized_name, {
+                "id": row.id,
+                "grade_id": row.grade_id,
+                "subgroup_id": row.subgroup_id,
+            })
+
+    prepared: List[dict] = []
+    new_students: Dict[str, str] = {}
+    for row in parsed_rows:
+        key = row["key"]
+        if is_classless_group:
+            if key not in by_name:
+                errors.append(f"Student '{row['student_name']}' is not a member of the selected subject group")
+                continue
+        elif key not in by_name:
+            new_students.setdefault(key, row["student_name"])
+        prepared.append(row)
+
+    # 3. Недостающие ученики класса — одним INSERT ... RETURNING
+    if new_students:
+        new_keys = list(new_students)
+        created = db.execute(
+            insert(StudentInDB).returning(StudentInDB.id, sort_by_parameter_order=True),
+            [
+                {"name": new_students[k], "normalized_name": k, "grade_id": grade_id, "subgroup_id": subgroup_id}
+                for k in new_keys
+            ],
+        ).scalars().all()
+        for key, student_id in zip(new_keys, created):
+            by_name[key] = {"id": student_id, "grade_id": grade_id, "subgroup_id": subgroup_id}
+
+    # Ученики из файла переводятся в выбранную подгруппу одним UPDATE
+    if subgroup_id and not is_classless_group:
+        moved = sorted({
+            by_name[item["key"]]["id"]
+            for item in prepared
+            if by_name[item["key"]]["subgroup_id"] != subgroup_id
+        })
+        if moved:
+            db.execute(
+                update(StudentInDB)
+                .where(StudentInDB.id.in_(moved))
+                .values(subgroup_id=subgroup_id, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+
+    # 4. Оценки: одна запись на ученика / предмет / семестр / учебный год / (subject_group);
+    #    при повторе ученика в файле побеждает последняя строка
+    rows_by_student: Dict[int, dict] = {}
+    for item in prepared:
+        student = by_name[item["key"]]
+        rows_by_student[student["id"]] = {
+            "teacher_name": teacher_name,
+            "subject_name": subject_name,
+            "previous_class_score": item["previous_class_score"],
+            "teacher_percent": item["teacher_percent"],
+            "actual_scores": item["actual_scores"],
+            "predicted_scores": item["predicted_scores"],
+            "danger_level": item["danger_level"],
+            "delta_percentage": item["delta_percentage"],
+            "grade_id": student["grade_id"] if is_classless_group else grade_id,
+            "subgroup_id": subgroup_id,
+            "academic_year": academic_year,
+        }
+
+    upsert_scores(db, [
+        {
+            **values,
+            "student_id": student_id,
+            "subject_id": subject_id,
+            "semester": semester,
+            "subject_group_id": subject_group_id,
+        }
+        for student_id, values in rows_by_student.items()
+    ])
+
+    return {
+        "imported_count": len(prepared),
+        "errors": errors,
+        "danger_distribution": danger_distribution,
+    }
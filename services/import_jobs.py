@@ -0,0 +1,361 @@
+"""
+Фоновые задачи импорта Excel: эндпоинт сохраняет файл на диск, создаёт строку в import_jobs
+и сразу отвечает id задачи; импорт идёт в пуле потоков этого процесса, клиент опрашивает
+GET /import-jobs/{id}.
+
+Состояние хранится в БД, поэтому переживает перезапуск воркера: выполняемая задача раз в
+IMPORT_JOB_HEARTBEAT_SECONDS обновляет updated_at, и каждый воркер — при старте и затем раз в
+IMPORT_JOB_STALE_SECONDS — возвращает в очередь задачи без heartbeat дольше IMPORT_JOB_STALE_SECONDS
+(их воркер упал) и запускает задачи, долго ждущие в очереди. Импорт пишет в БД одной транзакцией —
+повтор после падения не дублирует данные.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import IO, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from config import IMPORT_JOB_WORKERS, SessionLocal
+from schemas.models import ImportJobInDB, UserInDB
+
+logger = logging.getLogger(__name__)
+
+# Каталог должен быть общим для всех воркеров uvicorn (и переживать их перезапуск)
+IMPORT_JOBS_DIR = os.getenv("IMPORT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "usp-import-jobs"))
+IMPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", "30"))
+# Несколько пропущенных heartbeat подряд — воркер задачи считается упавшим
+IMPORT_JOB_STALE_SECONDS = float(os.getenv("IMPORT_JOB_STALE_SECONDS", "300"))
+IMPORT_JOB_MAX_ATTEMPTS = int(os.getenv("IMPORT_JOB_MAX_ATTEMPTS", "3"))
+IMPORT_JOB_RETENTION_DAYS = int(os.getenv("IMPORT_JOB_RETENTION_DAYS", "30"))
+# Пул процессов занят (503) — повтор через столько секунд
+IMPORT_JOB_RETRY_DELAY_SECONDS = float(os.getenv("IMPORT_JOB_RETRY_DELAY_SECONDS", "5"))
+_PROGRESS_INTERVAL_SECONDS = 1.0
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_monitor: Optional[threading.Thread] = None
+_monitor_stop = threading.Event()
+
+
+class ImportJobProgress:
+    """
+    Фаза и число обработанных строк задачи; заодно heartbeat для обнаружения зависших задач.
+    Пишется отдельной короткой транзакцией — импорт держит свою до конца. Без job_id ничего
+    не делает (синхронный режим эндпоинтов).
+    """
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id
+        self._saved_at = 0.0
+
+    def phase(self, phase: str, rows_total: Optional[int] = None) -> None:
+        values = {"phase": phase}
+        if rows_total is not None:
+            values["rows_total"] = rows_total
+        self._save(values)
+
+    def rows(self, rows_processed: int) -> None:
+        if time.monotonic() - self._saved_at >= _PROGRESS_INTERVAL_SECONDS:
+            self._save({"rows_processed": rows_processed})
+
+    def _save(self, values: dict) -> None:
+        if self.job_id is None:
+            return
+        self._saved_at = time.monotonic()
+        try:
+            _update_job(self.job_id, values)
+        except Exception:
+            # Прогресс — не повод останавливать импорт
+            logger.warning("Failed to save progress of import job %s", self.job_id, exc_info=True)
+
+
+# kind -> handler(db, user_data, params, path, progress) -> результат (dict или pydantic-модель)
+ImportHandler = Callable[[Session, dict, dict, str, ImportJobProgress], object]
+_handlers: Dict[str, ImportHandler] = {}
+
+
+def register_import_handler(kind: str, handler: ImportHandler) -> None:
+    """Регистрирует обработчик задач вида kind (вызывается при импорте модуля роутов)."""
+    _handlers[kind] = handler
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMPORT_JOB_WORKERS, thread_name_prefix="import-job")
+        return _executor
+
+
+def _submit(job_id: str) -> None:
+    _get_executor().submit(_run_job, job_id)
+
+
+def _update_job(job_id: str, values: dict, *, only_status: Optional[str] = None) -> int:
+    values = {**values, "updated_at": datetime.utcnow()}
+    db = SessionLocal()
+    try:
+        query = db.query(ImportJobInDB).filter(ImportJobInDB.id == job_id)
+        if only_status is not None:
+            query = query.filter(ImportJobInDB.status == only_status)
+        count = query.update(values, synchronize_session=False)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def _remove_file(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def create_import_job(
+    db: Session,
+    *,
+    kind: str,
+    upload: IO[bytes],
+    file_name: str,
+    user_data: dict,
+    params: Optional[dict] = None,
+) -> ImportJobInDB:
+    """Сохраняет загруженный файл (частями) и ставит задачу в очередь."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown import job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    os.makedirs(IMPORT_JOBS_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_JOBS_DIR, job_id + (os.path.splitext(file_name)[1].lower() or ".xlsx"))
+    upload.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(upload, out, 1024 * 1024)
+
+    user = db.query(UserInDB).filter(UserInDB.email == user_data.get("sub")).first()
+    job = ImportJobInDB(
+        id=job_id,
+        kind=kind,
+        status="queued",
+        phase="queued",
+        file_name=file_name,
+        file_path=path,
+        params=jsonable_encoder(params or {}),
+        user_data=jsonable_encoder(user_data),
+        created_by=user.id if user else None,
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        _remove_file(path)
+        raise
+    db.refresh(job)
+
+    _submit(job_id)
+    return job
+
+
+def _job_user_data(db: Session, job: ImportJobInDB) -> dict:
+    """
+    user_data задачи с ролью автора из БД: задача может запуститься (или повториться после
+    перезапуска) через долгое время после постановки, права к этому моменту могли измениться.
+    """
+    query = db.query(UserInDB)
+    if job.created_by is not None:
+        user = query.filter(UserInDB.id == job.created_by).first()
+    else:
+        # created_by пуст (автор не найден при постановке или удалён) — по email из токена
+        user = query.filter(UserInDB.email == (job.user_data or {}).get("sub")).first()
+    if user is None or user.is_active != 1:
+        raise HTTPException(status_code=403, detail="The user who queued this import no longer has access")
+    return {**(job.user_data or {}), "sub": user.email, "type": user.type}
+
+
+def _run_job(job_id: str) -> None:
+    # Атомарный захват: задачу из очереди берёт ровно один поток (в любом из воркеров)
+    now = datetime.utcnow()
+    claimed = _update_job(
+        job_id,
+        {"status": "running", "phase": "parsing", "started_at": now, "attempts": ImportJobInDB.attempts + 1},
+        only_status="queued",
+    )
+    if not claimed:
+        return
+
+    heartbeat_stop = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(job_id, heartbeat_stop), name=f"import-job-heartbeat-{job_id}", daemon=True
+    ).start()
+    db = SessionLocal()
+    try:
+        job = db.query(ImportJobInDB).filter(ImportJobInDB.id == job_id).first()
+        kind, path, attempts = job.kind, job.file_path, job.attempts
+        params = dict(job.params or {})
+        handler = _handlers.get(kind)
+        try:
+            user_data = _job_user_data(db, job)
+            if handler is None:
+                raise HTTPException(status_code=500, detail=f"Unknown import job kind: {kind}")
+            if not path or not os.path.exists(path):
+                raise HTTPException(status_code=410, detail="Uploaded file is no longer available")
+            result = jsonable_encoder(handler(db, user_data, params, path, ImportJobProgress(job_id)))
+        except HTTPException as exc:
+            db.rollback()
+            if exc.status_code == 503 and attempts < IMPORT_JOB_MAX_ATTEMPTS:
+                _update_job(job_id, {"status": "queued", "phase": "queued"})
+                timer = threading.Timer(IMPORT_JOB_RETRY_DELAY_SECONDS, _submit, args=(job_id,))
+                timer.daemon = True
+                timer.start()
+                return
+            _finish_job(job_id, path, "failed", error={"status_code": exc.status_code, "detail": exc.detail})
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Import job %s failed", job_id)
+            _finish_job(job_id, path, "failed", error={"status_code": 500, "detail": str(exc)})
+        else:
+            _finish_job(
+                job_id,
+                path,
+                "succeeded",
+                phase="done",
+                result=result,
+                warnings=result.get("warnings") or [],
+                errors=result.get("errors") or [],
+                rows_processed=func.coalesce(ImportJobInDB.rows_total, ImportJobInDB.rows_processed),
+            )
+    finally:
+        heartbeat_stop.set()
+        db.close()
+
+
+def _heartbeat(job_id: str, stop: threading.Event) -> None:
+    # Отдельный поток: разбор в пуле процессов и запись в БД прогресс не обновляют
+    while not stop.wait(IMPORT_JOB_HEARTBEAT_SECONDS):
+        try:
+            _update_job(job_id, {}, only_status="running")
+        except Exception:
+            logger.warning("Failed to save heartbeat of import job %s", job_id, exc_info=True)
+
+
+def _finish_job(job_id: str, path: Optional[str], status: str, **values) -> None:
+    _update_job(job_id, {"status": status, "finished_at": datetime.utcnow(), "file_path": None, **values})
+    _remove_file(path)
+
+
+def _recover_import_jobs(queued_before: Optional[datetime]) -> None:
+    """
+    Задачи без heartbeat дольше IMPORT_JOB_STALE_SECONDS — снова в очередь (после
+    IMPORT_JOB_MAX_ATTEMPTS — failed); очередь (queued_before — только ждущие с тех пор) — в пул.
+    Повторная отправка безопасна: задачу захватывает один поток.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        stale = db.query(ImportJobInDB).filter(
+            ImportJobInDB.status == "running",
+            ImportJobInDB.updated_at < now - timedelta(seconds=IMPORT_JOB_STALE_SECONDS),
+        )
+        exhausted = stale.filter(ImportJobInDB.attempts >= IMPORT_JOB_MAX_ATTEMPTS)
+        exhausted_files = [path for (path,) in exhausted.with_entities(ImportJobInDB.file_path)]
+        exhausted.update({
+            "status": "failed",
+            "error": {"status_code": 500, "detail": "Import was interrupted too many times"},
+            "file_path": None,
+            "finished_at": now,
+            "updated_at": now,
+        }, synchronize_session=False)
+        retry = stale.filter(ImportJobInDB.attempts < IMPORT_JOB_MAX_ATTEMPTS)
+        requeued = [job_id for (job_id,) in retry.with_entities(ImportJobInDB.id)]
+        retry.update({"status": "queued", "phase": "queued", "updated_at": now}, synchronize_session=False)
+        db.query(ImportJobInDB).filter(
+            ImportJobInDB.status.in_(FINISHED_STATUSES),
+            ImportJobInDB.finished_at < now - timedelta(days=IMPORT_JOB_RETENTION_DAYS),
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        queued_query = db.query(ImportJobInDB.id).filter(ImportJobInDB.status == "queued")
+        if queued_before is not None:
+            queued_query = queued_query.filter(
+                or_(ImportJobInDB.id.in_(requeued), ImportJobInDB.updated_at < queued_before)
+            )
+        queued: List[str] = [job_id for (job_id,) in queued_query.order_by(ImportJobInDB.created_at)]
+    finally:
+        db.close()
+
+    for path in exhausted_files:
+        _remove_file(path)
+    for job_id in queued:
+        _submit(job_id)
+
+
+def _monitor_loop() -> None:
+    while not _monitor_stop.wait(IMPORT_JOB_STALE_SECONDS):
+        try:
+            _recover_import_jobs(datetime.utcnow() - timedelta(seconds=IMPORT_JOB_STALE_SECONDS))
+        except Exception:
+            logger.warning("Failed to recover stale import jobs", exc_info=True)
+
+
+def resume_import_jobs() -> None:
+    """
+    Старт воркера: зависшие задачи возвращаются в очередь, очередь отправляется в пул,
+    завершённые старше IMPORT_JOB_RETENTION_DAYS удаляются. Дальше то же — раз в
+    IMPORT_JOB_STALE_SECONDS в фоновом потоке (воркер другой задачи мог упасть и в это время).
+    """
+    global _monitor
+    _recover_import_jobs(None)
+    with _executor_lock:
+        if _monitor is None or not _monitor.is_alive():
+            _monitor_stop.clear()
+            _monitor = threading.Thread(target=_monitor_loop, name="import-job-monitor", daemon=True)
+            _monitor.start()
+
+
+def shutdown_import_jobs() -> None:
+    """Задачи из очереди остаются queued в БД и продолжатся после перезапуска."""
+    global _executor, _monitor
+    _monitor_stop.set()
+    with _executor_lock:
+        executor, _executor = _executor, None
+        _monitor = None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def import_job_payload(job: ImportJobInDB) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "phase": job.phase,
+        "file_name": job.file_name,
+        "rows_total": job.rows_total,
+        "rows_processed": job.rows_processed or 0,
+        "warnings": job.warnings or [],
+        "errors": job.errors or [],
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts or 0,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "updated_at": job.updated_at,
+    }
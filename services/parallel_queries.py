@@ -0,0 +1,40 @@
+"""
+Независимые запросы на чтение параллельно: каждый в своей сессии (своё соединение из пула)
+на общем ограниченном пуле потоков.
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from sqlalchemy.orm import Session
+
+from config import PARALLEL_QUERY_WORKERS, SessionLocal
+
+# Каждая задача держит одно соединение; эти потоки учтены в размере пула соединений (config.py)
+_executor = ThreadPoolExecutor(
+    max_workers=PARALLEL_QUERY_WORKERS,
+    thread_name_prefix="parallel-query",
+)
+
+
+def _run_in_session(task: Callable[[Session], Any]) -> Any:
+    db = SessionLocal()
+    try:
+        return task(db)
+    finally:
+        db.close()
+
+
+def run_queries_concurrently(tasks: Dict[str, Callable[[Session], Any]]) -> Dict[str, Any]:
+    """
+    Выполняет task(db) для каждой задачи в отдельной сессии и возвращает {имя: результат}.
+    Задачи должны возвращать обычные значения (не ORM-объекты своей сессии).
+    Первая ошибка пробрасывается после завершения остальных задач.
+    """
+    futures = {name: _executor.submit(_run_in_session, task) for name, task in tasks.items()}
+    errors = [future.exception() for future in futures.values()]
+    for error in errors:
+        if error is not None:
+            raise error
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,156 @@
+"""
+Общий пул процессов для CPU-тяжёлой работы: разбор Excel и генерация шаблонов.
+
+В пуле потоков такая работа держит GIL и тормозит остальные запросы воркера; в отдельных
+процессах она идёт параллельно на всех ядрах. Задачи — функции уровня модуля, аргументы
+и результаты — обычные picklable-значения (пути к файлам, списки, dict, bytes).
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Пул создаётся в каждом воркере uvicorn — по умолчанию не больше 4 процессов на воркер
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+PROCESS_POOL_TASK_TIMEOUT_SECONDS = float(os.getenv("PROCESS_POOL_TASK_TIMEOUT_SECONDS", "120"))
+# Back-pressure: не больше стольких задач в работе и в очереди; остальные ждут слот, затем 503
+PROCESS_POOL_MAX_PENDING = int(os.getenv("PROCESS_POOL_MAX_PENDING", str(PROCESS_POOL_WORKERS * 2)))
+PROCESS_POOL_QUEUE_WAIT_SECONDS = float(os.getenv("PROCESS_POOL_QUEUE_WAIT_SECONDS", "10"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PROCESS_POOL_MAX_PENDING)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: дочерние процессы не наследуют соединения БД и блокировки потоков родителя
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _discard_executor(broken: ProcessPoolExecutor) -> None:
+    """Упавший пул (процесс убит OOM-killer'ом и т.п.) заменяется новым при следующей задаче."""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _invoke(func: Callable, args: tuple, kwargs: dict) -> Tuple[bool, Any]:
+    # HTTPException не переживает pickle — передаём (status_code, detail)
+    try:
+        return True, func(*args, **kwargs)
+    except HTTPException as exc:
+        return False, (exc.status_code, exc.detail)
+
+
+def _noop() -> None:
+    return None
+
+
+def warm_process_pool() -> None:
+    """Запускает процессы пула заранее (без ожидания), чтобы первая загрузка не платила за старт."""
+    executor = _get_executor()
+    for _ in range(PROCESS_POOL_WORKERS):
+        executor.submit(_noop)
+
+
+def shutdown_process_pool() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(func: Callable, args: tuple, kwargs: dict) -> Tuple[Future, ProcessPoolExecutor]:
+    if not _slots.acquire(timeout=PROCESS_POOL_QUEUE_WAIT_SECONDS):
+        raise HTTPException(status_code=503, detail="Server is busy processing other files, please retry shortly")
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(_invoke, func, args, kwargs)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard_executor(executor)
+        raise HTTPException(status_code=503, detail="File processing is temporarily unavailable, please retry")
+    except Exception:
+        _slots.release()
+        raise
+    # Слот освобождается, когда задача действительно закончилась (в т.ч. после таймаута)
+    future.add_done_callback(lambda _: _slots.release())
+    return future, executor
+
+
+def _result(future: Future, executor: ProcessPoolExecutor, func: Callable, timeout: Optional[float]) -> Any:
+    try:
+        ok, value = future.result(timeout=timeout or PROCESS_POOL_TASK_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        future.cancel()
+        logger.warning("Process pool task %s timed out", getattr(func, "__name__", func))
+        raise HTTPException(status_code=504, detail="File processing took too long")
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise HTTPException(status_code=503, detail="File processing is temporarily unavailable, please retry")
+
+    if not ok:
+        status_code, detail = value
+        raise HTTPException(status_code=status_code, detail=detail)
+    return value
+
+
+def run_in_process(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Выполняет func(*args, **kwargs) в пуле процессов и возвращает результат.
+    HTTPException из задачи пробрасывается как есть; 503 — пул перегружен, 504 — превышено время.
+    """
+    future, executor = _submit(func, args, kwargs)
+    return _result(future, executor, func, timeout)
+
+
+def map_in_process(func: Callable, calls: Sequence[tuple], timeout: Optional[float] = None) -> List[Any]:
+    """
+    func(*args) для каждого набора аргументов из calls — параллельно на всех процессах пула.
+    Результаты в порядке calls; ошибка вызова не прерывает остальные — на её месте HTTPException.
+    Одновременно в пуле не больше PROCESS_POOL_MAX_PENDING задач (общий лимит с run_in_process).
+    """
+    submitted: List[Any] = []
+    for args in calls:
+        while True:
+            try:
+                submitted.append(_submit(func, args, {}))
+                break
+            except HTTPException as exc:
+                # Слоты заняты нашими же задачами — ждём, пока одна из них закончится
+                in_flight = [item[0] for item in submitted if isinstance(item, tuple) and not item[0].done()]
+                if exc.status_code != 503 or not in_flight:
+                    submitted.append(exc)
+                    break
+                wait(in_flight, return_when=FIRST_COMPLETED)
+
+    results: List[Any] = []
+    for item in submitted:
+        if isinstance(item, HTTPException):
+            results.append(item)
+            continue
+        try:
+            results.append(_result(*item, func, timeout))
+        except HTTPException as exc:
+            results.append(exc)
+    return results
@@ -0,0 +1,138 @@
+"""
+Справочные данные с кэшем в процессе: учебный год, веса прогноза, алиасы колонок Excel, предметы.
+Значения загружаются один раз и хранятся под версией, которую bump_reference_data_version()
+увеличивает после записи в routes/settings.py и routes/subjects.py; TTL ограничивает,
+как долго другой воркер может отдавать устаревшее значение.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache
+from config import get_db
+from schemas.models import ExcelColumnMapping, SubjectInDB
+from services.excel_parser import load_prediction_weights_from_db
+from services.school_year import get_current_academic_year
+
+_reference_cache = TTLCache(
+    maxsize=16,
+    ttl=float(os.getenv("REFERENCE_CACHE_TTL_SECONDS", "300")),
+)
+_reference_version = 0
+_reference_version_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class SubjectRef:
+    """Снимок строки subjects (без привязки к сессии)."""
+
+    id: int
+    name: str
+    applicable_parallels: Tuple[int, ...]
+    allows_subject_groups: bool
+    is_active: bool
+
+
+def bump_reference_data_version() -> None:
+    """
+    Invalidate cached reference data. Call after committing changes to system settings,
+    prediction weights, Excel column mappings or subjects.
+    """
+    global _reference_version
+    with _reference_version_lock:
+        _reference_version += 1
+
+
+def reference_data_cache_stats() -> dict:
+    return {**_reference_cache.stats(), "version": _reference_version}
+
+
+def _cached(name: str, db: Session, loader: Callable[[Session], object]) -> object:
+    key = (name, _reference_version)
+    value = _reference_cache.get(key)
+    if value is None:
+        value = loader(db)
+        # Под версией, прочитанной до загрузки: параллельный bump делает запись недостижимой
+        _reference_cache.set(key, value)
+    return value
+
+
+def _load_column_aliases(db: Session) -> Dict[str, Tuple[str, ...]]:
+    rows = db.query(ExcelColumnMapping.field_name, ExcelColumnMapping.column_aliases).filter(
+        ExcelColumnMapping.is_active == 1
+    ).all()
+    return {field_name: tuple(aliases) for field_name, aliases in rows if aliases}
+
+
+def _load_subjects(db: Session) -> Dict[int, SubjectRef]:
+    rows = db.query(
+        SubjectInDB.id,
+        SubjectInDB.name,
+        SubjectInDB.applicable_parallels,
+        SubjectInDB.allows_subject_groups,
+        SubjectInDB.is_active,
+    ).order_by(SubjectInDB.id).all()
+    return {
+        row.id: SubjectRef(
+            id=row.id,
+            name=row.name,
+            applicable_parallels=tuple(row.applicable_parallels or ()),
+            allows_subject_groups=bool(row.allows_subject_groups),
+            is_active=bool(row.is_active),
+        )
+        for row in rows
+    }
+
+
+def cached_academic_year(db: Session) -> str:
+    """Кэшированный get_current_academic_year."""
+    return _cached("academic_year", db, get_current_academic_year)
+
+
+def cached_prediction_weights(db: Session) -> Dict[str, float]:
+    """Кэшированный load_prediction_weights_from_db (копия, можно изменять)."""
+    return dict(_cached("prediction_weights", db, load_prediction_weights_from_db))
+
+
+def cached_excel_column_aliases(db: Session) -> Dict[str, List[str]]:
+    """Активные ExcelColumnMapping: field_name → column_aliases."""
+    aliases = _cached("excel_column_aliases", db, _load_column_aliases)
+    return {field_name: list(values) for field_name, values in aliases.items()}
+
+
+def cached_subjects(db: Session) -> List[SubjectRef]:
+    """Все предметы (включая неактивные) в порядке id."""
+    return list(_cached("subjects", db, _load_subjects).values())
+
+
+def cached_subject(db: Session, subject_id: Optional[int]) -> Optional[SubjectRef]:
+    if subject_id is None:
+        return None
+    return _cached("subjects", db, _load_subjects).get(subject_id)
+
+
+def cached_subject_by_name(db: Session, name: str) -> Optional[SubjectRef]:
+    for subject in _cached("subjects", db, _load_subjects).values():
+        if subject.name == name:
+            return subject
+    return None
+
+
+# FastAPI dependencies (тот же db, что и у обработчика: get_db кэшируется в рамках запроса)
+
+def current_academic_year(db: Session = Depends(get_db)) -> str:
+    return cached_academic_year(db)
+
+
+def prediction_weights(db: Session = Depends(get_db)) -> Dict[str, float]:
+    return cached_prediction_weights(db)
+
+
+def excel_column_aliases(db: Session = Depends(get_db)) -> Dict[str, List[str]]:
+    return cached_excel_column_aliases(db)
@@ -0,0 +1,193 @@
+"""
+Разбор списков учеников и учителей из Excel без обращения к БД — выполняется в пуле процессов
+(services/process_pool.py). Возвращает обычные списки; запись в БД остаётся в обработчиках.
+"""
+from __future__ import annotations
+
+import itertools
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import openpyxl
+from fastapi import HTTPException
+
+from key_utils import normalize_student_name
+from services.excel_stream import ExcelSource, ExcelWorkbook, column_names, find_header_row, row_value
+
+
+def _has_token(value: object, token: str) -> bool:
+    if value is None:
+        return False
+    text = str(value).strip().lower()
+    if not text or text == "nan":
+        return False
+    return token in text
+
+
+def _is_students_header_row(row: tuple) -> bool:
+    has_name = any(_has_token(v, "фио") for v in row)
+    has_class = any(_has_token(v, "класс") for v in row)
+    has_liter = any(_has_token(v, "литер") for v in row) or any(_has_token(v, "паралл") for v in row) or any(_has_token(v, "букв") for v in row)
+    return has_name and (has_class or has_liter)
+
+
+def parse_students_roster(source: ExcelSource) -> List[Tuple[int, str, str]]:
+    """
+    Список учеников: [(номер строки Excel, текст класса, ФИО)]; ФИО пустое — строка без имени.
+    Лист — первый, где в первых 30 строках есть заголовок с «ФИО» и «Класс»; иначе первый лист.
+    Пустые ячейки класса (объединённые ячейки) берут значение сверху.
+    """
+    try:
+        workbook = ExcelWorkbook(source)
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail=f"Failed to read Excel: {str(exc)}")
+
+    with workbook:
+        # Один проход: заголовок ищется в первых 30 строках листа, затем тот же итератор читает данные
+        header_row: Optional[int] = None
+        columns: List[str] = []
+        data_rows = None
+        try:
+            for sheet in workbook.sheet_names:
+                rows = workbook.rows(sheet)
+                found = find_header_row(rows, _is_students_header_row)
+                if found is None:
+                    continue
+                first_row = next(rows, None)
+                if first_row is None:
+                    continue
+                cols = [name.strip().lower() for name in column_names(found[1])]
+                has_name = any("фио" in c for c in cols)
+                has_class = any("класс" in c for c in cols)
+                if has_name and has_class:
+                    header_row = found[0]
+                    columns = column_names(found[1])
+                    data_rows = itertools.chain([first_row], rows)
+                    break
+
+            if data_rows is None:
+                rows = workbook.rows(workbook.sheet_names[0])
+                found = find_header_row(rows, _is_students_header_row)
+                if found is None:
+                    rows = workbook.rows(workbook.sheet_names[0])
+                    next(rows, None)
+                    header = next(rows, None)
+                    found = (1, header) if header is not None else None
+                if found is not None:
+                    header_row = found[0]
+                    columns = column_names(found[1])
+                    data_rows = rows
+            first_row = next(data_rows, None) if data_rows is not None else None
+        except Exception as exc:
+            raise HTTPException(status_code=400, detail=f"Failed to read Excel: {str(exc)}")
+
+        if first_row is None:
+            raise HTTPException(status_code=400, detail="Excel file has no data rows")
+        data_rows = itertools.chain([first_row], data_rows)
+
+        columns = [column.strip() for column in columns]
+
+        def find_column(predicate) -> Optional[int]:
+            return next((index for index, column in enumerate(columns) if predicate(column.lower())), None)
+
+        class_column = find_column(lambda c: "класс" in c and "литер" in c)
+        class_number_column = find_column(lambda c: "класс" in c and "литер" not in c and "паралл" not in c)
+        liter_column = find_column(lambda c: "литер" in c or "паралл" in c or "букв" in c)
+        name_column = find_column(lambda c: "фио" in c)
+
+        if name_column is None or (class_column is None and class_number_column is None):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Excel must contain student name and class columns. Expected 'ФИО' and either 'Класс и литер' or separate class columns. Available columns: {columns}"
+            )
+
+        # Handle merged cells in class columns: пустая ячейка берёт значение сверху
+        filled: Dict[int, object] = {}
+
+        def filled_value(row: tuple, index: Optional[int]) -> object:
+            if index is None:
+                return ""
+            value = row_value(row, index)
+            if value is not None and value != "":
+                filled[index] = value
+            return filled.get(index, "")
+
+        records: List[Tuple[int, str, str]] = []
+        for row_index, row in enumerate(data_rows):
+            if class_column is not None:
+                raw_class_value = filled_value(row, class_column)
+            else:
+                base_class = filled_value(row, class_number_column)
+                base_liter = filled_value(row, liter_column)
+                raw_class_value = f"{base_class}{base_liter}".strip()
+            student_name = normalize_student_name(row_value(row, name_column))
+            records.append((row_index + header_row + 2, str(raw_class_value), student_name or ""))
+        return records
+
+
+def parse_teachers_workbook(source: ExcelSource) -> dict:
+    """
+    Шаблон учителей: {"valid_subjects": [...], "rows": [(номер строки, ФИО, email, ячейка классов, предмет)]}.
+    Лист «Учителя»/«Teachers» (или активный), заголовок — строка с «ФИО» в первых 10 строках;
+    список предметов — лист «Предметы», если он есть. Пустые строки пропускаются.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    workbook = openpyxl.load_workbook(source, read_only=True)
+    try:
+        # Collect valid subjects from the reference sheet
+        valid_subjects: List[str] = []
+        for sname in ("Предметы", "предметы", "Subjects"):
+            if sname in workbook.sheetnames:
+                subj_sheet = workbook[sname]
+                for row in subj_sheet.iter_rows(min_row=2, values_only=True):
+                    val = row[0] if row else None
+                    if val and str(val).strip():
+                        valid_subjects.append(str(val).strip())
+                break
+
+        # Find the teachers data sheet (first sheet, or named "Учителя"/"Teachers")
+        sheet = workbook.active
+        for sname in ("Учителя", "учителя", "Teachers"):
+            if sname in workbook.sheetnames:
+                sheet = workbook[sname]
+                break
+
+        # Detect header row: find row containing "ФИО"
+        header_row_idx = 1
+        for check_row_idx, row in enumerate(sheet.iter_rows(min_row=1, max_row=10, values_only=True), start=1):
+            if row and any(cell and "фио" in str(cell).strip().lower() for cell in row):
+                header_row_idx = check_row_idx
+                break
+
+        # Build column index map from header
+        header_cells = next(sheet.iter_rows(min_row=header_row_idx, max_row=header_row_idx, values_only=True), ())
+        header = [str(c).strip().lower() if c else "" for c in header_cells]
+        col_map = {}
+        for idx, h in enumerate(header):
+            if "фио" in h or h == "имя" or h == "name":
+                col_map["fio"] = idx
+            elif "email" in h or "почта" in h or "e-mail" in h:
+                col_map["email"] = idx
+            elif "класс" in h or "class" in h:
+                col_map["classes"] = idx
+            elif "предмет" in h or "subject" in h:
+                col_map["subject"] = idx
+
+        if "fio" not in col_map or "email" not in col_map:
+            raise HTTPException(status_code=400, detail="Не найдены обязательные столбцы: ФИО и Email. Проверьте заголовки.")
+
+        rows = []
+        for row_idx, row in enumerate(sheet.iter_rows(min_row=header_row_idx + 1, values_only=True), start=header_row_idx + 1):
+            if not row or all(cell is None or str(cell).strip() == "" for cell in row):
+                continue
+
+            fio = str(row[col_map["fio"]]).strip() if col_map.get("fio") is not None and len(row) > col_map["fio"] and row[col_map["fio"]] else None
+            email = str(row[col_map["email"]]).strip().lower() if col_map.get("email") is not None and len(row) > col_map["email"] and row[col_map["email"]] else None
+            class_cell = row[col_map["classes"]] if col_map.get("classes") is not None and len(row) > col_map["classes"] else None
+            subject_cell = str(row[col_map["subject"]]).strip() if col_map.get("subject") is not None and len(row) > col_map["subject"] and row[col_map["subject"]] else None
+            rows.append((row_idx, fio, email, class_cell, subject_cell))
+
+        return {"valid_subjects": valid_subjects, "rows": rows}
+    finally:
+        workbook.close()
@@ -4,8 +4,10 @@
 from __future__ import annotations
 
 import re
-from typing import Optional, Tuple
+from datetime import datetime
+from typing import Optional
 
+from sqlalchemy import Integer, column, update, values
 from sqlalchemy.orm import Session
 
 from schemas.models import GradeInDB, StudentInDB, SystemSettingsInDB
@@ -28,99 +30,130 @@ def next_academic_year_label(current: str) -> str:
     return f"{y1 + 1}-{y2 + 1}"
 
 
-def _normalize_grade_key(grade_text: str, parallel_text: Optional[str]) -> Tuple[str, str, str]:
-    """Согласовано с routes.grades._normalize_grade_key"""
-    grade_raw = str(grade_text or "").strip()
-    parallel_raw = str(parallel_text or "").strip().upper()
-
-    compact_grade = re.sub(r"\s+", "", grade_raw)
-    match = re.match(
-        r"^(\d{1,2})([A-Za-zА-Яа-яЁёІіҢңҒғҚқӨөҰұҮүҺһ]?)$",
-        compact_grade,
-    )
-    if match:
-        num = match.group(1)
-        letter = (match.group(2) or parallel_raw).upper()
-        canonical = f"{num}{letter}" if letter else num
-        return canonical, num, letter
-
-    num_match = re.match(r"^(\d{1,2})", grade_raw)
-    if num_match:
-        num = num_match.group(1)
-        letter = parallel_raw
-        canonical = f"{num}{letter}" if letter else num
-        return canonical, num, letter
-
-    fallback = f"{grade_raw} {parallel_raw}".strip()
-    return fallback, grade_raw, parallel_raw
-
-
 def find_next_parallel_grade(db: Session, grade: GradeInDB) -> Optional[GradeInDB]:
     """
     Следующий параллельный класс с той же литерой (9А → 10А).
     Для 12 класса возвращает None (выпуск).
     """
-    _, num_str, letter = _normalize_grade_key(grade.grade, grade.parallel)
-    try:
-        n = int(num_str)
-    except (TypeError, ValueError):
-        return None
-    if n >= 12:
+    n = grade.parallel_number
+    if n is None or n >= 12:
         return None
-    next_n = n + 1
-    letter_u = (letter or "").upper()
-    for cg in db.query(GradeInDB).all():
-        _, ns, le = _normalize_grade_key(cg.grade, cg.parallel)
-        if ns == str(next_n) and (le or "").upper() == letter_u:
-            return cg
-    return None
+    return (
+        db.query(GradeInDB)
+        .filter(
+            GradeInDB.parallel_number == n + 1,
+            GradeInDB.letter == (grade.letter or ""),
+        )
+        .order_by(GradeInDB.id)
+        .first()
+    )
 
 
-def promote_all_students_to_next_grade(
-    db: Session,
-    *,
-    dry_run: bool
-) -> dict:
+def build_promotion_plan(db: Session) -> dict:
     """
-    Для каждого активного ученика: grade_id → следующий класс (та же литера).
-    Выпускники (12 класс) не меняют класс (остаются на записи; при необходимости отключите вручную).
+    План перевода всех активных учеников (та же литера, следующая параллель).
+    Соответствие «класс → следующий класс» строится один раз по всем классам;
+    moves — пары (from_grade_id, to_grade_id) для apply_promotion_plan.
     """
+    grades = db.query(GradeInDB.id, GradeInDB.parallel_number, GradeInDB.letter).order_by(GradeInDB.id).all()
+    first_by_key: dict = {}
+    for g in grades:
+        if g.parallel_number is not None:
+            first_by_key.setdefault((g.parallel_number, g.letter or ""), g.id)
+
+    # grade_id → (reason | None, next grade id | None, parallel)
+    targets: dict = {}
+    for g in grades:
+        n = g.parallel_number
+        if n is None:
+            targets[g.id] = ("bad_grade_format", None, n)
+        elif n >= 12:
+            targets[g.id] = ("graduated", None, n)
+        else:
+            nxt = first_by_key.get((n + 1, g.letter or ""))
+            targets[g.id] = (None, nxt, n) if nxt else ("no_next_class_row", None, n)
+
     promoted = 0
     graduated = 0
     missing_target: list[dict] = []
+    moves: dict = {}
 
-    students = db.query(StudentInDB).filter(StudentInDB.is_active == 1).all()
-    for st in students:
-        grade = db.query(GradeInDB).filter(GradeInDB.id == st.grade_id).first()
-        if not grade:
-            missing_target.append({"student_id": st.id, "reason": "grade_not_found"})
-            continue
-        _, num_str, _ = _normalize_grade_key(grade.grade, grade.parallel)
-        try:
-            n = int(num_str)
-        except (TypeError, ValueError):
-            missing_target.append({"student_id": st.id, "reason": "bad_grade_format"})
+    students = (
+        db.query(StudentInDB.id, StudentInDB.grade_id)
+        .filter(StudentInDB.is_active == 1)
+        .order_by(StudentInDB.id)
+        .all()
+    )
+    for student_id, grade_id in students:
+        target = targets.get(grade_id)
+        if target is None:
+            missing_target.append({"student_id": student_id, "reason": "grade_not_found"})
             continue
-        if n >= 12:
+        reason, next_grade_id, n = target
+        if reason == "graduated":
             graduated += 1
-            continue
-        nxt = find_next_parallel_grade(db, grade)
-        if not nxt:
+        elif reason == "no_next_class_row":
             missing_target.append(
                 {
-                    "student_id": st.id,
+                    "student_id": student_id,
                     "reason": "no_next_class_row",
-                    "from_grade_id": grade.id,
+                    "from_grade_id": grade_id,
                     "hint": f"Создайте класс {n + 1} с той же литерой или проверьте названия классов",
                 }
             )
-            continue
-        if not dry_run:
-            st.grade_id = nxt.id
-        promoted += 1
+        elif reason:
+            missing_target.append({"student_id": student_id, "reason": reason})
+        else:
+            moves[grade_id] = next_grade_id
+            promoted += 1
 
     return {
         "promoted": promoted,
         "graduated_unchanged": graduated,
         "issues": missing_target,
+        "moves": sorted(moves.items()),
+    }
+
+
+def apply_promotion_plan(db: Session, plan: dict) -> int:
+    """
+    Переводит учеников одним UPDATE ... FROM (VALUES (from_grade_id, to_grade_id), ...).
+    Все строки сравниваются со старым grade_id, поэтому цепочка 9А → 10А → 11А не «проскакивает».
+    Без commit; возвращает число обновлённых учеников.
+    """
+    if not plan["moves"]:
+        return 0
+    grade_moves = values(
+        column("from_grade_id", Integer),
+        column("to_grade_id", Integer),
+        name="grade_moves",
+    ).data(plan["moves"])
+    result = db.execute(
+        update(StudentInDB)
+        .where(
+            StudentInDB.grade_id == grade_moves.c.from_grade_id,
+            StudentInDB.is_active == 1,
+        )
+        .values(grade_id=grade_moves.c.to_grade_id, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def promote_all_students_to_next_grade(
+    db: Session,
+    *,
+    dry_run: bool
+) -> dict:
+    """
+    Для каждого активного ученика: grade_id → следующий класс (та же литера).
+    Выпускники (12 класс) не меняют класс (остаются на записи; при необходимости отключите вручную).
+    """
+    plan = build_promotion_plan(db)
+    if not dry_run:
+        apply_promotion_plan(db, plan)
+    return {
+        "promoted": plan["promoted"],
+        "graduated_unchanged": plan["graduated_unchanged"],
+        "issues": plan["issues"],
     }
@@ -0,0 +1,94 @@
+"""
+Пакетный пересчёт прогноза и риска для всех оценок: чтение порциями через серверный курсор,
+расчёт порции в NumPy, запись изменённых строк одним UPDATE ... FROM (VALUES ...) на порцию.
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import Float, Integer, Text, cast, column, select, update, values
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+
+from schemas.models import ScoresInDB
+from services.excel_parser import actual_scores_to_quarters, recalculate_predicted_and_danger_batch
+
+RECALC_CHUNK_SIZE = 2000
+
+
+def _write_predictions(db: Session, rows: List[tuple]) -> None:
+    """rows: (id, predicted_scores JSON, danger_level, delta_percentage)."""
+    new_values = values(
+        column("id", Integer),
+        column("predicted_scores", Text),
+        column("danger_level", Integer),
+        column("delta_percentage", Float),
+        name="recalculated",
+    ).data(rows)
+    db.execute(
+        update(ScoresInDB)
+        .where(ScoresInDB.id == new_values.c.id)
+        .values(
+            predicted_scores=cast(new_values.c.predicted_scores, JSONB),
+            danger_level=new_values.c.danger_level,
+            delta_percentage=new_values.c.delta_percentage,
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def recalculate_all_score_predictions(
+    db: Session,
+    weights: Dict[str, float],
+    chunk_size: int = RECALC_CHUNK_SIZE,
+) -> dict:
+    """
+    Пересчитывает predicted_scores / danger_level / delta_percentage у всех оценок с actual_scores
+    (как _sync_score_prediction_with_actual). Перезаписываются только изменившиеся строки; без commit.
+    """
+    stmt = (
+        select(
+            ScoresInDB.id,
+            ScoresInDB.actual_scores,
+            ScoresInDB.previous_class_score,
+            ScoresInDB.teacher_percent,
+            ScoresInDB.predicted_scores,
+            ScoresInDB.danger_level,
+            ScoresInDB.delta_percentage,
+        )
+        .where(ScoresInDB.actual_scores.isnot(None))
+        .order_by(ScoresInDB.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    updated_count = 0
+    changed_count = 0
+    for partition in db.execute(stmt).partitions():
+        rows = [row for row in partition if row.actual_scores]
+        if not rows:
+            continue
+        levels, danger_levels, deltas = recalculate_predicted_and_danger_batch(
+            [actual_scores_to_quarters(row.actual_scores) for row in rows],
+            [row.previous_class_score for row in rows],
+            [row.teacher_percent for row in rows],
+            weights,
+        )
+        updated_count += len(rows)
+
+        changed = []
+        for row, level, danger_level, delta in zip(rows, levels, danger_levels, deltas):
+            predicted = [level, level, level, level]
+            if (
+                row.predicted_scores != predicted
+                or row.danger_level != danger_level
+                or row.delta_percentage != delta
+            ):
+                changed.append((row.id, json.dumps(predicted), danger_level, delta))
+        if changed:
+            _write_predictions(db, changed)
+            changed_count += len(changed)
+
+    return {"updated_count": updated_count, "changed_count": changed_count}
@@ -0,0 +1,72 @@
+"""
+Запись оценок одним запросом: INSERT ... ON CONFLICT DO UPDATE по уникальному ключу
+uq_scores_identity (ученик / предмет / семестр / учебный год / subject_group).
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from schemas.models import ScoresInDB
+
+SCORE_IDENTITY_COLUMNS = ("student_id", "subject_id", "semester", "academic_year", "subject_group_id")
+
+# Выражения должны совпадать с индексом uq_scores_identity, иначе PostgreSQL его не выберет
+_CONFLICT_TARGET = [
+    ScoresInDB.student_id,
+    text("COALESCE(subject_id, 0)"),
+    ScoresInDB.semester,
+    ScoresInDB.academic_year,
+    text("COALESCE(subject_group_id, 0)"),
+]
+
+UPSERT_CHUNK_SIZE = 1000
+
+
+def score_identity(row: dict) -> tuple:
+    return tuple(row.get(col) for col in SCORE_IDENTITY_COLUMNS)
+
+
+def upsert_scores(
+    db: Session,
+    rows: Sequence[dict],
+    update_columns: Optional[Iterable[str]] = None,
+) -> List[int]:
+    """
+    Вставляет или обновляет строки scores (без commit). Каждая строка — словарь колонок
+    ScoresInDB, включая все колонки ключа; при повторе ключа в rows побеждает последняя.
+
+    update_columns — что перезаписывать у существующей строки
+    (по умолчанию все переданные колонки, кроме ключа). Возвращает id затронутых строк.
+    """
+    unique_rows: Dict[tuple, dict] = {}
+    for row in rows:
+        unique_rows[score_identity(row)] = row
+    if not unique_rows:
+        return []
+
+    now = datetime.utcnow()
+    payload = [{**row, "updated_at": now} for row in unique_rows.values()]
+    columns = set().union(*(row.keys() for row in payload))
+    for row in payload:
+        for col in columns:
+            row.setdefault(col, None)
+
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in SCORE_IDENTITY_COLUMNS and c != "created_at"]
+    else:
+        update_columns = [*update_columns, "updated_at"]
+
+    ids: List[int] = []
+    for start in range(0, len(payload), UPSERT_CHUNK_SIZE):
+        stmt = insert(ScoresInDB).values(payload[start:start + UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=_CONFLICT_TARGET,
+            set_={col: stmt.excluded[col] for col in update_columns},
+        ).returning(ScoresInDB.id)
+        ids.extend(db.execute(stmt).scalars().all())
+    return ids
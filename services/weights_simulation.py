@@ -0,0 +1,113 @@
+"""
+Симуляция весов прогноза: уровень ученика и danger_level по всем оценкам учебного года
+для текущих и предлагаемых весов за один проход в памяти, без записи в БД.
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from schemas.models import GradeInDB, ScoresInDB
+from services.excel_parser import actual_scores_to_quarters, recalculate_predicted_and_danger_batch
+
+_DANGER_LEVELS = (0, 1, 2, 3)
+
+
+def _distribution(danger: np.ndarray) -> Dict[str, int]:
+    counts = np.bincount(danger, minlength=len(_DANGER_LEVELS))
+    return {str(level): int(counts[level]) for level in _DANGER_LEVELS}
+
+
+def simulate_prediction_weights(
+    db: Session,
+    *,
+    academic_year: str,
+    current_weights: Dict[str, float],
+    candidate_weights: Dict[str, float],
+) -> dict:
+    """
+    Оценки с заполненными actual_scores (те же, что пересчитывает recalculate-predictions)
+    считаются дважды: с current_weights и с candidate_weights.
+    """
+    rows = (
+        db.query(
+            ScoresInDB.student_id,
+            ScoresInDB.grade_id,
+            ScoresInDB.subject_name,
+            ScoresInDB.actual_scores,
+            ScoresInDB.previous_class_score,
+            ScoresInDB.teacher_percent,
+        )
+        .filter(
+            ScoresInDB.academic_year == academic_year,
+            ScoresInDB.actual_scores.isnot(None),
+        )
+        .all()
+    )
+    rows = [row for row in rows if row.actual_scores]
+
+    result = {
+        "academic_year": academic_year,
+        "current_weights": current_weights,
+        "candidate_weights": candidate_weights,
+        "total_scores": len(rows),
+        "scores_level_changed": 0,
+        "scores_danger_changed": 0,
+        "students_total": 0,
+        "students_level_changed": 0,
+        "danger_distribution_current": _distribution(np.zeros(0, dtype=int)),
+        "danger_distribution_simulated": _distribution(np.zeros(0, dtype=int)),
+        "by_grade_subject": [],
+    }
+    if not rows:
+        return result
+
+    quarters = [actual_scores_to_quarters(row.actual_scores) for row in rows]
+    previous = [row.previous_class_score for row in rows]
+    teacher = [row.teacher_percent for row in rows]
+    current_level, current_danger, _ = recalculate_predicted_and_danger_batch(quarters, previous, teacher, current_weights)
+    simulated_level, simulated_danger, _ = recalculate_predicted_and_danger_batch(quarters, previous, teacher, candidate_weights)
+
+    frame = pd.DataFrame({
+        "student_id": [row.student_id for row in rows],
+        "grade_id": [row.grade_id for row in rows],
+        "subject_name": [row.subject_name for row in rows],
+        "current_level": current_level,
+        "simulated_level": simulated_level,
+        "current_danger": current_danger,
+        "simulated_danger": simulated_danger,
+    })
+    frame["level_changed"] = frame["current_level"] != frame["simulated_level"]
+    frame["danger_changed"] = frame["current_danger"] != frame["simulated_danger"]
+    changed_by_student = frame.groupby("student_id")["level_changed"].any()
+
+    result.update({
+        "scores_level_changed": int(frame["level_changed"].sum()),
+        "scores_danger_changed": int(frame["danger_changed"].sum()),
+        "students_total": int(changed_by_student.size),
+        "students_level_changed": int(changed_by_student.sum()),
+        "danger_distribution_current": _distribution(frame["current_danger"].to_numpy()),
+        "danger_distribution_simulated": _distribution(frame["simulated_danger"].to_numpy()),
+    })
+
+    grade_names = dict(
+        db.query(GradeInDB.id, GradeInDB.canonical_key)
+        .filter(GradeInDB.id.in_(frame["grade_id"].unique().tolist()))
+        .all()
+    )
+    by_group = []
+    for (grade_id, subject_name), group in frame.groupby(["grade_id", "subject_name"], sort=True):
+        by_group.append({
+            "grade_id": int(grade_id),
+            "grade": grade_names.get(int(grade_id)),
+            "subject_name": subject_name,
+            "scores": int(len(group)),
+            "current": _distribution(group["current_danger"].to_numpy()),
+            "simulated": _distribution(group["simulated_danger"].to_numpy()),
+            "danger_changed": int(group["danger_changed"].sum()),
+        })
+    result["by_grade_subject"] = by_group
+    return result